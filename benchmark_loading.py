@@ -0,0 +1,104 @@
+"""
+⏱️ Benchmark du chargement du dataset PHMEV
+Mesure le temps de chargement et le pic mémoire de chaque mode, chacun dans un processus neuf
+
+Usage : python benchmark_loading.py [chemin_parquet]
+"""
+
+import multiprocessing
+import os
+import sys
+import time
+
+
+def _load_full(path):
+    """Ancien chargement : toutes les colonnes du fichier"""
+    import pandas as pd
+    return pd.read_parquet(path, engine='pyarrow')
+
+
+def _load_projected(path):
+    """Chargement projeté sur le manifeste de colonnes"""
+    from phmev_dataset import read_projected_parquet
+    return read_projected_parquet(path)
+
+
+def _load_prepared(path):
+    """Fichier préparé (build_analytics_dataset.py) à côté de la source, sinon préparation à la volée"""
+    from phmev_dataset import PREPARED_FILENAME, prepare_dataframe, read_prepared_parquet, read_projected_parquet
+    prepared_path = os.path.join(os.path.dirname(path), PREPARED_FILENAME)
+    if os.path.exists(prepared_path):
+        return read_prepared_parquet(prepared_path)
+    return prepare_dataframe(read_projected_parquet(path))
+
+
+def _load_ipc(path):
+    """Copie Arrow IPC mappée en mémoire (écrite par build_analytics_dataset.py)"""
+    from phmev_dataset import PREPARED_FILENAME, load_phmev_dataframe
+    return load_phmev_dataframe(os.path.join(os.path.dirname(path), PREPARED_FILENAME), path)
+
+
+# Mode → fonction de chargement (exécutée dans un processus isolé)
+LOAD_MODES = {
+    'complet (toutes colonnes)': _load_full,
+    'projeté (manifeste)': _load_projected,
+    'préparé (analytics-ready)': _load_prepared,
+    'IPC mappé (memory_map)': _load_ipc,
+}
+
+
+def _peak_rss_bytes():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _measure(mode, path, queue):
+    """Exécuté dans le processus fils : temps et pic mémoire pour un mode"""
+    import pandas as pd  # noqa: F401 - import hors mesure
+    import pyarrow.parquet  # noqa: F401
+    from phmev_store import dataframe_memory_bytes
+    baseline = _peak_rss_bytes()
+    start = time.perf_counter()
+    df = LOAD_MODES[mode](path)
+    elapsed = time.perf_counter() - start
+    queue.put({
+        'mode': mode,
+        'seconds': elapsed,
+        'peak_bytes': _peak_rss_bytes() - baseline,
+        'frame_bytes': dataframe_memory_bytes(df),
+        'rows': len(df),
+        'columns': len(df.columns),
+    })
+
+
+def benchmark_loading(path, modes=None):
+    """Lance chaque mode dans un processus neuf et retourne les mesures"""
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for mode in modes or LOAD_MODES:
+        queue = ctx.Queue()
+        process = ctx.Process(target=_measure, args=(mode, path, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+    return results
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from phmev_dataset import default_parquet_path
+
+    parquet_path = sys.argv[1] if len(sys.argv) > 1 else default_parquet_path()
+    if not os.path.exists(parquet_path):
+        print(f"❌ Fichier non trouvé: {parquet_path}")
+        sys.exit(1)
+
+    print(f"⏱️ Benchmark de chargement: {parquet_path}")
+    print("=" * 78)
+    print(f"{'Mode':<28} {'Temps':>8} {'Pic mémoire':>13} {'DataFrame':>11} {'Lignes':>11} {'Col.':>5}")
+    print("-" * 78)
+    for r in benchmark_loading(parquet_path):
+        print(f"{r['mode']:<28} {r['seconds']:>7.2f}s {r['peak_bytes'] / 1024**2:>10,.0f} Mo "
+              f"{r['frame_bytes'] / 1024**2:>8,.0f} Mo {r['rows']:>11,} {r['columns']:>5}")
+    print("=" * 78)
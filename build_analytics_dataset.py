@@ -0,0 +1,67 @@
+"""
+🏗️ Construction du fichier PHMEV « analytics-ready »
+Nettoyage, colonnes dérivées, typage compact et tri ATC5 faits une fois hors ligne :
+le démarrage des applications se réduit ensuite à une lecture Parquet, ou à un memory_map
+de la copie Arrow IPC écrite à côté (.arrow), partagée entre processus Streamlit
+
+Usage : python build_analytics_dataset.py [source.parquet] [destination.parquet]
+        python build_analytics_dataset.py OPEN_PHMEV_2023.parquet --year 2023
+        (--year : écrit la partition OPEN_PHMEV/year=2023/ de la disposition multi-années)
+        python build_analytics_dataset.py --cube [--year 2023]
+        (--cube : recalcule seulement le cube établissement × CIP13 d'un fichier préparé existant)
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phmev_cube import build_cube_file, cube_path_for
+from phmev_dataset import (build_analytics_dataset, default_parquet_path, ipc_path_for, prepared_parquet_path,
+                           year_partition_path)
+
+
+def report_cube(output_path):
+    """🧊 Agrège le cube du fichier préparé et affiche sa taille"""
+    start = time.perf_counter()
+    cube = build_cube_file(output_path)
+    elapsed = time.perf_counter() - start
+    print(f"🧊 Cube: {len(cube):,} cellules pour {cube.source_rows:,} lignes (÷{cube.compression:,.1f}) "
+          f"dans {cube_path_for(output_path)} ({os.path.getsize(cube_path_for(output_path)) / 1024**2:,.1f} Mo) | ⏱️ {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    year = None
+    if '--year' in args:
+        position = args.index('--year')
+        year = int(args[position + 1])
+        del args[position:position + 2]
+    cube_only = '--cube' in args
+    if cube_only:
+        args.remove('--cube')
+
+    source_path = args[0] if len(args) > 0 else default_parquet_path()
+    default_output = year_partition_path(year) if year is not None else prepared_parquet_path()
+    output_path = args[1] if len(args) > 1 else default_output
+    if cube_only:
+        if not os.path.exists(output_path):
+            print(f"❌ Fichier préparé non trouvé: {output_path}")
+            sys.exit(1)
+        report_cube(output_path)
+        sys.exit(0)
+    if not os.path.exists(source_path):
+        print(f"❌ Fichier non trouvé: {source_path}")
+        sys.exit(1)
+
+    print(f"🏗️ Préparation de {source_path}")
+    start = time.perf_counter()
+    rows = build_analytics_dataset(source_path, output_path)
+    elapsed = time.perf_counter() - start
+
+    print(f"✅ {rows:,} lignes écrites dans {output_path}")
+    print(f"💾 Taille: {os.path.getsize(output_path) / 1024**2:,.1f} Mo | ⏱️ {elapsed:.1f}s")
+    print(f"🗺️ Copie IPC: {ipc_path_for(output_path)} ({os.path.getsize(ipc_path_for(output_path)) / 1024**2:,.1f} Mo)")
+    report_cube(output_path)
+    print("🚀 Les applications liront désormais ce fichier directement au démarrage.")
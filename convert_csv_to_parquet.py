@@ -0,0 +1,36 @@
+"""
+🌊 Conversion de l'export CSV OPEN_PHMEV en Parquet, en streaming
+Lecture bloc par bloc (latin1, « ; », décimaux français), types compacts, row groups écrits au fil de l'eau :
+la mémoire reste bornée, même pour le fichier national
+
+Usage : python convert_csv_to_parquet.py [source.CSV] [destination.parquet]
+"""
+
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phmev_dataset import convert_csv_to_parquet, default_csv_path, default_parquet_path
+
+
+if __name__ == "__main__":
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else default_csv_path()
+    parquet_path = sys.argv[2] if len(sys.argv) > 2 else default_parquet_path()
+    if not os.path.exists(csv_path):
+        print(f"❌ Fichier non trouvé: {csv_path}")
+        sys.exit(1)
+
+    print(f"🌊 Conversion de {csv_path} ({os.path.getsize(csv_path) / 1024**2:,.0f} Mo)")
+    start = time.perf_counter()
+    rows = convert_csv_to_parquet(csv_path, parquet_path)
+    elapsed = time.perf_counter() - start
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak = peak if sys.platform == 'darwin' else peak * 1024
+    print(f"✅ {rows:,} lignes écrites dans {parquet_path}")
+    print(f"💾 Taille: {os.path.getsize(parquet_path) / 1024**2:,.1f} Mo | ⏱️ {elapsed:.1f}s | "
+          f"Pic mémoire: {peak / 1024**2:,.0f} Mo")
+    print("💡 Étape suivante : python build_analytics_dataset.py")
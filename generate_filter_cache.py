@@ -9,6 +9,8 @@ from datetime import datetime
 from google.cloud import bigquery
 from google.oauth2 import service_account
 import pandas as pd
+from phmev_alias import AliasIndex, save_alias_cache
+from phmev_dataset import bigquery_table_version, resolve_bigquery_table
 
 def generate_filter_cache():
     """Génère et sauvegarde le cache des options de filtres"""
@@ -22,8 +24,16 @@ def generate_filter_cache():
         
         print("✅ Connexion BigQuery établie")
         
+        # Même table que l'application (partitionnée PHMEV si elle existe, sinon PHMEV2024) : même empreinte
+        table = resolve_bigquery_table(client, 'test-db-473321')
+        if table is None:
+            raise LookupError("Aucune table PHMEV trouvée dans test-db-473321.dataset")
+        table_ref = f"{table.project}.{table.dataset_id}.{table.table_id}"
+        fingerprint = bigquery_table_version(table)
+        print(f"📋 Table: {table_ref} ({fingerprint})")
+        
         # Requête pour récupérer toutes les options
-        query = """
+        query = f"""
         SELECT DISTINCT
             atc1, l_atc1,
             atc2, L_ATC2,
@@ -34,7 +44,7 @@ def generate_filter_cache():
             COALESCE(NULLIF(categorie_jur, ''), 'Non spécifiée') as categorie,
             COALESCE(NULLIF(nom_etb, ''), NULLIF(raison_sociale_etb, ''), 'Non spécifié') as etablissement,
             COALESCE(NULLIF(l_cip13, ''), 'Non spécifié') as medicament
-        FROM `test-db-473321.dataset.PHMEV2024`
+        FROM `{table_ref}`
         WHERE l_cip13 NOT IN ('Non restitué', 'Non spécifié', 'Honoraires de dispensation')
         AND l_cip13 IS NOT NULL
         """
@@ -82,11 +92,12 @@ def generate_filter_cache():
         options['medicaments'] = sorted(df['medicament'].dropna().unique().tolist())
         print(f"   ✅ Médicaments: {len(options['medicaments'])} options")
         
-        # Ajouter métadonnées
+        # Ajouter métadonnées (fingerprint : version de la table, comparée par l'application)
         options['_metadata'] = {
             'generated_at': datetime.now().isoformat(),
             'total_records': len(df),
-            'version': '1.0'
+            'version': '1.0',
+            'fingerprint': fingerprint
         }
         
         # Sauvegarder en JSON (lisible)
@@ -99,6 +110,22 @@ def generate_filter_cache():
             pickle.dump(options, f)
         print("✅ Cache pickle sauvegardé")
         
+        # Index d'alias : couples distincts CIP13 → l_cip13 → ATC5 → L_ATC5 (marques et molécules)
+        print("🏷️ Construction de l'index d'alias marque / molécule...")
+        alias_query = f"""
+        SELECT DISTINCT CAST(CIP13 AS STRING) as cip13, l_cip13, ATC5 as atc5, L_ATC5 as l_atc5
+        FROM `{table_ref}`
+        WHERE l_cip13 NOT IN ('Non restitué', 'Non spécifié', 'Honoraires de dispensation')
+        AND l_cip13 IS NOT NULL
+        """
+        alias_records = client.query(alias_query).to_dataframe().to_dict('list')
+        alias_index = AliasIndex(alias_records)
+        save_alias_cache(alias_records, {
+            'generated_at': options['_metadata']['generated_at'],
+            'fingerprint': options['_metadata']['fingerprint']
+        })
+        print(f"✅ Cache d'alias sauvegardé ({alias_index.n_records} CIP13)")
+        
         # Statistiques
         print("\n📊 Statistiques du cache généré:")
         print(f"   🧬 ATC1: {len(options.get('atc1', []))} options")
@@ -110,6 +137,8 @@ def generate_filter_cache():
         print(f"   🏥 Catégories: {len(options['categories'])} options")
         print(f"   🏢 Établissements: {len(options['etablissements'])} options")
         print(f"   💊 Médicaments: {len(options['medicaments'])} options")
+        print(f"   🏷️ Alias: {sum(kind == 'marque' for kind, *_ in alias_index.groups)} marques, "
+              f"{len(alias_index.molecule_groups)} molécules")
         
         # Vérifier si Cabometyx est présent
         cabometyx_found = [med for med in options['medicaments'] if 'cabometyx' in med.lower()]
@@ -0,0 +1,205 @@
+"""
+🏷️ Index d'alias marque / molécule déduit des données PHMEV
+Marque (début de l_cip13) → codes CIP13 → molécule ATC5 → L_ATC5, rangés dans un arbre de préfixes :
+« cabome » ou « cabozan » résout en O(longueur du préfixe) vers tous les médicaments concernés.
+Remplace la table d'abréviations écrite à la main ; régénéré avec le cache de filtres
+"""
+
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from phmev_search import normalize
+
+# Colonnes des couples distincts dont l'index est construit (cache : une liste par colonne)
+ALIAS_COLUMNS = ['cip13', 'l_cip13', 'atc5', 'l_atc5']
+
+# Fichiers générés par generate_filter_cache.py, à côté du cache des options de filtres
+ALIAS_CACHE_PICKLE = 'alias_index_cache.pkl'
+ALIAS_CACHE_JSON = 'alias_index_cache.json'
+
+# En dessous, un préfixe désigne trop de marques pour servir d'alias
+MIN_ALIAS_PREFIX = 3
+
+# Mot de molécule partagé par plus de molécules : pas un point d'entrée ('association', 'acide', 'sodique')
+MAX_WORD_MOLECULES = 10
+
+
+def brand_name(label):
+    """Marque d'un libellé CIP : mots normalisés avant le premier dosage ('CABOMETYX 20MG CPR 30' → 'cabometyx')"""
+    words = []
+    for word in normalize(label).split():
+        if any(ch.isdigit() for ch in word):
+            break
+        words.append(word)
+    return ' '.join(words)
+
+
+class PrefixTrie:
+    """🌲 Arbre de préfixes compressé (arêtes étiquetées par des chaînes) sur les clés triées
+
+    Chaque nœud couvre une plage contiguë des clés triées : une recherche descend d'arête en arête le
+    long du préfixe puis lit la plage, sans parcourir les clés — O(longueur du préfixe).
+    Un même identifiant peut avoir plusieurs clés ('acide folique' et 'folique' répondent à « foli »).
+    """
+
+    def __init__(self, items):
+        entries = sorted(set(items))
+        self.keys = [key for key, _ in entries]
+        self.ids = np.array([item_id for _, item_id in entries], dtype=np.int32)
+        # nœud → étiquette de l'arête entrante, {caractère: nœud enfant}, plage [début, fin) des clés
+        self._edges, self._children, self._ranges = [], [], []
+        self._build(0, len(self.keys), 0)
+
+    def _build(self, lo, hi, depth):
+        """Nœud des clés [lo, hi), qui partagent leurs `depth` premiers caractères"""
+        node = len(self._children)
+        self._edges.append('')
+        self._children.append({})
+        self._ranges.append((lo, hi))
+        start = lo
+        # Clés qui se terminent à ce nœud : en tête de plage (ordre trié)
+        while start < hi and len(self.keys[start]) == depth:
+            start += 1
+        while start < hi:
+            ch = self.keys[start][depth]
+            end = start + 1
+            while end < hi and self.keys[end][depth] == ch:
+                end += 1
+            first, last = self.keys[start], self.keys[end - 1]
+            common = depth + 1
+            while common < min(len(first), len(last)) and first[common] == last[common]:
+                common += 1
+            child = self._build(start, end, common)
+            self._edges[child] = first[depth:common]
+            self._children[node][ch] = child
+            start = end
+        return node
+
+    def __len__(self):
+        """Nombre de nœuds"""
+        return len(self._children)
+
+    def lookup(self, prefix):
+        """Identifiants (avec doublons) des clés qui commencent par `prefix` (normalisé)"""
+        node, i = 0, 0
+        while i < len(prefix):
+            node = self._children[node].get(prefix[i])
+            if node is None:
+                return self.ids[:0]
+            edge = self._edges[node]
+            segment = prefix[i:i + len(edge)]
+            if edge[:len(segment)] != segment:
+                return self.ids[:0]
+            i += len(edge)
+        lo, hi = self._ranges[node]
+        return self.ids[lo:hi]
+
+
+class AliasIndex:
+    """🏷️ Marques et molécules → libellés de médicaments (l_cip13), par préfixe
+
+    Une marque mène à sa molécule : « cabome » → CABOMETYX → CIP13 → ATC5 L01EX07 → CABOZANTINIB,
+    donc aussi aux autres spécialités de la même molécule.
+    """
+
+    def __init__(self, records):
+        records = pd.DataFrame(records, columns=ALIAS_COLUMNS).dropna(subset=['cip13', 'l_cip13'])
+        records = records.astype({'cip13': str}).drop_duplicates()
+        self.n_records = len(records)
+        # Chaîne marque → CIP13 → ATC5 → L_ATC5
+        cip_labels = dict(zip(records['cip13'], records['l_cip13']))
+        cip_atc5 = dict(records.dropna(subset=['atc5'])[['cip13', 'atc5']].itertuples(index=False, name=None))
+        molecules = dict(records.dropna(subset=['atc5', 'l_atc5'])[['atc5', 'l_atc5']].itertuples(index=False, name=None))
+        brands, atc5_cips = {}, {}
+        for cip, label in cip_labels.items():
+            brand = brand_name(label)
+            if brand:
+                brands.setdefault(brand, set()).add(cip)
+        for cip, atc5 in cip_atc5.items():
+            atc5_cips.setdefault(atc5, set()).add(cip)
+
+        # Groupes d'alias : (type, nom affiché, libellés de médicaments, codes ATC5)
+        self.groups = []
+        for brand, cips in sorted(brands.items()):
+            atc5_codes = frozenset(cip_atc5[cip] for cip in cips if cip in cip_atc5)
+            self.groups.append(('marque', brand.upper(), frozenset(cip_labels[cip] for cip in cips), atc5_codes))
+        # ATC5 → groupe de la molécule
+        self.molecule_groups = {}
+        for atc5, molecule in sorted(molecules.items()):
+            if atc5 in atc5_cips:
+                self.molecule_groups[atc5] = len(self.groups)
+                labels = frozenset(cip_labels[cip] for cip in atc5_cips[atc5])
+                self.groups.append(('molécule', molecule, labels, frozenset([atc5])))
+        # Marque : par son nom ; molécule : aussi par chacun de ses mots distinctifs (« paracetamol » → CODEINE + PARACETAMOL)
+        words = [normalize(name).split() for _, name, _, _ in self.groups]
+        shared = {}
+        for (kind, *_), group_words in zip(self.groups, words):
+            if kind == 'molécule':
+                for word in set(group_words):
+                    shared[word] = shared.get(word, 0) + 1
+        self.trie = PrefixTrie(
+            (' '.join(group_words[start:]), i)
+            for i, ((kind, *_), group_words) in enumerate(zip(self.groups, words))
+            for start in (range(len(group_words)) if kind == 'molécule' else [0])
+            if start == 0 or shared[group_words[start]] <= MAX_WORD_MOLECULES
+        )
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """Depuis un DataFrame PHMEV (colonnes CIP13, l_cip13, ATC5, L_ATC5), une ligne par couple distinct"""
+        columns = ['CIP13', 'l_cip13', 'ATC5', 'L_ATC5']
+        pairs = df[columns].drop_duplicates().astype(object).where(lambda d: d.notna(), None)
+        return cls(dict(zip(ALIAS_COLUMNS, (pairs[col].tolist() for col in columns))))
+
+    def __len__(self):
+        return len(self.groups)
+
+    def lookup(self, prefix):
+        """Groupes (type, nom, libellés, codes ATC5) : marques commençant par `prefix`, molécules dont un mot commence par `prefix`"""
+        prefix = normalize(prefix)
+        if len(prefix) < MIN_ALIAS_PREFIX:
+            return []
+        return [self.groups[i] for i in np.unique(self.trie.lookup(prefix))]
+
+    def molecules(self, prefix):
+        """Noms des molécules désignées par `prefix`, directement ou par une de leurs marques"""
+        atc5_codes = set().union(*(atc5 for _, _, _, atc5 in self.lookup(prefix)))
+        return sorted({self.groups[self.molecule_groups[code]][1] for code in atc5_codes if code in self.molecule_groups})
+
+    def resolve(self, prefix):
+        """💊 Libellés de médicaments des marques et molécules commençant par `prefix`, et de leurs molécules"""
+        labels, atc5_codes = set(), set()
+        for _, _, group_labels, group_atc5 in self.lookup(prefix):
+            labels |= group_labels
+            atc5_codes |= group_atc5
+        for code in atc5_codes:
+            if code in self.molecule_groups:
+                labels |= self.groups[self.molecule_groups[code]][2]
+        return labels
+
+
+def save_alias_cache(records, metadata, pickle_path=ALIAS_CACHE_PICKLE, json_path=ALIAS_CACHE_JSON):
+    """Enregistre les couples de l'index (JSON lisible + pickle rapide), avec l'empreinte des données"""
+    cache = {'records': records, '_metadata': metadata}
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+    with open(pickle_path, 'wb') as f:
+        pickle.dump(cache, f)
+
+
+def load_alias_cache(fingerprint=None, pickle_path=ALIAS_CACHE_PICKLE, json_path=ALIAS_CACHE_JSON):
+    """Couples enregistrés par generate_filter_cache.py s'ils sont de la même version des données, sinon None"""
+    cache = None
+    if os.path.exists(pickle_path):
+        with open(pickle_path, 'rb') as f:
+            cache = pickle.load(f)
+    elif os.path.exists(json_path):
+        with open(json_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    if cache is None or (fingerprint is not None and cache.get('_metadata', {}).get('fingerprint') != fingerprint):
+        return None
+    return cache['records']
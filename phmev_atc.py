@@ -0,0 +1,108 @@
+"""
+🌳 Arbre de la classification ATC (A → A01 → A01A → A01AA → A01AA01)
+Codes strictement préfixés : enfants, libellés et plages de lignes (dataset trié par ATC5) en O(enfants),
+partagé par toutes les variantes de l'application (pandas, DuckDB, BigQuery)
+"""
+
+import numpy as np
+import pandas as pd
+
+from phmev_schema import is_encoded, present_pairs
+
+# Niveaux ATC : (clé d'options, colonne code, colonne libellé, longueur du code)
+ATC_LEVELS = [
+    ('atc1', 'atc1', 'l_atc1', 1),
+    ('atc2', 'atc2', 'L_ATC2', 3),
+    ('atc3', 'atc3', 'L_ATC3', 4),
+    ('atc4', 'atc4', 'L_ATC4', 5),
+    ('atc5', 'ATC5', 'L_ATC5', 7),
+]
+
+ATC_LEVEL_KEYS = [level for level, *_ in ATC_LEVELS]
+
+
+class AtcTree:
+    """🌳 code → libellé, enfants et plage de lignes [début, fin) quand les lignes du code sont contiguës"""
+
+    def __init__(self, labels, row_ranges=None):
+        # niveau → {code: libellé} ; niveau → {code: (début, fin)}
+        self.labels = {level: dict(labels.get(level, {})) for level in ATC_LEVEL_KEYS}
+        self.row_ranges = {level: dict((row_ranges or {}).get(level, {})) for level in ATC_LEVEL_KEYS}
+        self._children = {}
+        for depth, level in enumerate(ATC_LEVEL_KEYS[1:], start=1):
+            parent_length = ATC_LEVELS[depth - 1][3]
+            for code in sorted(self.labels[level]):
+                self._children.setdefault(code[:parent_length], []).append(code)
+
+    @classmethod
+    def from_options(cls, options):
+        """Depuis des listes d'options {'atc1': [(code, libellé), ...], ...} (cache de filtres, requête SQL)"""
+        return cls({level: {code: label for code, label in options.get(level) or []
+                            if code is not None and label is not None}
+                    for level in ATC_LEVEL_KEYS})
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """Depuis le DataFrame chargé : couples (code, libellé) présents + plages de lignes contiguës"""
+        labels, row_ranges = {}, {}
+        for level, code_col, label_col, _ in ATC_LEVELS:
+            if code_col not in df.columns or label_col not in df.columns:
+                continue
+            labels[level] = present_pairs(df, code_col, label_col)
+            row_ranges[level] = contiguous_row_ranges(df[code_col])
+        return cls(labels, row_ranges)
+
+    def label(self, level, code):
+        return self.labels[level].get(code, code)
+
+    def children(self, codes):
+        """Codes enfants (niveau suivant) des codes donnés, triés"""
+        return sorted(child for code in codes for child in self._children.get(code, []))
+
+    def options(self, level, selected):
+        """📋 Options (code, libellé) d'un niveau : descendants des codes choisis au niveau le plus fin au-dessus
+
+        `selected` : {niveau: [codes]} ; sans sélection en amont, tous les codes du niveau.
+        """
+        depth = ATC_LEVEL_KEYS.index(level)
+        codes = None
+        for upper in reversed(ATC_LEVEL_KEYS[:depth]):
+            if selected.get(upper):
+                codes = list(selected[upper])
+                for _ in range(ATC_LEVEL_KEYS.index(upper), depth):
+                    codes = self.children(codes)
+                break
+        if codes is None:
+            codes = sorted(self.labels[level])
+        return [(code, self.labels[level][code]) for code in codes]
+
+    def rows(self, level, codes):
+        """⚡ Positions des lignes des codes (union de plages), None si une plage n'est pas contiguë"""
+        ranges = []
+        for code in set(codes):
+            if code not in self.labels[level]:
+                continue
+            if code not in self.row_ranges[level]:
+                return None
+            ranges.append(self.row_ranges[level][code])
+        if not ranges:
+            return np.array([], dtype=np.int64)
+        ranges.sort()
+        return np.concatenate([np.arange(start, end, dtype=np.int64) for start, end in ranges])
+
+
+def contiguous_row_ranges(series):
+    """{code: (début, fin)} des codes dont toutes les lignes sont consécutives (fichier trié par ATC5)"""
+    if is_encoded(series):
+        codes, categories = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        codes, categories = pd.factorize(series)
+    if len(codes) == 0:
+        return {}
+    # Début de chaque suite de codes identiques : un code contigu n'a qu'une seule suite
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    ends = np.r_[starts[1:], len(codes)]
+    run_codes = codes[starts]
+    runs_per_code = np.bincount(run_codes[run_codes >= 0], minlength=len(categories))
+    return {categories[c]: (int(s), int(e)) for c, s, e in zip(run_codes, starts, ends)
+            if c >= 0 and runs_per_code[c] == 1}
@@ -0,0 +1,143 @@
+"""
+♻️ Cache de résultats partagé par toutes les sessions du processus (KPIs, tops, facettes, sélections)
+Clé = état de filtres canonique (valeurs triées, listes vides ignorées) + version des données ;
+taille bornée en octets, éviction LRU, compteurs de hits/misses
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Budget mémoire par défaut du cache (Mo), surchargé par PHMEV_RESULT_CACHE_MB
+DEFAULT_MAX_MB = 256
+
+# Valeur absente du cache (None est un résultat valide : « toutes les lignes »)
+_MISSING = object()
+
+
+def canonical_filters(filters):
+    """🔑 État de filtres hashable et stable : clés triées, valeurs triées sans doublons, vides ignorés
+
+    {'ville': ['B', 'A', 'A'], 'categorie': [], 'min_boites': 5} → (('min_boites', 5), ('ville', ('A', 'B')))
+    """
+    items = []
+    for key, value in (filters or {}).items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set, frozenset)):
+            if not value:
+                continue
+            value = tuple(sorted(set(value), key=lambda v: (type(v).__name__, v)))
+        items.append((key, value))
+    return tuple(sorted(items))
+
+
+def result_nbytes(value):
+    """Taille mémoire approximative d'un résultat (DataFrame, tableau numpy, dict/list imbriqués)"""
+    if value is None:
+        return 0
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(result_nbytes(k) + result_nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(result_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """📦 Cache LRU borné en octets, thread-safe ; les résultats sont partagés, donc en lecture seule"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_MB * 1024**2):
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        # clé → (résultat, taille en octets), du moins au plus récemment utilisé
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Résultat mis en cache sous `key` (le marque comme le plus récent), sinon `default`"""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """Ajoute un résultat puis évince les plus anciens au-delà du budget ; trop gros, il n'est pas gardé"""
+        size = result_nbytes(value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            if size > self.max_bytes:
+                return value
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+        return value
+
+    def get_or_compute(self, key, compute):
+        """⚡ Résultat de `key`, calculé par `compute()` au premier appel (hors verrou) puis partagé"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.put(key, compute())
+        return value
+
+    def clear(self):
+        """Vide le cache (ex: bouton « Vider le cache ») ; les compteurs sont conservés"""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """📊 Entrées, octets, hits/misses/évictions et taux de succès"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Singleton du module : importé une seule fois par le serveur Streamlit, donc commun à toutes les sessions
+_CACHE = ResultCache(int(os.environ.get('PHMEV_RESULT_CACHE_MB', DEFAULT_MAX_MB)) * 1024**2)
+
+
+def get_result_cache():
+    """Retourne le cache de résultats partagé du processus"""
+    return _CACHE
+
+
+def cached_result(name, dataset_version, filters, compute, *params):
+    """♻️ Résultat `name` d'un état de filtres, partagé entre sessions pour une version des données"""
+    key = (name, dataset_version, canonical_filters(filters)) + params
+    return _CACHE.get_or_compute(key, compute)
@@ -0,0 +1,152 @@
+"""
+🕸️ Matrices d'incidence creuses entre dimensions du dataset PHMEV (CIP × établissement, ville, ATC5...)
+Une entrée par couple de valeurs présent dans les données, avec ses lignes, boîtes et REM : les options
+d'une dimension pour une sélection sur une autre se lisent en sommant quelques milliers d'entrées,
+au lieu de filtrer des millions de lignes
+"""
+
+import numpy as np
+import pandas as pd
+
+from phmev_schema import is_encoded
+
+# Couples de colonnes précalculés (les deux sens sont servis par la même matrice)
+COOCCURRENCE_PAIRS = [
+    ('libelle_cip', 'etablissement'),
+    ('libelle_cip', 'ville'),
+    ('etablissement', 'ville'),
+    ('ATC5', 'libelle_cip'),
+]
+
+# Mesures sommées par couple de valeurs (les lignes sont toujours comptées)
+COOCCURRENCE_MEASURES = ['BOITES', 'REM']
+
+
+def _codes(series):
+    """Codes entiers (-1 = NaN) et libellés d'une colonne, encodée ou non"""
+    if is_encoded(series):
+        return series.cat.codes.to_numpy().astype(np.int64), pd.Index(series.cat.categories)
+    codes, categories = pd.factorize(series)
+    return codes.astype(np.int64), pd.Index(categories)
+
+
+class IncidenceMatrix:
+    """Matrice creuse lignes × colonnes au format CSR : `indptr`, `indices` et une valeur par mesure
+
+    `order` (vue transposée) : positions des entrées dans les tableaux de mesures partagés avec la
+    matrice d'origine, pour ne pas dupliquer les sommes.
+    """
+
+    def __init__(self, row_labels, col_labels, indptr, indices, values, order=None):
+        self.row_labels = row_labels
+        self.col_labels = col_labels
+        self.indptr = indptr
+        self.indices = indices
+        # mesure → somme par entrée ('lignes' compris)
+        self.values = values
+        self.order = order
+
+    @classmethod
+    def build(cls, df, row_col, col_col, measures=COOCCURRENCE_MEASURES):
+        """Couples (valeur de row_col, valeur de col_col) présents, avec lignes et sommes des mesures"""
+        row_codes, row_labels = _codes(df[row_col])
+        col_codes, col_labels = _codes(df[col_col])
+        valid = (row_codes >= 0) & (col_codes >= 0)
+        keys = row_codes[valid] * len(col_labels) + col_codes[valid]
+        pairs, inverse = np.unique(keys, return_inverse=True)
+        values = {'lignes': np.bincount(inverse, minlength=len(pairs)).astype(np.int32)}
+        for measure in measures:
+            if measure in df.columns:
+                weights = df[measure].to_numpy()[valid]
+                sums = np.bincount(inverse, weights=weights, minlength=len(pairs))
+                # Centimes entiers : sommes float64 exactes jusqu'à 2**53, reconverties en int64
+                values[measure] = np.rint(sums).astype(np.int64) if np.issubdtype(weights.dtype, np.integer) else sums
+        rows = pairs // len(col_labels)
+        indptr = np.searchsorted(rows, np.arange(len(row_labels) + 1)).astype(np.int64)
+        indices = (pairs % len(col_labels)).astype(np.int32)
+        return cls(row_labels, col_labels, indptr, indices, values)
+
+    def transpose(self):
+        """Vue colonnes × lignes, mesures partagées (seuls les indices sont recopiés)"""
+        rows = np.repeat(np.arange(len(self.row_labels), dtype=np.int32), np.diff(self.indptr))
+        # Tri stable par colonne : dans chaque nouvelle ligne, les indices restent croissants
+        by_column = np.argsort(self.indices, kind='stable')
+        indptr = np.searchsorted(self.indices[by_column], np.arange(len(self.col_labels) + 1)).astype(np.int64)
+        order = (by_column if self.order is None else self.order[by_column]).astype(np.int32)
+        return IncidenceMatrix(self.col_labels, self.row_labels, indptr, rows[by_column], self.values, order)
+
+    def __len__(self):
+        """Nombre d'entrées non nulles"""
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        own = self.indptr.nbytes + self.indices.nbytes + (self.order.nbytes if self.order is not None else 0)
+        return own + (0 if self.order is not None else sum(v.nbytes for v in self.values.values()))
+
+    def product(self, values):
+        """⚡ Somme des lignes de la matrice pour les valeurs choisies (produit par un vecteur indicateur)
+
+        Même résultat que bincount_facet sur les lignes du dataset filtrées par ces valeurs :
+        DataFrame (lignes + mesures) indexé par les valeurs de colonne présentes.
+        """
+        codes = np.unique(self.row_labels.get_indexer(list(values)))
+        codes = codes[codes >= 0]
+        starts, ends = self.indptr[codes], self.indptr[codes + 1]
+        lengths = ends - starts
+        # Positions des entrées des lignes choisies, concaténées sans boucle Python
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        positions = np.arange(lengths.sum(), dtype=np.int64) + offsets
+        columns = self.indices[positions]
+        entries = positions if self.order is None else self.order[positions]
+        result = {}
+        for name, data in self.values.items():
+            weights = data[entries]
+            sums = np.bincount(columns, weights=weights, minlength=len(self.col_labels))
+            result[name] = np.rint(sums).astype(np.int64) if np.issubdtype(weights.dtype, np.integer) else sums
+        present = result['lignes'] > 0
+        return pd.DataFrame({name: sums[present] for name, sums in result.items()},
+                            index=pd.Index(np.asarray(self.col_labels)[present]))
+
+
+class CooccurrenceIndex:
+    """🕸️ Matrices d'incidence des couples de COOCCURRENCE_PAIRS, dans les deux sens ; en lecture seule"""
+
+    def __init__(self, n_rows, matrices):
+        self.n_rows = n_rows
+        # (colonne filtrée, colonne de la facette) → IncidenceMatrix
+        self._matrices = matrices
+
+    @classmethod
+    def build(cls, df, report=None, pairs=COOCCURRENCE_PAIRS, measures=COOCCURRENCE_MEASURES):
+        """Construit les matrices d'un DataFrame (colonnes absentes ignorées)"""
+        pairs = [(a, b) for a, b in pairs if a in df.columns and b in df.columns]
+        matrices = {}
+        for i, (row_col, col_col) in enumerate(pairs):
+            if report:
+                report(i / len(pairs), f"🕸️ Co-occurrences : {row_col} × {col_col}")
+            matrix = IncidenceMatrix.build(df, row_col, col_col, measures)
+            matrices[(row_col, col_col)] = matrix
+            matrices[(col_col, row_col)] = matrix.transpose()
+        return cls(len(df), matrices)
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def nbytes(self):
+        """Mémoire des matrices (rapport mémoire du store partagé)"""
+        return sum(m.nbytes for m in self._matrices.values())
+
+    def get(self, row_col, col_col):
+        """Matrice colonne filtrée → colonne de la facette (None si le couple n'est pas précalculé)"""
+        return self._matrices.get((row_col, col_col))
+
+    def facet(self, row_col, values, col_col):
+        """Facette de col_col pour les lignes dont row_col est dans `values` (None si non précalculée)"""
+        matrix = self.get(row_col, col_col)
+        if matrix is None:
+            return None
+        facet = matrix.product(values)
+        facet.index.name = col_col
+        return facet
@@ -0,0 +1,241 @@
+"""
+🧊 Cube OLAP pré-agrégé du dataset PHMEV
+Une cellule par (établissement × CIP13) avec les sommes BOITES / REM / BSE et le nombre de lignes brutes :
+les KPIs et les tops du tableau de bord (sommes, comptes distincts) y sont identiques aux lignes brutes,
+sur bien moins de lignes. Matérialisé à côté du fichier préparé (build_analytics_dataset.py) et en table
+BigQuery <table>_CUBE (upload_to_bigquery.py) ; le routeur n'y renvoie que les états de filtres qu'il sait servir
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from phmev_dataset import (DEFAULT_YEAR, YEAR_COLUMN, dataset_fingerprint, ipc_path_for, prepared_parquet_path,
+                           read_prepared_ipc, read_prepared_parquet, year_partition_path)
+from phmev_schema import FILTER_COLUMNS, encode_dimensions, isin_mask
+
+# Grain du cube : établissement (+ ville, catégorie qui en dépendent) × CIP13 (+ libellé et hiérarchie ATC)
+CUBE_DIMENSIONS = ['etablissement', 'ville', 'categorie', 'CIP13', 'code_cip', 'libelle_cip',
+                   'atc1', 'atc2', 'atc3', 'atc4', 'ATC5', 'L_ATC5']
+
+# Mesures sommées par cellule ; cout_par_boite sommé pour retrouver sa moyenne par ligne (÷ nb_lignes)
+CUBE_MEASURES = ['BOITES', 'REM', 'BSE', 'cout_par_boite']
+
+# Nombre de lignes brutes de chaque cellule
+ROW_COUNT_COLUMN = 'nb_lignes'
+
+# Filtres évalués ligne à ligne (seuil de boîtes d'une ligne) : les cellules ne permettent pas d'y répondre
+ROW_LEVEL_FILTERS = ['min_boites']
+
+# Version du format du cube (métadonnées Parquet / description de la table BigQuery)
+CUBE_FORMAT_VERSION = '1'
+
+# Colonnes brutes du cube BigQuery : celles qu'interrogent build_where_clause, les facettes et les tops
+BIGQUERY_CUBE_DIMENSIONS = ['atc1', 'l_atc1', 'atc2', 'L_ATC2', 'atc3', 'L_ATC3', 'atc4', 'L_ATC4', 'ATC5', 'L_ATC5',
+                            'CIP13', 'l_cip13', 'nom_etb', 'raison_sociale_etb', 'nom_ville', 'categorie_jur']
+
+
+def cube_path_for(parquet_path):
+    """Cube écrit à côté d'un fichier préparé : même nom suffixé de _cube"""
+    return os.path.splitext(parquet_path)[0] + '_cube.parquet'
+
+
+def prepared_path_for_year(year=DEFAULT_YEAR, root=None):
+    """Fichier préparé d'une année : sa partition si elle existe, sinon le fichier historique (2024)"""
+    path = year_partition_path(year, root)
+    if os.path.exists(path) or int(year) != DEFAULT_YEAR:
+        return path
+    return prepared_parquet_path()
+
+
+def build_cube(df, dimensions=None):
+    """🧊 Lignes brutes → cellules (dimensions présentes, sommes des mesures, nombre de lignes)"""
+    if dimensions is None:
+        dimensions = [col for col in [YEAR_COLUMN] + CUBE_DIMENSIONS if col in df.columns]
+    measures = [col for col in CUBE_MEASURES if col in df.columns]
+    # Valeurs manquantes gardées comme groupes : chaque ligne brute est comptée dans exactement une cellule
+    groups = df.groupby(dimensions, observed=True, dropna=False, sort=False)
+    cells = groups[measures].sum()
+    cells[ROW_COUNT_COLUMN] = groups.size().astype('int64')
+    return encode_dimensions(cells.reset_index())
+
+
+def row_count(frame):
+    """Nombre de lignes brutes représentées : somme de nb_lignes pour des cellules du cube, sinon len()"""
+    if ROW_COUNT_COLUMN in frame.columns:
+        return int(frame[ROW_COUNT_COLUMN].sum())
+    return len(frame)
+
+
+def with_row_counts(frame):
+    """Lignes brutes ou cellules avec une colonne nb_lignes (1 par ligne brute) pour les moyennes par ligne"""
+    if ROW_COUNT_COLUMN in frame.columns:
+        return frame
+    return frame.assign(**{ROW_COUNT_COLUMN: np.ones(len(frame), dtype=np.int64)})
+
+
+class PhmevCube:
+    """🧊 Cellules (établissement × CIP13) et routeur des états de filtres qu'elles savent servir
+
+    Sommes et comptes distincts d'établissements, de produits ou de molécules sont exacts sur les cellules
+    (chaque ligne brute appartient à une seule cellule) ; un seuil par ligne (min_boites) ne l'est pas.
+    """
+
+    def __init__(self, cells):
+        self.cells = cells
+        self.source_rows = row_count(cells)
+
+    @classmethod
+    def build(cls, df, report=None):
+        """Agrège un dataset en mémoire ; `report(fraction, message)` reçoit la progression"""
+        report = report or (lambda fraction, message: None)
+        report(0.1, "🧊 Agrégation du cube (établissement × CIP13)...")
+        return cls(build_cube(df))
+
+    @classmethod
+    def load_or_build(cls, df, prepared_path=None, report=None):
+        """Cube écrit par build_analytics_dataset.py s'il correspond au fichier préparé, sinon agrégé depuis df"""
+        if prepared_path is not None:
+            cube = read_cube(cube_path_for(prepared_path), prepared_path)
+            if cube is not None and cube.source_rows == len(df):
+                return cube
+        return cls.build(df, report)
+
+    def __len__(self):
+        return len(self.cells)
+
+    @property
+    def nbytes(self):
+        return int(self.cells.memory_usage(deep=True).sum())
+
+    @property
+    def compression(self):
+        """Lignes brutes par cellule"""
+        return self.source_rows / max(len(self.cells), 1)
+
+    def answers(self, current_filters, min_boites=0):
+        """🧭 True si l'état de filtres ne porte que sur des dimensions du cube (aucun seuil par ligne)"""
+        if min_boites or any(current_filters.get(key) for key in ROW_LEVEL_FILTERS):
+            return False
+        columns = dict(FILTER_COLUMNS)
+        columns['annee_filtre'] = YEAR_COLUMN
+        for filter_key, values in current_filters.items():
+            if values and filter_key in columns and columns[filter_key] not in self.cells.columns:
+                return False
+        return True
+
+    def filter(self, current_filters):
+        """Cellules de l'état de filtres (masques sur les codes entiers, comme get_filtered_dataframe)"""
+        mask = None
+        filter_columns = list(FILTER_COLUMNS)
+        if YEAR_COLUMN in self.cells.columns:
+            filter_columns.append(('annee_filtre', YEAR_COLUMN))
+        for filter_key, column in filter_columns:
+            values = current_filters.get(filter_key)
+            if values:
+                column_mask = isin_mask(self.cells[column], values)
+                mask = column_mask if mask is None else mask & column_mask
+        return self.cells if mask is None else self.cells[mask]
+
+
+def write_cube(cube, output_path, prepared_path):
+    """💾 Écrit les cellules en Parquet avec l'empreinte du fichier préparé dont elles sont issues"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(cube.cells, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        b'phmev_cube': CUBE_FORMAT_VERSION.encode(),
+        b'phmev_cube_source': dataset_fingerprint(prepared_path).encode(),
+    })
+    # Écriture atomique : une session ne lit jamais un cube à moitié écrit
+    tmp_path = output_path + '.tmp'
+    pq.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, output_path)
+    return len(cube)
+
+
+def read_cube(cube_path, prepared_path=None):
+    """📂 Cube écrit à côté de `prepared_path` ; None s'il manque ou n'est plus à jour (fichier reconstruit)"""
+    import pyarrow.parquet as pq
+
+    if not os.path.exists(cube_path):
+        return None
+    metadata = pq.read_schema(cube_path).metadata or {}
+    if metadata.get(b'phmev_cube') != CUBE_FORMAT_VERSION.encode():
+        return None
+    if prepared_path is not None and (
+            not os.path.exists(prepared_path)
+            or metadata.get(b'phmev_cube_source') != dataset_fingerprint(prepared_path).encode()):
+        return None
+    return PhmevCube(encode_dimensions(pq.read_table(cube_path).to_pandas()))
+
+
+def read_cubes(prepared_paths):
+    """📅 Cubes de plusieurs fichiers préparés {année: chemin} réunis (colonne year) ; None si l'un manque"""
+    frames = []
+    for year, prepared_path in prepared_paths.items():
+        cube = read_cube(cube_path_for(prepared_path), prepared_path)
+        if cube is None:
+            return None
+        cells = cube.cells
+        if year is not None and YEAR_COLUMN not in cells.columns:
+            cells = cells.assign(**{YEAR_COLUMN: int(year)})
+        frames.append(cells)
+    if not frames:
+        return None
+    if len(frames) == 1:
+        return PhmevCube(frames[0])
+    # Dictionnaires différents d'une année à l'autre : réencodés sur l'union des valeurs
+    cells = pd.concat([frame.astype({col: object for col in frame.columns if isinstance(frame[col].dtype, pd.CategoricalDtype)})
+                       for frame in frames], ignore_index=True)
+    return PhmevCube(encode_dimensions(cells))
+
+
+def build_cube_file(prepared_path=None):
+    """🏗️ Agrège le fichier préparé (copie IPC si elle existe) et écrit son cube à côté ; retourne le cube"""
+    prepared_path = prepared_path or prepared_parquet_path()
+    if os.path.exists(ipc_path_for(prepared_path)):
+        df = read_prepared_ipc(ipc_path_for(prepared_path))
+    else:
+        df = read_prepared_parquet(prepared_path)
+    cube = PhmevCube.build(df)
+    write_cube(cube, cube_path_for(prepared_path), prepared_path)
+    return cube
+
+
+def bigquery_cube_table(table):
+    """Table BigQuery du cube d'une table PHMEV : même identifiant suffixé de _CUBE"""
+    return f"{table}_CUBE"
+
+
+def bigquery_cube_description(source_version):
+    """Description de la table cube : version du format et version de la table source (bigquery_table_version)"""
+    return f"phmev_cube:{CUBE_FORMAT_VERSION}:{source_version}"
+
+
+def bigquery_cube_sql(source_table, source_version, partitioned=False, year_range=(2015, 2040)):
+    """🧊 CREATE TABLE du cube BigQuery : colonnes brutes conservées, donc mêmes clauses WHERE et GROUP BY
+
+    Seul COUNT(*) devient SUM(nb_lignes) dans les requêtes de l'application.
+    """
+    dimensions = ([YEAR_COLUMN] if partitioned else []) + BIGQUERY_CUBE_DIMENSIONS
+    partition = (f"PARTITION BY RANGE_BUCKET({YEAR_COLUMN}, GENERATE_ARRAY({year_range[0]}, {year_range[1]}, 1))"
+                 if partitioned else "")
+    description = bigquery_cube_description(source_version).replace("'", "\\'")
+    return f"""
+    CREATE OR REPLACE TABLE `{bigquery_cube_table(source_table)}`
+    {partition}
+    OPTIONS(description='{description}')
+    AS
+    SELECT
+        {', '.join(dimensions)},
+        SUM(BOITES) AS BOITES,
+        SUM(REM) AS REM,
+        SUM(BSE) AS BSE,
+        COUNT(*) AS {ROW_COUNT_COLUMN}
+    FROM `{source_table}`
+    GROUP BY {', '.join(dimensions)}
+    """
@@ -0,0 +1,481 @@
+"""
+📂 Lecture du dataset PHMEV
+Lectures Parquet projetées sur le manifeste de colonnes, fichier « analytics-ready » pré-calculé,
+copie Arrow IPC mappée en mémoire et partagée entre processus, lectures filtrées à la source
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from phmev_schema import (CENTS_PER_EURO, CENTS_RATIO_COLUMNS, DASHBOARD_COLUMNS, DERIVED_COLUMNS,
+                          DIMENSION_COLUMNS, FILTER_COLUMNS, MISSING_TEXT_VALUES, MONEY_COLUMNS,
+                          NON_INFORMATIVE_CIP_LABELS, encode_dimensions, ensure_cents, is_encoded,
+                          parse_french_decimal, to_cents)
+
+# Fichier source complet (3,504,612 lignes)
+PARQUET_FILENAME = 'OPEN_PHMEV_2024.parquet'
+
+# Export CSV brut (latin1, séparateur « ; », décimaux français)
+CSV_FILENAME = 'OPEN_PHMEV_2024.CSV'
+
+# Fichier préparé par build_analytics_dataset.py : nettoyé, typé, encodé, trié par ATC5
+PREPARED_FILENAME = 'OPEN_PHMEV_2024_analytics.parquet'
+
+# Disposition multi-années (Hive) : OPEN_PHMEV/year=2023/…, OPEN_PHMEV/year=2024/…
+PARTITIONS_DIRNAME = 'OPEN_PHMEV'
+YEAR_COLUMN = 'year'
+
+# Année du fichier historique OPEN_PHMEV_2024.parquet
+DEFAULT_YEAR = 2024
+
+# Version du format préparé (stockée dans les métadonnées Parquet) ; 2 : REM/BSE en centimes int64
+PREPARED_FORMAT_VERSION = '2'
+
+# Ordre de tri du fichier préparé : lignes d'une même molécule contiguës (row groups sélectifs)
+PREPARED_SORT_COLUMNS = ['ATC5', 'etablissement']
+
+# ~128k lignes par row group : statistiques min/max utiles sans multiplier les métadonnées
+PREPARED_ROW_GROUP_SIZE = 128 * 1024
+
+
+def _data_path(filename):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+
+
+def default_parquet_path():
+    """Chemin du fichier OPEN_PHMEV_2024.parquet à côté des scripts"""
+    return _data_path(PARQUET_FILENAME)
+
+
+def prepared_parquet_path():
+    """Chemin du fichier préparé OPEN_PHMEV_2024_analytics.parquet"""
+    return _data_path(PREPARED_FILENAME)
+
+
+def ipc_path_for(parquet_path):
+    """Copie Arrow IPC (Feather v2) écrite à côté d'un fichier préparé : même nom, extension .arrow"""
+    return os.path.splitext(parquet_path)[0] + '.arrow'
+
+
+def prepared_ipc_path():
+    """Chemin de la copie IPC OPEN_PHMEV_2024_analytics.arrow"""
+    return ipc_path_for(prepared_parquet_path())
+
+
+def partitions_root():
+    """Racine de la disposition partitionnée par année (OPEN_PHMEV/year=YYYY/)"""
+    return _data_path(PARTITIONS_DIRNAME)
+
+
+def year_partition_path(year, root=None):
+    """Fichier préparé d'une année : OPEN_PHMEV/year=YYYY/OPEN_PHMEV_YYYY_analytics.parquet"""
+    return os.path.join(root or partitions_root(), f"{YEAR_COLUMN}={int(year)}",
+                        f"OPEN_PHMEV_{int(year)}_analytics.parquet")
+
+
+def available_years(root=None):
+    """📅 Années présentes dans la disposition partitionnée (liste vide si elle n'existe pas)"""
+    root = root or partitions_root()
+    if not os.path.isdir(root):
+        return []
+    prefix = f"{YEAR_COLUMN}="
+    return sorted(int(name[len(prefix):]) for name in os.listdir(root)
+                  if name.startswith(prefix) and name[len(prefix):].isdigit()
+                  and os.path.exists(year_partition_path(name[len(prefix):], root)))
+
+
+def legacy_dataset_exists():
+    """True si le fichier historique de DEFAULT_YEAR (copie IPC, fichier préparé ou source brute) existe"""
+    return any(os.path.exists(path) for path in (prepared_ipc_path(), prepared_parquet_path(), default_parquet_path()))
+
+
+def selectable_years(root=None, legacy=None):
+    """📅 Années proposées : partitions + DEFAULT_YEAR tant que son fichier historique existe (même sans partition)
+
+    `legacy` : présence du fichier historique (détectée à côté des scripts si None).
+    """
+    years = set(available_years(root))
+    if legacy_dataset_exists() if legacy is None else legacy:
+        years.add(DEFAULT_YEAR)
+    return sorted(years)
+
+
+def partition_files(root=None, years=None):
+    """Fichiers Parquet des partitions (copies IPC .arrow exclues), éventuellement limités à `years`"""
+    root = root or partitions_root()
+    return [year_partition_path(year, root) for year in available_years(root)
+            if years is None or year in years]
+
+
+def default_csv_path():
+    """Chemin de l'export OPEN_PHMEV_2024.CSV à côté des scripts"""
+    return _data_path(CSV_FILENAME)
+
+
+def projected_columns(parquet_path, columns=None):
+    """Colonnes du manifeste (+ dérivées déjà présentes) effectivement disponibles dans le fichier"""
+    import pyarrow.parquet as pq
+
+    wanted = list(DASHBOARD_COLUMNS if columns is None else columns) + DERIVED_COLUMNS
+    available = set(pq.read_schema(parquet_path).names)
+    return [col for col in dict.fromkeys(wanted) if col in available]
+
+
+def read_projected_parquet(parquet_path=None, columns=None):
+    """🚀 Lit uniquement les colonnes utilisées par le dashboard (projection Parquet)"""
+    parquet_path = parquet_path or default_parquet_path()
+    return pd.read_parquet(parquet_path, engine='pyarrow', columns=projected_columns(parquet_path, columns))
+
+
+# Types compacts de l'export CSV ; toutes les autres colonnes sont lues comme texte
+CSV_INTEGER_COLUMNS = {'CIP13': 'int64', 'BOITES': 'int32', 'region_etb': 'int16'}
+CSV_DECIMAL_COLUMNS = ['REM', 'BSE']
+
+# Taille d'un bloc lu par le lecteur CSV incrémental (mémoire bornée à quelques blocs)
+CSV_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def _csv_header(csv_path, encoding):
+    with open(csv_path, 'r', encoding=encoding, newline='') as f:
+        return [name.strip().strip('"') for name in f.readline().rstrip('\r\n').split(';')]
+
+
+def convert_csv_to_parquet(csv_path, parquet_path, block_size=CSV_BLOCK_SIZE,
+                           row_group_size=PREPARED_ROW_GROUP_SIZE, encoding='latin1'):
+    """🌊 Convertit l'export CSV en Parquet bloc par bloc (lecteur CSV incrémental pyarrow)
+
+    Types fixés d'avance d'après l'en-tête : aucun bloc ne peut changer le schéma en cours de route.
+    REM/BSE (336.578,01) sont parsés par parse_french_decimal, les entiers castés en types compacts,
+    et chaque row group est écrit dès qu'il est plein : la mémoire ne dépend pas de la taille du fichier.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    import pyarrow.parquet as pq
+
+    header = _csv_header(csv_path, encoding)
+    column_types = {name: pa.string() for name in header}
+    column_types.update({name: pa.type_for_alias(alias) for name, alias in CSV_INTEGER_COLUMNS.items()
+                         if name in column_types})
+
+    reader = pv.open_csv(
+        csv_path,
+        read_options=pv.ReadOptions(encoding=encoding, block_size=block_size),
+        parse_options=pv.ParseOptions(delimiter=';'),
+        convert_options=pv.ConvertOptions(column_types=column_types, null_values=MISSING_TEXT_VALUES,
+                                          strings_can_be_null=True),
+    )
+
+    def convert_batch(batch):
+        columns = []
+        for name, column in zip(batch.schema.names, batch.columns):
+            if name in CSV_DECIMAL_COLUMNS:
+                column = pa.array(parse_french_decimal(column.to_pandas()), type=pa.float64())
+            columns.append(column)
+        return pa.RecordBatch.from_arrays(columns, names=batch.schema.names)
+
+    tmp_path = f"{parquet_path}.tmp"
+    rows, pending, pending_rows = 0, [], 0
+    writer = None
+    try:
+        for batch in reader:
+            batch = convert_batch(batch)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, batch.schema, compression='zstd', use_dictionary=True)
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            # Row groups écrits dès qu'ils sont pleins : seuls quelques blocs restent en mémoire
+            while pending_rows >= row_group_size:
+                table = pa.Table.from_batches(pending)
+                writer.write_table(table.slice(0, row_group_size), row_group_size=row_group_size)
+                pending = table.slice(row_group_size).to_batches()
+                pending_rows -= row_group_size
+                rows += row_group_size
+        if pending_rows:
+            writer.write_table(pa.Table.from_batches(pending), row_group_size=row_group_size)
+            rows += pending_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError(f"Fichier CSV vide: {csv_path}")
+    os.replace(tmp_path, parquet_path)
+    return rows
+
+
+def _coalesce_text(*series, default):
+    """Équivalent pandas de COALESCE(NULLIF(a, ''), NULLIF(b, ''), default)"""
+    result = None
+    for s in series:
+        s = s.astype(object).where(s.notna() & (s.astype(str) != ''), None)
+        result = s if result is None else result.where(result.notna(), s)
+    return result.fillna(default).astype(str)
+
+
+def prepare_dataframe(df):
+    """🧹 Nettoyage + colonnes dérivées (mêmes règles que les requêtes SQL DuckDB/BigQuery)"""
+    df = df[df['l_cip13'].notna() & ~df['l_cip13'].isin(NON_INFORMATIVE_CIP_LABELS)].copy()
+
+    etb_sources = [df[c] for c in ('nom_etb', 'raison_sociale_etb') if c in df.columns]
+    df['etablissement'] = _coalesce_text(*etb_sources, default='Non spécifié')
+    df['medicament'] = _coalesce_text(df['L_ATC5'], default='Non spécifié')
+    df['categorie'] = _coalesce_text(df['categorie_jur'], default='Non spécifiée')
+    df['ville'] = _coalesce_text(df['nom_ville'], default='Non spécifiée')
+    df['region'] = pd.to_numeric(df['region_etb'], errors='coerce').fillna(0).astype('int16')
+    df['code_cip'] = df['CIP13'].astype(str)
+    df['libelle_cip'] = _coalesce_text(df['l_cip13'], default='Non spécifié')
+
+    df['BOITES'] = pd.to_numeric(df['BOITES'], errors='coerce').fillna(0).astype('int32')
+    # Montants en centimes entiers : totaux exacts, 8 octets sans NaN (cout_par_boite en centimes par boîte)
+    rem = to_cents(df['REM'])
+    bse = to_cents(df['BSE'])
+    df['REM'], df['BSE'] = rem, bse
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['cout_par_boite'] = np.where(df['BOITES'] > 0, rem / df['BOITES'], 0)
+        df['taux_remboursement'] = np.where(bse > 0, rem / bse * 100, 0)
+
+    return encode_dimensions(df)
+
+
+def _prepared_table(df):
+    """Table Arrow triée par ATC5 et marquée comme préparée (métadonnées du schéma)"""
+    import pyarrow as pa
+
+    sort_columns = [col for col in PREPARED_SORT_COLUMNS if col in df.columns]
+    df = df.sort_values(sort_columns, kind='stable', ignore_index=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    return table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                          b'phmev_prepared': PREPARED_FORMAT_VERSION.encode()})
+
+
+def write_prepared_parquet(df, output_path, row_group_size=PREPARED_ROW_GROUP_SIZE):
+    """💾 Écrit le DataFrame préparé trié par ATC5, encodé en dictionnaire, compressé zstd"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = df if not isinstance(df, pd.DataFrame) else _prepared_table(df)
+    # Dimensions déclarées en texte dans le schéma (toujours encodées en dictionnaire sur disque) :
+    # pyarrow.dataset peut alors élaguer les row groups sur leurs statistiques min/max,
+    # ce qu'il ne fait pas sur un type dictionnaire
+    table = table.cast(pa.schema([
+        field.with_type(field.type.value_type) if pa.types.is_dictionary(field.type) else field
+        for field in table.schema
+    ], metadata=table.schema.metadata))
+    # Écriture atomique : les applications ne lisent jamais un fichier à moitié écrit
+    tmp_path = f"{output_path}.tmp"
+    pq.write_table(table, tmp_path, row_group_size=row_group_size, compression='zstd',
+                   use_dictionary=True, write_statistics=True)
+    os.replace(tmp_path, output_path)
+    return table.num_rows
+
+
+def write_prepared_ipc(df, output_path, batch_size=PREPARED_ROW_GROUP_SIZE):
+    """💾 Écrit la copie Arrow IPC non compressée : relue par memory_map sans décodage ni copie"""
+    import pyarrow as pa
+
+    table = df if not isinstance(df, pd.DataFrame) else _prepared_table(df)
+    tmp_path = f"{output_path}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=batch_size)
+    os.replace(tmp_path, output_path)
+    return table.num_rows
+
+
+def build_analytics_dataset(raw_path=None, output_path=None, row_group_size=PREPARED_ROW_GROUP_SIZE):
+    """🏗️ Source brute → fichier « analytics-ready » (nettoyé, typé, colonnes dérivées, trié) + copie IPC"""
+    output_path = output_path or prepared_parquet_path()
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    table = _prepared_table(prepare_dataframe(read_projected_parquet(raw_path)))
+    write_prepared_parquet(table, output_path, row_group_size)
+    return write_prepared_ipc(table, ipc_path_for(output_path), row_group_size)
+
+
+def is_prepared_parquet(parquet_path):
+    """True si le fichier a été écrit par build_analytics_dataset.py"""
+    import pyarrow.parquet as pq
+
+    metadata = pq.read_schema(parquet_path).metadata or {}
+    return metadata.get(b'phmev_prepared') == PREPARED_FORMAT_VERSION.encode()
+
+
+def read_prepared_parquet(parquet_path=None):
+    """⚡ Lecture pure I/O du fichier préparé (dimensions relues directement en dictionnaire)"""
+    import pyarrow.parquet as pq
+
+    parquet_path = parquet_path or prepared_parquet_path()
+    names = pq.read_schema(parquet_path).names
+    table = pq.read_table(parquet_path, read_dictionary=[col for col in DIMENSION_COLUMNS if col in names])
+    df = table.to_pandas()
+    # Dictionnaires dans l'ordre d'apparition → catégories triées, comme encode_dimensions()
+    for col in df.columns:
+        if is_encoded(df[col]) and not df[col].cat.categories.is_monotonic_increasing:
+            df[col] = df[col].cat.reorder_categories(df[col].cat.categories.sort_values())
+    return ensure_cents(df)
+
+
+def open_prepared_ipc(ipc_path=None):
+    """🗺️ Table Arrow mappée en mémoire : les pages du fichier sont partagées par tous les processus"""
+    import pyarrow as pa
+
+    source = pa.memory_map(ipc_path or prepared_ipc_path(), 'r')
+    return pa.ipc.open_file(source).read_all()
+
+
+def read_prepared_ipc(ipc_path=None):
+    """⚡ DataFrame adossé à la copie IPC (colonnes numériques sans nulls lues sans copie)"""
+    return ensure_cents(open_prepared_ipc(ipc_path).to_pandas(split_blocks=True, self_destruct=True))
+
+
+def load_phmev_dataframe(prepared_path=None, raw_path=None, report=None):
+    """📂 Copie IPC, sinon fichier préparé, sinon source brute projetée + préparation à la volée
+
+    `report(fraction, message)` reçoit la progression (chargement d'arrière-plan, voir phmev_store).
+    """
+    report = report or (lambda fraction, message: None)
+    prepared_path = prepared_path or prepared_parquet_path()
+    if os.path.exists(ipc_path_for(prepared_path)):
+        report(0.2, "🗺️ Ouverture de la copie Arrow mappée en mémoire...")
+        return read_prepared_ipc(ipc_path_for(prepared_path))
+    if os.path.exists(prepared_path):
+        report(0.2, "⚡ Lecture du fichier préparé...")
+        return read_prepared_parquet(prepared_path)
+    raw_path = raw_path or default_parquet_path()
+    if not os.path.exists(raw_path):
+        raise FileNotFoundError(f"Fichier {os.path.basename(raw_path)} non trouvé")
+    report(0.1, "🚀 Chargement des données PHMEV (3.5M lignes)...")
+    df = read_projected_parquet(raw_path)
+    report(0.6, "🔄 Création des colonnes dérivées...")
+    return prepare_dataframe(df)
+
+
+def load_year_dataframe(year, root=None, report=None):
+    """📅 Charge une seule année : sa partition si elle existe, sinon le fichier historique (2024)"""
+    prepared_path = year_partition_path(year, root)
+    if os.path.exists(prepared_path) or os.path.exists(ipc_path_for(prepared_path)):
+        return load_phmev_dataframe(prepared_path, report=report)
+    if int(year) == DEFAULT_YEAR:
+        return load_phmev_dataframe(report=report)
+    raise FileNotFoundError(f"Année {year} absente de {root or partitions_root()}")
+
+
+def dataset_fingerprint(path):
+    """🔖 Empreinte du contenu d'un fichier : hash du footer Parquet (lignes, row groups, statistiques, métadonnées)
+
+    Lecture de quelques Ko en fin de fichier, sans décoder de données. Un répertoire partitionné combine
+    les empreintes de ses partitions ; un fichier non Parquet (copie IPC seule) retombe sur taille + mtime.
+    """
+    digest = hashlib.sha1()
+    if os.path.isdir(path):
+        for file_path in partition_files(path):
+            digest.update(f"{os.path.relpath(file_path, path)}={dataset_fingerprint(file_path)};".encode())
+        return digest.hexdigest()[:16]
+    with open(path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        tail = b''
+        if size >= 12:
+            f.seek(size - 8)
+            tail = f.read(8)
+        if tail[4:] == b'PAR1' and int.from_bytes(tail[:4], 'little') <= size - 12:
+            footer_length = int.from_bytes(tail[:4], 'little')
+            f.seek(size - 8 - footer_length)
+            digest.update(f.read(footer_length))
+        else:
+            digest.update(str(os.stat(path).st_mtime_ns).encode())
+    digest.update(str(size).encode())
+    return digest.hexdigest()[:16]
+
+
+def bigquery_table_version(table):
+    """🔖 Version d'une table BigQuery : identifiant + date de dernière modification (métadonnées seules)"""
+    return f"{table.table_id}@{table.modified.isoformat()}"
+
+
+# Tables BigQuery par ordre de préférence : partitionnée par année (upload --year), sinon historique
+BIGQUERY_TABLE_IDS = ('PHMEV', 'PHMEV2024')
+
+
+def resolve_bigquery_table(client, project_id, dataset_id='dataset'):
+    """🔎 Table PHMEV interrogée (métadonnées BigQuery) : la première de BIGQUERY_TABLE_IDS qui existe, sinon None"""
+    for table_id in BIGQUERY_TABLE_IDS:
+        try:
+            return client.get_table(f"{project_id}.{dataset_id}.{table_id}")
+        except Exception:
+            continue
+    return None
+
+
+def source_fingerprint(year=DEFAULT_YEAR, root=None, raw_path=None):
+    """🔖 Empreinte de la source que chargerait load_year_dataframe(year) (None si aucune source)"""
+    prepared_path = year_partition_path(year, root)
+    if not (os.path.exists(prepared_path) or os.path.exists(ipc_path_for(prepared_path))):
+        if int(year) != DEFAULT_YEAR:
+            return None
+        prepared_path = prepared_parquet_path()
+    # Parquet et copie IPC sont écrits ensemble par build_analytics_dataset : le Parquet fait foi
+    for path in (prepared_path, ipc_path_for(prepared_path), raw_path or default_parquet_path()):
+        if os.path.exists(path):
+            return dataset_fingerprint(path)
+    return None
+
+
+def euros_select_sql(conn, source):
+    """🦆 SELECT DuckDB sur `source` avec les montants en euros (centimes entiers du fichier préparé ÷ 100)
+
+    Fichier d'un ancien format (montants déjà en euros) : SELECT * inchangé.
+    """
+    types = {row[0]: str(row[1]).upper() for row in conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()}
+    if not all('INT' in types.get(col, '') for col in MONEY_COLUMNS):
+        return f"SELECT * FROM {source}"
+    columns = [col for col in MONEY_COLUMNS + CENTS_RATIO_COLUMNS if col in types]
+    replace = ', '.join(f"{col} / {CENTS_PER_EURO} AS {col}" for col in columns)
+    return f"SELECT * REPLACE ({replace}) FROM {source}"
+
+
+def filter_expression(current_filters):
+    """🔎 Filtres actifs → expression pyarrow.dataset (None si aucun filtre)"""
+    import pyarrow.compute as pc
+
+    # Filtre d'année : porte sur la clé de partition, les répertoires des autres années ne sont pas lus
+    years = current_filters.get('annee_filtre')
+    expression = pc.field(YEAR_COLUMN).isin([int(y) for y in years]) if years else None
+    for filter_key, column in FILTER_COLUMNS:
+        values = current_filters.get(filter_key)
+        if values:
+            column_filter = pc.field(column).isin(list(values))
+            expression = column_filter if expression is None else expression & column_filter
+    return expression
+
+
+class LazyPhmevDataset:
+    """🪶 Dataset non chargé : les filtres sont poussés vers pyarrow.dataset à chaque lecture
+
+    Seuls les row groups dont les statistiques peuvent correspondre sont lus (fichier préparé trié
+    par ATC5), puis seules les lignes retenues sont décodées. Rien n'est conservé entre deux lectures.
+    `parquet_path` peut être la racine partitionnée par année : la colonne `year` vient alors du chemin.
+    """
+
+    def __init__(self, parquet_path=None, filters=None, dataset=None):
+        import pyarrow.dataset as ds
+
+        self.parquet_path = parquet_path or prepared_parquet_path()
+        if dataset is None and os.path.isdir(self.parquet_path):
+            dataset = ds.dataset(partition_files(self.parquet_path), format='parquet', partitioning='hive',
+                                 partition_base_dir=self.parquet_path)
+        self.dataset = dataset if dataset is not None else ds.dataset(self.parquet_path, format='parquet')
+        self.filters = dict(filters or {})
+
+    def filter(self, current_filters):
+        """Nouvelle vue avec les filtres actifs (aucune lecture)"""
+        return LazyPhmevDataset(self.parquet_path, {**self.filters, **current_filters}, self.dataset)
+
+    def scan(self, columns=None):
+        """Lit les lignes retenues par les filtres, restreintes aux colonnes demandées"""
+        if columns is not None:
+            columns = [col for col in dict.fromkeys(columns) if col in self.dataset.schema.names]
+        table = self.dataset.to_table(columns=columns, filter=filter_expression(self.filters))
+        return ensure_cents(encode_dimensions(table.to_pandas()))
+
+    def __len__(self):
+        return self.dataset.count_rows(filter=filter_expression(self.filters))
@@ -0,0 +1,127 @@
+"""
+🧮 Moteur de facettes du dataset PHMEV
+Pour un état de filtres : valeurs disponibles de chaque dimension + boîtes et montants, par bincount
+sur les codes entiers ; chaque dimension ignore son propre filtre (sémantique « exclude own dimension »)
+"""
+
+import numpy as np
+import pandas as pd
+
+from phmev_schema import FILTER_COLUMNS, NON_INFORMATIVE_CIP_LABELS, is_encoded, isin_mask
+
+# Filtre → colonne dont on compte les valeurs (codes ATC pour la hiérarchie, libellés ailleurs)
+FACET_COLUMNS = {
+    'atc1_filtre': 'atc1',
+    'atc2_filtre': 'atc2',
+    'atc3_filtre': 'atc3',
+    'atc4_filtre': 'atc4',
+    'atc5_filtre': 'ATC5',
+    'libelle_filtre': 'libelle_cip',
+    'ville_filtre': 'ville',
+    'categorie_filtre': 'categorie',
+    'etablissement_filtre': 'etablissement',
+}
+
+# Filtre → colonne filtrée (codes ATC, libellés ailleurs)
+FILTER_COLUMN_BY_KEY = dict(FILTER_COLUMNS)
+
+# Mesures sommées pour chaque valeur de facette
+FACET_MEASURES = ['BOITES', 'REM']
+
+
+def facet_groups(current_filters, facet_keys=None):
+    """Regroupe les facettes qui voient les mêmes lignes : filtres actifs moins le filtre de la facette
+
+    Sans filtre actif, une seule sélection (toutes les lignes) sert toutes les facettes ;
+    avec k filtres actifs, k + 1 sélections au plus.
+    """
+    facet_keys = list(FACET_COLUMNS) if facet_keys is None else facet_keys
+    active = [key for key, _ in FILTER_COLUMNS if current_filters.get(key)]
+    groups = {}
+    for key in facet_keys:
+        groups.setdefault(tuple(k for k in active if k != key), []).append(key)
+    return groups
+
+
+def selection_rows(df, current_filters, bitmap_index=None):
+    """Positions des lignes qui passent les filtres (None = toutes), par index bitmap ou masques isin"""
+    if bitmap_index is not None and len(bitmap_index) == len(df):
+        return bitmap_index.rows(current_filters)
+    mask = None
+    for filter_key, column in FILTER_COLUMNS:
+        values = current_filters.get(filter_key)
+        if values:
+            column_mask = isin_mask(df[column], values)
+            mask = column_mask if mask is None else mask & column_mask
+    return None if mask is None else np.flatnonzero(mask)
+
+
+def bincount_facet(df, column, rows=None, measures=FACET_MEASURES):
+    """Une facette : lignes et sommes des mesures par valeur présente, en un bincount sur les codes"""
+    series = df[column]
+    if is_encoded(series):
+        codes, categories = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        codes, categories = pd.factorize(series)
+    if rows is not None:
+        codes = codes[rows]
+    valid = codes >= 0
+    codes = codes[valid]
+    counts = np.bincount(codes, minlength=len(categories))
+    result = {'lignes': counts}
+    for measure in measures:
+        if measure in df.columns:
+            weights = df[measure].to_numpy()
+            weights = (weights if rows is None else weights[rows])[valid]
+            sums = np.bincount(codes, weights=weights, minlength=len(categories))
+            # Montants en centimes entiers : sommes float64 exactes jusqu'à 2**53, reconverties en int64
+            result[measure] = np.rint(sums).astype(np.int64) if np.issubdtype(weights.dtype, np.integer) else sums
+    present = counts > 0
+    return pd.DataFrame({name: values[present] for name, values in result.items()},
+                        index=pd.Index(np.asarray(categories)[present], name=column))
+
+
+def cooccurrence_facet(cooccurrence, group_filters, facet_key, measures=FACET_MEASURES):
+    """Facette lue dans une matrice de co-occurrence : un seul filtre actif et couple précalculé, sinon None"""
+    if cooccurrence is None or len(group_filters) != 1:
+        return None
+    (filter_key, values), = group_filters.items()
+    facet = cooccurrence.facet(FILTER_COLUMN_BY_KEY[filter_key], values, FACET_COLUMNS[facet_key])
+    return None if facet is None else facet[['lignes'] + [m for m in measures if m in facet.columns]]
+
+
+def compute_facets(df, current_filters, bitmap_index=None, facet_keys=None, measures=FACET_MEASURES,
+                   cooccurrence=None):
+    """⚡ Toutes les facettes d'un état de filtres : {filtre: DataFrame(lignes, BOITES, REM) indexé par valeur}
+
+    `df` : DataFrame en mémoire, ou vue LazyPhmevDataset (une lecture filtrée par groupe de facettes).
+    `cooccurrence` : CooccurrenceIndex (phmev_cooccurrence) ; une facette qui ne voit qu'un filtre actif
+    se lit alors dans la matrice du couple, sans sélectionner de lignes.
+    """
+    facets = {}
+    for others, keys in facet_groups(current_filters, facet_keys).items():
+        # Filtres de la facette : tous les autres filtres actifs, le sien vidé
+        group_filters = {key: current_filters[key] for key in others}
+        for key in keys:
+            facet = cooccurrence_facet(cooccurrence, group_filters, key, measures)
+            if facet is not None:
+                facets[key] = facet
+        keys = [key for key in keys if key not in facets]
+        if not keys:
+            continue
+        if hasattr(df, 'scan'):
+            view = df.filter({**{key: [] for key in keys}, **group_filters})
+            frame, rows = view.scan([FACET_COLUMNS[key] for key in keys] + list(measures)), None
+        else:
+            frame, rows = df, selection_rows(df, group_filters, bitmap_index)
+        for key in keys:
+            facets[key] = bincount_facet(frame, FACET_COLUMNS[key], rows, measures)
+    if 'libelle_filtre' in facets:
+        facet = facets['libelle_filtre']
+        facets['libelle_filtre'] = facet[~facet.index.isin(NON_INFORMATIVE_CIP_LABELS)]
+    return facets
+
+
+def format_boites(count):
+    """Suffixe affiché à côté d'une option : « (12,345 boîtes) »"""
+    return f"({int(count):,} boîtes)".replace(',', ' ')
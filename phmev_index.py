@@ -0,0 +1,226 @@
+"""
+🗂️ Index bitmap des dimensions filtrables du dataset PHMEV
+Un bitset compressé par valeur (code ATC, CIP, ville, catégorie, établissement), construit une fois au
+chargement : une combinaison de filtres se résout par OR (valeurs d'une dimension) puis AND (dimensions)
+"""
+
+import numpy as np
+import pandas as pd
+
+from phmev_atc import ATC_LEVELS
+from phmev_schema import FILTER_COLUMNS, is_encoded, isin_mask
+
+# Colonne de code ATC filtrée → niveau de l'arbre ATC
+ATC_CODE_LEVELS = {code_col: level for level, code_col, _, _ in ATC_LEVELS}
+
+# En dessous de 1 ligne sur 32, une liste de positions (4 octets/ligne) coûte moins qu'un bitmap (1 bit/ligne)
+SPARSE_RATIO = 32
+
+
+class Bitset:
+    """Lignes d'une valeur, dans le conteneur le plus compact (à la Roaring) :
+    'runs' (plages contiguës, dataset trié par ATC5), 'rows' (positions triées) ou 'bits' (bitmap packé)
+    """
+
+    __slots__ = ('kind', 'data', 'count', 'n_rows')
+
+    def __init__(self, kind, data, count, n_rows):
+        self.kind = kind
+        self.data = data
+        self.count = count
+        self.n_rows = n_rows
+
+    @classmethod
+    def from_rows(cls, rows, n_rows):
+        """Compresse des positions triées vers le conteneur le moins coûteux"""
+        breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+        n_runs = len(breaks) + 1
+        costs = {'runs': 8 * n_runs, 'rows': 4 * len(rows), 'bits': (n_rows + 7) // 8}
+        kind = min(costs, key=costs.get)
+        if kind == 'runs':
+            starts = rows[np.r_[0, breaks]]
+            ends = rows[np.r_[breaks - 1, len(rows) - 1]] + 1
+            data = (starts.astype(np.uint32), ends.astype(np.uint32))
+        elif kind == 'rows':
+            data = rows.astype(np.uint32)
+        else:
+            mask = np.zeros(n_rows, dtype=bool)
+            mask[rows] = True
+            data = np.packbits(mask)
+        return cls(kind, data, len(rows), n_rows)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.data) if self.kind == 'runs' else self.data.nbytes
+
+    def rows(self):
+        """Positions des lignes (int64 triées)"""
+        if self.kind == 'rows':
+            return self.data.astype(np.int64)
+        if self.kind == 'bits':
+            return np.flatnonzero(np.unpackbits(self.data, count=self.n_rows))
+        starts, ends = (a.astype(np.int64) for a in self.data)
+        lengths = ends - starts
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return np.arange(self.count, dtype=np.int64) + offsets
+
+    def fill(self, mask):
+        """OR en place dans un masque booléen de n_rows cases"""
+        if self.kind == 'bits':
+            mask |= np.unpackbits(self.data, count=self.n_rows).view(bool)
+        else:
+            mask[self.rows()] = True
+        return mask
+
+
+class BitmapIndex:
+    """📇 Bitsets par valeur des colonnes de FILTER_COLUMNS ; en lecture seule, partagé par les sessions"""
+
+    def __init__(self, n_rows, dimensions):
+        self.n_rows = n_rows
+        # colonne → (libellés, liste de Bitset indexée par code ; None si la valeur n'a aucune ligne)
+        self._dimensions = dimensions
+
+    @classmethod
+    def build(cls, df, report=None, columns=None):
+        """Construit l'index d'un DataFrame (codes de dictionnaire si la colonne est encodée)"""
+        columns = [col for _, col in FILTER_COLUMNS] if columns is None else columns
+        columns = [col for col in dict.fromkeys(columns) if col in df.columns]
+        n_rows = len(df)
+        dimensions = {}
+        for i, col in enumerate(columns):
+            if report:
+                report(i / len(columns), f"🗂️ Index bitmap : {col}")
+            series = df[col]
+            if is_encoded(series):
+                codes, categories = series.cat.codes.to_numpy(), series.cat.categories
+            else:
+                codes, categories = pd.factorize(series)
+            codes = codes.astype(np.int64)
+            # Tri stable : les positions de chaque code restent croissantes, le code -1 (NaN) vient en tête
+            order = np.argsort(codes, kind='stable')
+            counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+            bounds = np.cumsum(np.r_[np.count_nonzero(codes < 0), counts])
+            bitsets = [Bitset.from_rows(order[bounds[c]:bounds[c + 1]], n_rows) if counts[c] else None
+                       for c in range(len(categories))]
+            dimensions[col] = (pd.Index(categories), bitsets)
+        return cls(n_rows, dimensions)
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def nbytes(self):
+        """Mémoire des bitsets (rapport mémoire du store partagé)"""
+        return sum(b.nbytes for _, bitsets in self._dimensions.values() for b in bitsets if b is not None)
+
+    def columns(self):
+        return list(self._dimensions)
+
+    def bitsets(self, column, values):
+        """Bitsets des valeurs demandées (valeurs inconnues et doublons ignorés)"""
+        categories, bitsets = self._dimensions[column]
+        codes = np.unique(categories.get_indexer(list(values)))
+        return [bitsets[c] for c in codes if c >= 0 and bitsets[c] is not None]
+
+    def _union(self, column, values):
+        """OR des valeurs d'une dimension : positions si peu de lignes, sinon masque booléen"""
+        selected = self.bitsets(column, values)
+        count = sum(b.count for b in selected)
+        if count * SPARSE_RATIO < self.n_rows:
+            if len(selected) == 1:
+                return count, selected[0].rows()
+            rows = np.concatenate([b.rows() for b in selected]) if selected else np.array([], dtype=np.int64)
+            return count, np.sort(rows)
+        mask = np.zeros(self.n_rows, dtype=bool)
+        for b in selected:
+            b.fill(mask)
+        return count, mask
+
+    def select(self, column, values):
+        """Positions (triées) des lignes d'une dimension dont la valeur est dans `values`"""
+        _, selection = self._union(column, values)
+        return np.flatnonzero(selection) if selection.dtype == bool else selection
+
+    def rows(self, current_filters):
+        """⚡ Positions (triées) des lignes qui passent tous les filtres ; None si aucun filtre actif"""
+        selections = [self._union(column, values) for filter_key, column in FILTER_COLUMNS
+                      if (values := current_filters.get(filter_key)) and column in self._dimensions]
+        if not selections:
+            return None
+        # Dimension la plus sélective d'abord : les suivantes ne testent que ses positions
+        selections.sort(key=lambda s: s[0])
+        result = selections[0][1]
+        for _, selection in selections[1:]:
+            if result.dtype == bool:
+                # Toutes les sélections restantes sont des masques (triées par taille)
+                result = result & selection
+            elif selection.dtype == bool:
+                result = result[selection[result]]
+            else:
+                result = np.intersect1d(result, selection, assume_unique=True)
+        return np.flatnonzero(result) if result.dtype == bool else result
+
+    def mask(self, current_filters):
+        """Masque booléen équivalent à la chaîne de isin_mask (None si aucun filtre actif)"""
+        rows = self.rows(current_filters)
+        if rows is None:
+            return None
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[rows] = True
+        return mask
+
+
+class FilterCascade:
+    """🪜 Évaluation incrémentale des filtres interdépendants, dans l'ordre de FILTER_COLUMNS
+
+    Chaque niveau ne teste que les lignes retenues par le niveau précédent. `memo` (un dict conservé
+    d'une exécution à l'autre, ex: st.session_state) garde la sélection de chaque niveau avec la chaîne
+    de filtres qui l'a produite : un changement à l'ATC5 repart de la sélection ATC4 mémorisée.
+    """
+
+    def __init__(self, df, bitmap_index=None, memo=None, atc_tree=None):
+        self.df = df
+        self.bitmap_index = bitmap_index
+        # Arbre ATC (phmev_atc) : un niveau ATC se résout en plages de lignes tant que l'index n'est pas prêt
+        self.atc_tree = atc_tree
+        # profondeur → (chaîne des filtres jusqu'à ce niveau, positions retenues ou None = toutes)
+        self.memo = {} if memo is None else memo
+        self.hits = 0
+        self.misses = 0
+
+    def rows(self, current_filters):
+        """Positions des lignes qui passent tous les filtres (None = toutes), niveau par niveau"""
+        rows, chain = None, ()
+        for depth, (filter_key, column) in enumerate(FILTER_COLUMNS):
+            values = tuple(sorted(set(current_filters.get(filter_key) or ())))
+            chain += ((filter_key, values),)
+            if not values:
+                continue
+            cached = self.memo.get(depth)
+            if cached is not None and cached[0] == chain:
+                self.hits += 1
+                rows = cached[1]
+                continue
+            self.misses += 1
+            rows = self._narrow(column, values, rows)
+            # Un seul état par niveau : la mémoire reste bornée à une sélection par filtre
+            self.memo[depth] = (chain, rows)
+        return rows
+
+    def _narrow(self, column, values, rows):
+        if rows is None:
+            if self.bitmap_index is not None and column in self.bitmap_index.columns():
+                return self.bitmap_index.select(column, values)
+            level = ATC_CODE_LEVELS.get(column)
+            if self.atc_tree is not None and level is not None:
+                tree_rows = self.atc_tree.rows(level, values)
+                if tree_rows is not None:
+                    return tree_rows
+            return np.flatnonzero(isin_mask(self.df[column], values))
+        return rows[isin_mask(self.df[column], values, rows)]
+
+    def frame(self, current_filters):
+        """DataFrame filtré (mêmes lignes que la chaîne de isin_mask)"""
+        rows = self.rows(current_filters)
+        return self.df if rows is None else self.df.take(rows)
@@ -0,0 +1,204 @@
+"""
+🧬 Schéma et typage compact du dataset PHMEV
+Dimensions texte encodées en dictionnaire (codes entiers + libellés) pour filtrer et grouper sur des entiers
+"""
+
+import numpy as np
+import pandas as pd
+
+# 📋 Manifeste des colonnes du fichier OPEN_PHMEV réellement utilisées par les vues du dashboard
+DASHBOARD_COLUMNS = [
+    # Hiérarchie ATC (codes et libellés)
+    'atc1', 'l_atc1', 'atc2', 'L_ATC2', 'atc3', 'L_ATC3', 'atc4', 'L_ATC4', 'ATC5', 'L_ATC5',
+    # Médicament (code et libellé CIP13)
+    'CIP13', 'l_cip13',
+    # Établissement, catégorie juridique, géographie
+    'nom_etb', 'raison_sociale_etb', 'categorie_jur', 'nom_ville', 'region_etb',
+    # Mesures
+    'BOITES', 'REM', 'BSE',
+]
+
+# Colonnes dérivées, lues telles quelles si le fichier les contient déjà
+DERIVED_COLUMNS = [
+    'etablissement', 'medicament', 'categorie', 'ville', 'region', 'code_cip', 'libelle_cip',
+    'cout_par_boite', 'taux_remboursement',
+]
+
+# Correspondance filtre → colonne filtrée (ATC hiérarchiques, CIP, géographie, organisation)
+# Les filtres ATC portent sur les codes (courts, sans ambiguïté) ; les libellés ne servent qu'à l'affichage
+FILTER_COLUMNS = [
+    ('atc1_filtre', 'atc1'),
+    ('atc2_filtre', 'atc2'),
+    ('atc3_filtre', 'atc3'),
+    ('atc4_filtre', 'atc4'),
+    ('atc5_filtre', 'ATC5'),
+    ('libelle_filtre', 'libelle_cip'),
+    ('ville_filtre', 'ville'),
+    ('categorie_filtre', 'categorie'),
+    ('etablissement_filtre', 'etablissement'),
+]
+
+# Montants stockés en centimes entiers (int64) : sommes exactes, conversion en euros à l'affichage seulement
+MONEY_COLUMNS = ['REM', 'BSE']
+
+# Ratio dérivé des montants, exprimé lui aussi en centimes (centimes par boîte)
+CENTS_RATIO_COLUMNS = ['cout_par_boite']
+
+CENTS_PER_EURO = 100
+
+# Libellés CIP non informatifs, exclus de toutes les analyses
+NON_INFORMATIVE_CIP_LABELS = ['Non restitué', 'Non spécifié', 'Honoraires de dispensation']
+
+# Dimensions texte à forte répétition : une chaîne Python par ligne → un code entier par ligne
+DIMENSION_COLUMNS = [
+    # Hiérarchie ATC (codes et libellés)
+    'atc1', 'l_atc1', 'atc2', 'L_ATC2', 'atc3', 'L_ATC3', 'atc4', 'L_ATC4', 'ATC5', 'L_ATC5',
+    # Médicaments
+    'CIP13', 'l_cip13', 'code_cip', 'libelle_cip', 'medicament',
+    # Établissements et géographie
+    'nom_etb', 'raison_sociale_etb', 'etablissement', 'categorie_jur', 'categorie', 'nom_ville', 'ville',
+]
+
+
+def encode_dimensions(df, columns=None):
+    """🗜️ Convertit les dimensions texte en catégories (codes int8/int16/int32 + dictionnaire de libellés)"""
+    columns = DIMENSION_COLUMNS if columns is None else columns
+    for col in columns:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def is_encoded(series):
+    """True si la colonne est encodée en dictionnaire"""
+    return isinstance(series.dtype, pd.CategoricalDtype)
+
+
+def isin_mask(series, values, rows=None):
+    """⚡ Équivalent de series.isin(values) évalué sur les codes entiers (table de correspondance)
+
+    `rows` : positions à tester (masque de même longueur que rows), au lieu de toute la colonne.
+    """
+    if not is_encoded(series):
+        return (series if rows is None else series.iloc[rows]).isin(values).to_numpy()
+    categories = series.cat.categories
+    wanted = categories.get_indexer(list(values)) if len(values) else np.array([], dtype=np.intp)
+    # Dernière case = code -1 (valeur manquante), jamais sélectionnée
+    lookup = np.zeros(len(categories) + 1, dtype=bool)
+    lookup[wanted[wanted >= 0]] = True
+    codes = series.cat.codes.to_numpy()
+    return lookup[codes if rows is None else codes[rows]]
+
+
+def present_values(series):
+    """📋 Valeurs distinctes présentes (hors NaN), calculées par bincount sur les codes"""
+    if not is_encoded(series):
+        return series.dropna().unique().tolist()
+    codes = series.cat.codes.to_numpy()
+    counts = np.bincount(codes[codes >= 0], minlength=len(series.cat.categories))
+    return series.cat.categories[counts > 0].tolist()
+
+
+def present_pairs(df, code_col, label_col):
+    """📋 Couples (code, libellé) distincts présents, calculés sur les codes entiers"""
+    codes, labels = df[code_col], df[label_col]
+    if not (is_encoded(codes) and is_encoded(labels)):
+        return df[[code_col, label_col]].drop_duplicates().set_index(code_col)[label_col].dropna().to_dict()
+    c = codes.cat.codes.to_numpy().astype(np.int64)
+    l = labels.cat.codes.to_numpy().astype(np.int64)
+    valid = (c >= 0) & (l >= 0)
+    n_labels = len(labels.cat.categories)
+    pairs = np.unique(c[valid] * n_labels + l[valid])
+    code_values = codes.cat.categories[pairs // n_labels]
+    label_values = labels.cat.categories[pairs % n_labels]
+    return dict(zip(code_values, label_values))
+
+
+def to_cents(series):
+    """💶 Montants en euros (float, texte numérique) → centimes int64, arrondis au centime ; vides → 0
+
+    Les sommes pandas ignoraient déjà les NaN : un montant manquant compté 0 ne change aucun total.
+    """
+    values = pd.to_numeric(series, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    cents = np.rint(np.nan_to_num(values * CENTS_PER_EURO, nan=0.0)).astype(np.int64)
+    return pd.Series(cents, index=series.index, name=series.name)
+
+
+def ensure_cents(df):
+    """Convertit en place un DataFrame aux montants en euros (ancien format) vers les centimes"""
+    if all(col not in df.columns or pd.api.types.is_integer_dtype(df[col].dtype) for col in MONEY_COLUMNS):
+        return df
+    for col in MONEY_COLUMNS:
+        if col in df.columns:
+            df[col] = to_cents(df[col])
+    for col in CENTS_RATIO_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col] * CENTS_PER_EURO
+    return df
+
+
+def money_in_euros(df):
+    """Convertit en place les montants en centimes vers des euros float (export vers un outil externe)"""
+    if not any(col in df.columns and pd.api.types.is_integer_dtype(df[col].dtype) for col in MONEY_COLUMNS):
+        return df
+    for col in MONEY_COLUMNS + CENTS_RATIO_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col] / CENTS_PER_EURO
+    return df
+
+
+def cents_to_euros(value):
+    """Centimes (scalaire, Series ou tableau) → euros, pour l'affichage"""
+    return value / CENTS_PER_EURO
+
+
+# Valeurs textuelles considérées comme vides dans l'export CSV
+MISSING_TEXT_VALUES = ['', 'nan', 'NaN', 'NULL', 'null']
+
+# Montant « propre » une fois les milliers retirés et la virgule remplacée : -336578.01
+_PLAIN_DECIMAL = r'^-?[0-9]+(\.[0-9]+)?$'
+
+
+def _clean_french_number(x):
+    """Règle historique, appliquée uniquement aux rares valeurs irrégulières"""
+    if ',' in x:
+        parts = x.split(',')
+        if len(parts) == 2:
+            return f"{parts[0].replace('.', '')}.{parts[1]}"
+    return x.replace('.', '') if '.' in x else x
+
+
+def parse_french_decimal(series):
+    """💶 Convertit les décimaux français (336.578,01 → 336578.01) en float, de façon vectorisée (pyarrow)
+
+    Même résultat que l'ancien convert_french_decimal() : avec une virgule, les points de la partie
+    entière sont des séparateurs de milliers ; sans virgule, tous les points sont des milliers ;
+    vides et NULL → NaN.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return pd.to_numeric(series, errors='coerce')
+
+    text = pc.utf8_trim_whitespace(pa.array(series.astype('string[pyarrow]')))
+    missing = pc.or_(pc.is_null(text), pc.is_in(text, value_set=pa.array(MISSING_TEXT_VALUES)))
+
+    # Cas général (≈ toutes les lignes) : retrait des points, virgule → point, cast Arrow natif
+    normalized = pc.replace_substring(pc.replace_substring(text, '.', ''), ',', '.')
+    plain = pc.and_(
+        pc.fill_null(pc.match_substring_regex(normalized, _PLAIN_DECIMAL), False),
+        # « 1,2.3 » : un point après la virgule n'est pas un séparateur de milliers
+        pc.invert(pc.fill_null(pc.match_substring_regex(text, r',.*\.'), False)),
+    )
+    plain = pc.and_(plain, pc.invert(missing))
+    values = pc.cast(pc.if_else(plain, normalized, pa.scalar(None, pa.string())), pa.float64())
+    result = values.to_numpy(zero_copy_only=False).copy()
+
+    # Valeurs irrégulières (1e5, 1,2,3, abc…) : règle historique + pd.to_numeric, ligne à ligne
+    irregular = np.flatnonzero(~(plain.to_numpy(zero_copy_only=False) | missing.to_numpy(zero_copy_only=False)))
+    if len(irregular):
+        raw = text.take(pa.array(irregular)).to_pylist()
+        result[irregular] = pd.to_numeric(pd.Series([_clean_french_number(x) for x in raw], dtype=object),
+                                          errors='coerce')
+    return pd.Series(result, index=series.index, name=series.name)
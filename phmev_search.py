@@ -0,0 +1,312 @@
+"""
+🔎 Recherche dans les libellés du dataset PHMEV (médicaments, établissements, villes)
+Index inversé de trigrammes construit une fois par version des données : « libellés contenant X » =
+intersection des listes de positions des trigrammes de X, puis vérification sur les seuls candidats.
+Libellés normalisés à l'indexation (accents, casse, ponctuation) ; fautes de frappe rattrapées par
+distance d'édition bornée sur le vocabulaire des mots, candidats choisis par trigrammes communs.
+Au fil de la frappe (« c », « ca », « cab »…), chaque recherche ne filtre que les résultats de la précédente
+"""
+
+import heapq
+import re
+import unicodedata
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+from phmev_cache import ResultCache
+
+# Longueur des n-grammes indexés
+NGRAM = 3
+
+# Mots vérifiés par distance d'édition, par mot de la recherche (les plus proches en trigrammes)
+FUZZY_CANDIDATES = 64
+
+# Préfixes partagés entre sessions : recherches courtes (tapées par tous), budget mémoire par index (Mo)
+SHARED_PREFIX_LENGTH = 6
+PREFIX_CACHE_MB = 16
+
+_EMPTY = np.array([], dtype=np.int32)
+_PUNCTUATION = re.compile(r"[^\w%]+")
+
+
+def normalize(text):
+    """Forme comparée des libellés et des recherches : sans accents, casse repliée, ponctuation → espace
+
+    'HÔPITAL Saint-Éloi (C.H.)' → 'hopital saint eloi c h'
+    """
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    return ' '.join(_PUNCTUATION.sub(' ', text).split())
+
+
+def trigrams(text):
+    """Trigrammes distincts d'un texte normalisé"""
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+def max_typos(word):
+    """Fautes tolérées selon la longueur du mot : aucune sous 5 lettres (trop de voisins), 1 jusqu'à 8, 2 au-delà"""
+    return 0 if len(word) < 5 else 1 if len(word) < 9 else 2
+
+
+def prefix_distance(word, token, max_distance):
+    """Distance d'édition (avec transpositions) entre `word` et le meilleur préfixe de `token`
+
+    Saisie en cours : 'cabomet' est à 0 de 'cabometyx', 'cabomteyx' à 1. Calcul limité à la bande
+    |i - j| <= max_distance ; au-delà de `max_distance`, retourne max_distance + 1 sans finir le calcul.
+    """
+    k = max_distance
+    token = token[:len(word) + k]
+    outside = k + 1
+    before, previous = None, [j if j <= k else outside for j in range(len(token) + 1)]
+    for i in range(1, len(word) + 1):
+        current = [i if i <= k else outside] + [outside] * len(token)
+        for j in range(max(1, i - k), min(len(token), i + k) + 1):
+            cost = word[i - 1] != token[j - 1]
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and word[i - 1] == token[j - 2] and word[i - 2] == token[j - 1]:
+                value = min(value, before[j - 2] + 1)
+            current[j] = value
+        if min(current) > k:
+            return outside
+        before, previous = previous, current
+    return min(min(previous), outside)
+
+
+def _postings(items, grams_of):
+    """n-gramme → positions triées des éléments qui le contiennent"""
+    postings = {}
+    for position, item in enumerate(items):
+        for gram in grams_of(item):
+            postings.setdefault(gram, []).append(position)
+    return {gram: np.array(rows, dtype=np.int32) for gram, rows in postings.items()}
+
+
+class NarrowingSearch:
+    """⌨️ Recherche au fil de la frappe, une par session : une recherche qui prolonge la précédente ne
+    filtre que ses résultats (« cabo » parmi les résultats de « cab »), sans nouveau calcul complet
+
+    `compute(recherche)` : résultats complets (sans limite) ; `narrow(recherche, résultats)` : ceux qui
+    correspondent encore. Valable pour toute recherche par sous-chaînes : si une recherche en prolonge une
+    autre, ses résultats sont inclus dans ceux de la plus courte. `shared` (ResultCache) garde les préfixes
+    courts de toutes les sessions : le plus long préfixe connu sert de point de départ. `namespace` (version
+    des données) sépare dans `shared` les préfixes de sources différentes.
+    """
+
+    def __init__(self, compute, narrow, shared=None, key=normalize, namespace=None):
+        self.compute = compute
+        self.narrow = narrow
+        self.shared = shared
+        self.key = key
+        self.namespace = namespace
+        # Dernière recherche de la session (forme comparée) et ses résultats complets
+        self.query = None
+        self.results = None
+        self.computed = 0
+        self.narrowed = 0
+
+    def _base(self, query):
+        """(préfixe, résultats) connus le plus proches de `query`, sinon (None, None)"""
+        base = (None, None)
+        if self.query is not None and query.startswith(self.query):
+            base = (self.query, self.results)
+        if self.shared is not None:
+            start = len(base[0]) if base[0] is not None else 0
+            for end in range(min(len(query), SHARED_PREFIX_LENGTH), start, -1):
+                prefix = query[:end]
+                # Seules les formes comparées sont mises en cache ('ca ' n'en est pas une)
+                if self.key(prefix) == prefix and (self.namespace, prefix) in self.shared:
+                    results = self.shared.get((self.namespace, prefix))
+                    if results is not None:
+                        return prefix, results
+        return base
+
+    def __call__(self, query):
+        """Résultats complets de `query`, filtrés depuis le plus long préfixe connu"""
+        query = self.key(query)
+        if not query:
+            return self.compute(query)
+        prefix, results = self._base(query)
+        if prefix is None:
+            results = self.compute(query)
+            self.computed += 1
+        elif prefix != query:
+            results = self.narrow(query, results)
+            self.narrowed += 1
+        if self.shared is not None and prefix != query and len(query) <= SHARED_PREFIX_LENGTH:
+            self.shared.put((self.namespace, query), results)
+        self.query, self.results = query, results
+        return results
+
+
+def substring_search(session_state, state_key, query_all, search_term, limit, source, shared=None, version=None):
+    """⌨️ Recherche de libellés par sous-chaîne (insensible à la casse) au fil de la frappe, ex: requête DuckDB
+
+    `query_all(terme)` : tous les libellés de `source` (connexion) contenant le terme en minuscules. La
+    recherche de la session est recréée quand la source ou le cache partagé change ; dans `shared`, les
+    préfixes sont rangés sous `version` (empreinte des données). Début du libellé d'abord, puis les plus courts.
+    """
+    state = session_state.get(state_key)
+    if state is None or state[0] is not source or state[1].shared is not shared or state[1].namespace != version:
+        narrowing = NarrowingSearch(query_all, lambda term, labels: [label for label in labels if term in label.lower()],
+                                    shared, key=str.lower, namespace=version)
+        state = session_state[state_key] = (source, narrowing)
+    term = search_term.lower()
+    return heapq.nsmallest(limit, state[1](search_term),
+                           key=lambda label: (not label.lower().startswith(term), len(label), label))
+
+
+class TrigramIndex:
+    """🔎 trigramme → positions triées des libellés qui le contiennent ; en lecture seule, partagé par les sessions
+
+    Libellés triés (ordre alphabétique normalisé) : les positions donnent directement l'ordre d'affichage.
+    Les mots distincts des libellés ont leur propre index de trigrammes pour les fautes de frappe.
+    """
+
+    def __init__(self, labels):
+        labels = {str(label) for label in labels if pd.notna(label)}
+        self.labels = sorted(labels, key=lambda label: (normalize(label), label))
+        self.keys = [normalize(label) for label in self.labels]
+        self.postings = _postings(self.keys, trigrams)
+        # Libellés trop courts pour avoir un trigramme : vérifiés directement
+        self.short = np.array([p for p, key in enumerate(self.keys) if len(key) < NGRAM], dtype=np.int32)
+        # Mots d'un ou deux caractères déjà résolus (vocabulaire borné, rempli à la demande)
+        self._short_words = {}
+        # Vocabulaire : mot → libellés qui le contiennent, et trigrammes des mots
+        token_labels = {}
+        for position, key in enumerate(self.keys):
+            for token in set(key.split()):
+                token_labels.setdefault(token, []).append(position)
+        self.tokens = sorted(token_labels)
+        self.token_labels = [np.array(token_labels[token], dtype=np.int32) for token in self.tokens]
+        self.token_postings = _postings(self.tokens, trigrams)
+        # Positions des préfixes tapés par toutes les sessions (voir narrowing)
+        self.prefix_cache = ResultCache(PREFIX_CACHE_MB * 1024**2)
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def nbytes(self):
+        """Mémoire des listes de positions"""
+        return (sum(rows.nbytes for rows in self.postings.values()) + self.short.nbytes
+                + sum(rows.nbytes for rows in self._short_words.values())
+                + sum(rows.nbytes for rows in self.token_labels)
+                + sum(rows.nbytes for rows in self.token_postings.values()))
+
+    def _verify(self, word, candidates):
+        """Candidats dont le libellé contient vraiment le mot"""
+        return np.array([p for p in candidates.tolist() if word in self.keys[p]], dtype=np.int32)
+
+    def _word_positions(self, word, within=None):
+        """Positions des libellés contenant un mot de la recherche (parmi `within` si donné)"""
+        if len(word) < NGRAM:
+            rows = self._short_words.get(word)
+            if rows is None:
+                # Mot court : union des trigrammes qui le contiennent (vocabulaire, pas libellés)
+                lists = [rows for gram, rows in self.postings.items() if word in gram]
+                lists.append(np.array([p for p in self.short if word in self.keys[p]], dtype=np.int32))
+                rows = self._short_words[word] = np.unique(np.concatenate(lists))
+            if within is None:
+                return rows
+            return self._verify(word, within) if len(within) <= len(rows) else np.intersect1d(within, rows, assume_unique=True)
+        lists = []
+        for gram in trigrams(word):
+            rows = self.postings.get(gram)
+            if rows is None:
+                return _EMPTY
+            lists.append(rows)
+        # Plus courte liste d'abord : chaque intersection ne réduit que des candidats déjà rares
+        lists.sort(key=len)
+        if within is not None:
+            # Résultats précédents plus rares que tout trigramme : vérifiés directement, sans intersection
+            lists = [within] if len(within) <= len(lists[0]) else lists + [within]
+        candidates = lists[0]
+        for rows in lists[1:]:
+            candidates = np.intersect1d(candidates, rows, assume_unique=True)
+            if len(candidates) == 0:
+                return _EMPTY
+        # Tous les trigrammes présents n'impliquent pas la sous-chaîne : vérification des candidats
+        return self._verify(word, candidates)
+
+    def positions(self, query, within=None):
+        """⚡ Positions (triées) des libellés contenant tous les mots de la recherche
+
+        `within` : positions triées d'une recherche moins précise (ex: préfixe de `query`) ; seules
+        celles-ci sont vérifiées, chaque mot ne réduit que les résultats des précédents.
+        """
+        words = normalize(query).split()
+        if not words:
+            return np.arange(len(self.labels), dtype=np.int32) if within is None else within
+        result = within
+        for word in sorted(set(words), key=len, reverse=True):
+            result = self._word_positions(word, result)
+            if len(result) == 0:
+                break
+        return result
+
+    def narrowing(self):
+        """⌨️ Recherche au fil de la frappe pour une session, préfixes courts partagés par l'index"""
+        return NarrowingSearch(self.positions, self.positions, self.prefix_cache)
+
+    def _fuzzy_word(self, word):
+        """{position: fautes} des libellés dont un mot commence à distance bornée de `word`"""
+        max_distance = max_typos(word)
+        matches = {int(p): 0 for p in self._word_positions(word)}
+        lists = [self.token_postings[gram] for gram in trigrams(word) if gram in self.token_postings]
+        if max_distance == 0 or not lists:
+            return matches
+        # Mots du vocabulaire partageant le plus de trigrammes : seuls eux passent la distance d'édition
+        shared = np.bincount(np.concatenate(lists), minlength=len(self.tokens))
+        candidates = np.flatnonzero(shared)
+        if len(candidates) > FUZZY_CANDIDATES:
+            candidates = candidates[np.argpartition(-shared[candidates], FUZZY_CANDIDATES)[:FUZZY_CANDIDATES]]
+        for token_id in candidates:
+            distance = prefix_distance(word, self.tokens[token_id], max_distance)
+            if distance <= max_distance:
+                for position in self.token_labels[token_id].tolist():
+                    matches[position] = min(matches.get(position, distance), distance)
+        return matches
+
+    def fuzzy_positions(self, query):
+        """🩹 {position: fautes totales} des libellés où chaque mot de la recherche est retrouvé, fautes bornées"""
+        result = {}
+        for i, word in enumerate(sorted(set(normalize(query).split()), key=len, reverse=True)):
+            matches = self._fuzzy_word(word)
+            result = matches if i == 0 else {p: d + matches[p] for p, d in result.items() if p in matches}
+            if not result:
+                break
+        return result
+
+    def search(self, query, limit=None, allowed=None, weights=None, positions=None):
+        """🔍 Libellés classés par qualité de correspondance, puis par volume (`weights`, ex: REM)
+
+        Ordre : début du libellé, phrase exacte, tous les mots, puis correspondances avec fautes de frappe
+        (moins de fautes d'abord). Les fautes ne complètent la liste que si les correspondances exactes
+        n'atteignent pas `limit` (sans limite : seulement si rien ne correspond exactement).
+        `allowed` : libellés proposés (options disponibles pour les autres filtres), les autres sont ignorés.
+        `positions` : résultats exacts déjà calculés (ex: NarrowingSearch), sinon positions(query).
+        """
+        phrase = normalize(query)
+        weights = weights or {}
+        # Clés triées : les libellés qui commencent par la recherche forment une plage contiguë
+        first, last = bisect_left(self.keys, phrase), bisect_left(self.keys, phrase + '\U0010ffff')
+        single_word = ' ' not in phrase
+        scored = [
+            (0 if first <= position < last else 1 if single_word or phrase in self.keys[position] else 2,
+             -weights.get(self.labels[position], 0), position)
+            for position in (self.positions(query) if positions is None else positions).tolist()
+            if allowed is None or self.labels[position] in allowed
+        ]
+        if phrase and len(scored) < (limit or 1):
+            found = {position for _, _, position in scored}
+            for position, typos in self.fuzzy_positions(query).items():
+                label = self.labels[position]
+                if position in found or (allowed is not None and label not in allowed):
+                    continue
+                scored.append((2 + typos, -weights.get(label, 0), position))
+        scored.sort()
+        results = [self.labels[position] for _, _, position in scored]
+        return results if limit is None else results[:limit]
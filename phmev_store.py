@@ -0,0 +1,227 @@
+"""
+🧠 Stockage partagé du dataset PHMEV
+Un seul DataFrame en lecture seule par processus, partagé par toutes les sessions Streamlit,
+chargé en arrière-plan pendant que l'interface s'affiche (l'application active le Copy-on-Write de pandas)
+"""
+
+import os
+import threading
+from concurrent.futures import Future
+
+import pandas as pd
+
+# Clé du dataset principal (OPEN_PHMEV_2024)
+PHMEV_DATASET_KEY = 'phmev_2024'
+
+# Anciennes clés de session qui contenaient une copie complète du dataset
+LEGACY_SESSION_KEYS = ('phmev_data_cached',)
+
+
+def dataset_key(year):
+    """Clé du dataset d'une année (une entrée du store par année chargée)"""
+    return f'phmev_{int(year)}'
+
+
+def index_key(year):
+    """Clé de l'index bitmap du dataset d'une année (même version que le dataset)"""
+    return f'{dataset_key(year)}_index'
+
+
+def cooccurrence_key(year):
+    """Clé des matrices de co-occurrence du dataset d'une année (même version que le dataset)"""
+    return f'{dataset_key(year)}_cooccurrence'
+
+
+def cube_key(year):
+    """Clé du cube établissement × CIP13 du dataset d'une année (même version que le dataset)"""
+    return f'{dataset_key(year)}_cube'
+
+
+class SharedDatasetError(RuntimeError):
+    """Tentative de dupliquer un dataset déjà publié dans le store partagé"""
+
+
+class SharedDatasetStore:
+    """📦 Store process-wide : un dataset chargé une seule fois, lu par toutes les sessions"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._datasets = {}
+        self._memory = {}
+        self._futures = {}
+        self._progress = {}
+        self._versions = {}
+
+    def get(self, key):
+        """Retourne le dataset publié sous `key` (ou None)"""
+        return self._datasets.get(key)
+
+    def publish(self, key, df):
+        """Publie un dataset ; refuse une seconde copie sous la même clé"""
+        with self._lock:
+            current = self._datasets.get(key)
+            if current is not None and current is not df:
+                raise SharedDatasetError(
+                    f"Le dataset '{key}' est déjà chargé dans le processus ({len(current):,} lignes)"
+                )
+            self._datasets[key] = df
+            self._memory[key] = dataframe_memory_bytes(df)
+            return df
+
+    def get_or_load(self, key, loader):
+        """Retourne le dataset partagé, en appelant `loader()` une seule fois par processus"""
+        df = self._datasets.get(key)
+        if df is not None:
+            return df
+        future = self._futures.get(key)
+        if future is not None and (not future.done() or future.exception() is None):
+            # Chargement d'arrière-plan en cours : on l'attend au lieu de relire le fichier
+            return future.result()
+        with self._lock:
+            df = self._datasets.get(key)
+            if df is None:
+                df = loader()
+                if df is not None:
+                    self.publish(key, df)
+            return df
+
+    def start_loading(self, key, loader, version=None):
+        """🧵 Lance `loader(report)` dans un thread d'arrière-plan (une seule fois) et retourne son Future
+
+        `report(fraction, message)` met à jour la progression lue par progress(). Le dataset est publié
+        dès la fin du chargement ; en cas d'erreur le Future porte l'exception et un nouvel appel relance.
+        `version` (empreinte de la source) : si elle change, l'ancien dataset est libéré puis rechargé ;
+        un chargement de l'ancienne version encore en cours est abandonné (il ne publiera rien).
+        """
+        with self._lock:
+            if version is not None and self._versions.get(key, version) != version:
+                self.evict(key)
+                self._futures.pop(key, None)
+                self._versions.pop(key, None)
+            future = self._futures.get(key)
+            if future is not None and not (future.done() and future.exception() is not None):
+                return future
+            future = Future()
+            df = self._datasets.get(key)
+            if df is not None:
+                future.set_result(df)
+                self._futures[key] = future
+                if version is not None:
+                    self._versions[key] = version
+                return future
+            self._futures[key] = future
+            self._versions[key] = version
+            self._progress[key] = (0.0, "⏳ Chargement en attente...")
+
+        def is_current():
+            # Remplacé par le chargement d'une nouvelle version : ni progression ni publication
+            return self._futures.get(key) is future
+
+        def report(fraction, message):
+            if is_current():
+                self._progress[key] = (float(fraction), message)
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                df = loader(report)
+                if df is None:
+                    raise SharedDatasetError(f"Le chargement du dataset '{key}' n'a rien retourné")
+                with self._lock:
+                    if is_current():
+                        self.publish(key, df)
+            except BaseException as e:
+                report(1.0, f"❌ {e}")
+                future.set_exception(e)
+            else:
+                report(1.0, "✅ Données prêtes")
+                future.set_result(df)
+
+        threading.Thread(target=run, name=f"phmev-loader-{key}", daemon=True).start()
+        return future
+
+    def version(self, key):
+        """Version (empreinte de la source) du dataset chargé ou en cours de chargement sous `key`"""
+        return self._versions.get(key)
+
+    def loading_future(self, key):
+        """Future du chargement d'arrière-plan de `key` (ou None s'il n'a pas été lancé)"""
+        return self._futures.get(key)
+
+    def progress(self, key):
+        """Progression du chargement : (fraction entre 0 et 1, message)"""
+        if key in self._datasets:
+            return 1.0, "✅ Données prêtes"
+        return self._progress.get(key, (0.0, "⏳ Chargement non démarré"))
+
+    def evict(self, key=None):
+        """Libère un dataset (ou tous si key=None), ex: bouton « Vider le cache »"""
+        with self._lock:
+            keys = list(self._datasets) if key is None else [key]
+            for k in keys:
+                self._datasets.pop(k, None)
+                self._memory.pop(k, None)
+                # Chargement terminé : oublié ; en cours : il publiera, puis sera oublié au prochain evict
+                future = self._futures.get(k)
+                if future is not None and future.done():
+                    self._futures.pop(k, None)
+                    self._progress.pop(k, None)
+                    self._versions.pop(k, None)
+
+    def memory_report(self):
+        """📊 Mémoire résidente : taille de chaque dataset partagé + RSS du processus"""
+        with self._lock:
+            datasets = {key: {'rows': len(df), 'bytes': self._memory.get(key, 0)}
+                        for key, df in self._datasets.items()}
+        return {
+            'datasets': datasets,
+            'datasets_bytes': sum(d['bytes'] for d in datasets.values()),
+            'process_rss_bytes': process_rss_bytes(),
+        }
+
+
+def dataframe_memory_bytes(df):
+    """Taille mémoire réelle d'un DataFrame (chaînes comprises) ou d'un index (nbytes)"""
+    if df is None:
+        return 0
+    if not isinstance(df, pd.DataFrame):
+        return int(df.nbytes)
+    return int(df.memory_usage(deep=True).sum())
+
+
+def process_rss_bytes():
+    """RSS courant du processus (Linux /proc, sinon pic via resource)"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss est en octets sur macOS, en kilo-octets ailleurs
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except (ImportError, OSError):
+        return 0
+
+
+def purge_session_copies(session_state):
+    """🧹 Supprime les copies par session du dataset (ancien cache st.session_state)"""
+    purged = []
+    for key in LEGACY_SESSION_KEYS:
+        if key in session_state:
+            del session_state[key]
+            purged.append(key)
+    return purged
+
+
+# Singleton du module : importé une seule fois par le serveur Streamlit, donc commun à toutes les sessions
+_STORE = SharedDatasetStore()
+
+
+def get_dataset_store():
+    """Retourne le store partagé du processus"""
+    return _STORE
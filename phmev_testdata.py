@@ -0,0 +1,35 @@
+"""
+🧪 Dataset synthétique au format PHMEV partagé par les tests (index, facettes, arbre ATC, co-occurrences)
+"""
+
+import numpy as np
+import pandas as pd
+
+from phmev_schema import encode_dimensions
+
+
+def make_df(n=200_000, seed=0, villes_na=False, with_rem=False):
+    """Dataset synthétique au format PHMEV, trié par ATC5 comme le fichier préparé
+
+    `villes_na` : villes manquantes parmi les valeurs tirées ; `with_rem` : montants REM en centimes.
+    """
+    rng = np.random.default_rng(seed)
+    atc5 = np.array([f"{l}{i:02d}{k}A{j:02d}" for l in "ABCL" for i in range(1, 4) for k in "AB" for j in range(1, 5)])
+    codes = np.sort(atc5[rng.integers(0, len(atc5), n)])
+    villes = np.array([f"VILLE {i}" for i in range(300)] + ([None] if villes_na else []), dtype=object)
+    df = pd.DataFrame({
+        'atc1': [c[:1] for c in codes], 'l_atc1': [f"SYSTEME {c[:1]}" for c in codes],
+        'atc2': [c[:3] for c in codes], 'L_ATC2': [f"GROUPE {c[:3]}" for c in codes],
+        'atc3': [c[:4] for c in codes], 'L_ATC3': [f"SOUS-GROUPE {c[:4]}" for c in codes],
+        'atc4': [c[:5] for c in codes], 'L_ATC4': [f"CHIMIQUE {c[:5]}" for c in codes],
+        'ATC5': codes, 'L_ATC5': [f"MOLECULE {c}" for c in codes],
+        'libelle_cip': [f"MEDICAMENT {c} {i}" for c, i in zip(codes, rng.integers(0, 20, n))],
+        'ville': villes[rng.integers(0, len(villes), n)],
+        'categorie': [f"CATEGORIE {i}" for i in rng.integers(0, 6, n)],
+        'etablissement': [f"CH {i}" for i in rng.integers(0, 1000, n)],
+        # int32 comme dans le fichier préparé
+        'BOITES': rng.integers(1, 100, n).astype('int32'),
+    })
+    if with_rem:
+        df['REM'] = rng.integers(0, 10**9, n)
+    return encode_dimensions(df)
@@ -9,6 +9,13 @@ import numpy as np
 from datetime import datetime
 from google.cloud import bigquery
 from google.oauth2 import service_account
+from phmev_alias import AliasIndex, load_alias_cache
+from phmev_atc import ATC_LEVEL_KEYS, AtcTree
+from phmev_cache import canonical_filters, get_result_cache
+from phmev_cube import ROW_COUNT_COLUMN, ROW_LEVEL_FILTERS, bigquery_cube_description, bigquery_cube_table
+from phmev_dataset import bigquery_table_version, resolve_bigquery_table
+from phmev_facets import format_boites
+from phmev_search import TrigramIndex
 
 # Configuration de la page
 st.set_page_config(
@@ -249,30 +256,97 @@ def init_bigquery():
         # Erreur silencieuse pour éviter de casser l'interface
         return None, None
 
-@st.cache_data(ttl=86400)  # Cache 24 heures
-def get_base_filter_options():
-    """Récupère les options de base depuis le cache (ultra-rapide)"""
+@st.cache_data(ttl=60, show_spinner=False)  # Sonde de métadonnées : seule entrée à durée limitée
+def get_dataset_version():
+    """Version des données (table + last_modified BigQuery), incluse dans toutes les clés de cache"""
+    client, project_id = init_bigquery()
+    if not client:
+        return None
+    
+    table = resolve_bigquery_table(client, project_id)
+    return bigquery_table_version(table) if table is not None else None
+
+def get_phmev_table():
+    """Table interrogée et années disponibles pour la version courante des données"""
+    return get_phmev_table_for_version(get_dataset_version())
+
+@st.cache_data(show_spinner=False)
+def get_phmev_table_for_version(dataset_version):
+    """Table PHMEV partitionnée par année si elle existe, sinon PHMEV2024 (recalculé à chaque nouvelle version)"""
+    client, project_id = init_bigquery()
+    if not client:
+        return None, []
+    
+    try:
+        if not dataset_version or not dataset_version.startswith('PHMEV@'):
+            raise LookupError("Table partitionnée absente")
+        # Années = partitions de la table (upload_to_bigquery.py --year), lues dans les métadonnées
+        query = f"""
+        SELECT partition_id
+        FROM `{project_id}.dataset.INFORMATION_SCHEMA.PARTITIONS`
+        WHERE table_name = 'PHMEV' AND partition_id NOT IN ('__NULL__', '__UNPARTITIONED__')
+        """
+        years = sorted(int(row.partition_id) for row in client.query(query).result())
+        return f"{project_id}.dataset.PHMEV", years
+    except Exception:
+        return f"{project_id}.dataset.PHMEV2024", []
+
+@st.cache_data(show_spinner=False)
+def get_cube_table_for_version(dataset_version):
+    """🧊 Cube (établissement × CIP13) de la table interrogée s'il a été construit pour cette version des données"""
+    client, _ = init_bigquery()
+    table, _ = get_phmev_table_for_version(dataset_version)
+    if not client or not table or not dataset_version:
+        return None
+    try:
+        cube = client.get_table(bigquery_cube_table(table))
+    except Exception:
+        return None
+    # Cube d'une version antérieure (upload sans --cube) : ignoré, les requêtes restent exactes
+    return bigquery_cube_table(table) if cube.description == bigquery_cube_description(dataset_version) else None
+
+def route_query(filters, dataset_version=None):
+    """🧭 Routeur : (table interrogée, nombre de lignes en SQL) — le cube dès que l'état de filtres le permet
+
+    Le cube garde les colonnes brutes : mêmes clauses WHERE et GROUP BY, seul COUNT(*) devient SUM(nb_lignes).
+    Un seuil de boîtes par ligne (min_boites) reste évalué sur la table brute.
+    """
+    table, _ = get_phmev_table()
+    cube_table = get_cube_table_for_version(dataset_version) if dataset_version else None
+    if cube_table and not any(filters.get(key) for key in ROW_LEVEL_FILTERS):
+        return cube_table, f"SUM({ROW_COUNT_COLUMN})"
+    return table, "COUNT(*)"
+
+@st.cache_data(show_spinner=False)  # Pas d'expiration : la version des données fait partie de la clé
+def get_base_filter_options(dataset_version=None):
+    """Récupère les options de base depuis le cache (ultra-rapide)
+
+    Un cache fichier n'est utilisé que s'il a été généré pour la même version des données
+    (empreinte enregistrée par generate_filter_cache.py) ; sans connexion BigQuery, il est pris tel quel.
+    """
     import pickle
     import json
     import os
-    from datetime import datetime, timedelta
+    
+    def is_current(options):
+        return dataset_version is None or options.get('_metadata', {}).get('fingerprint') == dataset_version
     
     try:
         # PRIORITÉ 1: Cache intégré (pour Streamlit Cloud)
         try:
             from filter_cache_embedded import get_embedded_cache
             options = get_embedded_cache()
-            return options
+            if is_current(options):
+                return options
         except ImportError:
             pass
         
         # PRIORITÉ 2: Cache pickle local (pour développement local)
         cache_file = 'filter_options_cache.pkl'
         if os.path.exists(cache_file):
-            cache_age = datetime.now() - datetime.fromtimestamp(os.path.getmtime(cache_file))
-            if cache_age < timedelta(hours=24):
-                with open(cache_file, 'rb') as f:
-                    options = pickle.load(f)
+            with open(cache_file, 'rb') as f:
+                options = pickle.load(f)
+            if is_current(options):
                 return options
         
         # PRIORITÉ 3: Cache JSON local
@@ -280,7 +354,8 @@ def get_base_filter_options():
         if os.path.exists(json_file):
             with open(json_file, 'r', encoding='utf-8') as f:
                 options = json.load(f)
-            return options
+            if is_current(options):
+                return options
         
         # FALLBACK: BigQuery (silencieux)
         return get_base_filter_options_from_bigquery()
@@ -292,6 +367,7 @@ def get_base_filter_options():
 def get_base_filter_options_from_bigquery():
     """Fallback : récupère les options depuis BigQuery"""
     client, project_id = init_bigquery()
+    table, _ = get_phmev_table()
     if not client:
         return {}
     
@@ -307,7 +383,7 @@ def get_base_filter_options_from_bigquery():
             COALESCE(NULLIF(categorie_jur, ''), 'Non spécifiée') as categorie,
             COALESCE(NULLIF(nom_etb, ''), NULLIF(raison_sociale_etb, ''), 'Non spécifié') as etablissement,
             COALESCE(NULLIF(l_cip13, ''), 'Non spécifié') as medicament
-        FROM `{project_id}.dataset.PHMEV2024`
+        FROM `{table}`
         WHERE l_cip13 NOT IN ('Non restitué', 'Non spécifié', 'Honoraires de dispensation')
         AND l_cip13 IS NOT NULL
         """
@@ -337,82 +413,77 @@ def get_base_filter_options_from_bigquery():
         # Erreur silencieuse pour éviter l'affichage technique
         return {}
 
-@st.cache_data(ttl=300)  # Cache 5 minutes pour les filtres dynamiques
-def get_filtered_options(current_filters):
-    """Récupère les options filtrées dynamiquement"""
+# Facette → (expression SQL de la valeur, libellé, filtre propre ignoré par la facette)
+FACET_DIMENSIONS = {
+    'atc1': ('atc1', 'l_atc1', 'atc1'),
+    'atc2': ('atc2', 'L_ATC2', 'atc2'),
+    'atc3': ('atc3', 'L_ATC3', 'atc3'),
+    'atc4': ('atc4', 'L_ATC4', 'atc4'),
+    'atc5': ('ATC5', 'L_ATC5', 'atc5'),
+    'villes': ("COALESCE(NULLIF(nom_ville, ''), 'Non spécifiée')", None, 'villes'),
+    'categories': ("COALESCE(NULLIF(categorie_jur, ''), 'Non spécifiée')", None, 'categories'),
+    'etablissements': ("COALESCE(NULLIF(nom_etb, ''), NULLIF(raison_sociale_etb, ''), 'Non spécifié')", None, 'etablissements'),
+    'medicaments': ("COALESCE(NULLIF(l_cip13, ''), 'Non spécifié')", None, 'medicaments'),
+}
+
+def build_facets_query(table, current_filters):
+    """🧮 Une requête, une agrégation par facette : chaque facette ignore son propre filtre (UNION ALL)"""
+    facet_filters = {k: v for k, v in current_filters.items() if k != 'min_boites'}
+    branches = []
+    for facet, (value_expr, label_col, own_filter) in FACET_DIMENSIONS.items():
+        where_clause = build_where_clause({k: v for k, v in facet_filters.items() if k != own_filter})
+        branches.append(f"""
+        (SELECT '{facet}' AS facette, {value_expr} AS valeur, {f'ANY_VALUE({label_col})' if label_col else 'NULL'} AS libelle,
+                SUM(BOITES) AS boites, SUM(REM) AS rem
+         FROM `{table}`
+         WHERE {where_clause}
+         GROUP BY valeur)""")
+    return "\n        UNION ALL".join(branches)
+
+def get_filtered_options(current_filters, dataset_version=None):
+    """Récupère les options filtrées dynamiquement, avec les boîtes de chaque option (facettes)
+
+    Résultat partagé entre sessions (cache LRU borné, clé = état de filtres canonique + version des données).
+    """
     client, project_id = init_bigquery()
+    # Les facettes ignorent le seuil de boîtes : toujours servies par le cube s'il existe
+    table, _ = route_query({}, dataset_version)
     if not client:
         return {}
     
+    key = ('facets', dataset_version, canonical_filters(current_filters))
+    cached = get_result_cache().get(key)
+    if cached is not None:
+        return cached
+    
     try:
-        # Construire la clause WHERE avec les filtres actuels
-        where_conditions = [
-            "l_cip13 NOT IN ('Non restitué', 'Non spécifié', 'Honoraires de dispensation')",
-            "l_cip13 IS NOT NULL"
-        ]
-        
-        # Ajouter les filtres existants
-        for level in ['atc1', 'atc2', 'atc3', 'atc4']:
-            if current_filters.get(level):
-                level_list = "', '".join(current_filters[level])
-                where_conditions.append(f"{level} IN ('{level_list}')")
-        
-        if current_filters.get('atc5'):
-            atc5_list = "', '".join(current_filters['atc5'])
-            where_conditions.append(f"ATC5 IN ('{atc5_list}')")
-        
-        if current_filters.get('villes'):
-            villes_list = "', '".join(current_filters['villes'])
-            where_conditions.append(f"COALESCE(NULLIF(nom_ville, ''), 'Non spécifiée') IN ('{villes_list}')")
-        
-        if current_filters.get('categories'):
-            cat_list = "', '".join(current_filters['categories'])
-            where_conditions.append(f"COALESCE(NULLIF(categorie_jur, ''), 'Non spécifiée') IN ('{cat_list}')")
-        
-        if current_filters.get('etablissements'):
-            etab_list = "', '".join(current_filters['etablissements'])
-            where_conditions.append(f"COALESCE(NULLIF(nom_etb, ''), NULLIF(raison_sociale_etb, ''), 'Non spécifié') IN ('{etab_list}')")
-        
-        where_clause = " AND ".join(where_conditions)
-        
-        query = f"""
-        SELECT DISTINCT
-            atc1, l_atc1,
-            atc2, L_ATC2,
-            atc3, L_ATC3,
-            atc4, L_ATC4,
-            ATC5, L_ATC5,
-            COALESCE(NULLIF(nom_ville, ''), 'Non spécifiée') as ville,
-            COALESCE(NULLIF(categorie_jur, ''), 'Non spécifiée') as categorie,
-            COALESCE(NULLIF(nom_etb, ''), NULLIF(raison_sociale_etb, ''), 'Non spécifié') as etablissement,
-            COALESCE(NULLIF(l_cip13, ''), 'Non spécifié') as medicament
-        FROM `{project_id}.dataset.PHMEV2024`
-        WHERE {where_clause}
-        """
-        
-        df = client.query(query).to_dataframe()
-        
-        options = {}
-        if 'atc2' in df.columns:
-            options['atc2'] = sorted([(row['atc2'], row['L_ATC2']) for _, row in df[['atc2', 'L_ATC2']].dropna().drop_duplicates().iterrows()])
-        if 'atc3' in df.columns:
-            options['atc3'] = sorted([(row['atc3'], row['L_ATC3']) for _, row in df[['atc3', 'L_ATC3']].dropna().drop_duplicates().iterrows()])
-        if 'atc4' in df.columns:
-            options['atc4'] = sorted([(row['atc4'], row['L_ATC4']) for _, row in df[['atc4', 'L_ATC4']].dropna().drop_duplicates().iterrows()])
-        if 'ATC5' in df.columns:
-            options['atc5'] = sorted([(row['ATC5'], row['L_ATC5']) for _, row in df[['ATC5', 'L_ATC5']].dropna().drop_duplicates().iterrows()])
+        # Une agrégation par dimension au lieu du produit cartésien DISTINCT de toutes les dimensions
+        df = client.query(build_facets_query(table, current_filters)).to_dataframe()
+        df = df.dropna(subset=['valeur'])
         
-        options['villes'] = sorted(df['ville'].dropna().unique().tolist())
-        options['categories'] = sorted(df['categorie'].dropna().unique().tolist())
-        options['etablissements'] = sorted(df['etablissement'].dropna().unique().tolist())
-        options['medicaments'] = sorted(df['medicament'].dropna().unique().tolist())
+        options = {'boites': {}, 'rem': {}}
+        for facet, (_, label_col, _) in FACET_DIMENSIONS.items():
+            rows = df[df['facette'] == facet].sort_values('valeur')
+            if label_col:
+                options[facet] = list(zip(rows['valeur'], rows['libelle']))
+            else:
+                options[facet] = rows['valeur'].tolist()
+            options['boites'][facet] = dict(zip(rows['valeur'], rows['boites'].fillna(0).astype('int64')))
+            # Montant remboursé de chaque option : départage les résultats de recherche de même qualité
+            options['rem'][facet] = dict(zip(rows['valeur'], rows['rem'].fillna(0)))
         
-        return options
+        # Seuls les résultats réussis sont partagés : une erreur transitoire sera retentée
+        return get_result_cache().put(key, options)
         
     except Exception as e:
         # Erreur silencieuse, retour aux options de base
         return {}
 
+def format_option(value, count=None, label=None):
+    """Libellé d'une option : « code - libellé (n boîtes) », les boîtes seulement si connues"""
+    text = f"{value} - {label}" if label is not None else f"{value}"
+    return f"{text} {format_boites(count)}" if count is not None else text
+
 def build_where_clause(filters):
     """Construit la clause WHERE dynamique"""
     where_conditions = [
@@ -420,6 +491,10 @@ def build_where_clause(filters):
         "l_cip13 IS NOT NULL"
     ]
     
+    # Années (colonne de partitionnement : seules les partitions choisies sont lues)
+    if filters.get('annees'):
+        where_conditions.append(f"year IN ({', '.join(str(int(y)) for y in filters['annees'])})")
+    
     # Filtres ATC hiérarchiques
     for level in ['atc1', 'atc2', 'atc3', 'atc4']:
         if filters.get(level):
@@ -452,24 +527,30 @@ def build_where_clause(filters):
     
     return " AND ".join(where_conditions)
 
-def get_kpis(filters):
-    """Récupère les KPIs depuis BigQuery"""
+def get_kpis(filters, dataset_version=None):
+    """Récupère les KPIs depuis BigQuery (partagés entre sessions pour un même état de filtres)"""
     client, project_id = init_bigquery()
+    table, row_count = route_query(filters, dataset_version)
     if not client:
         return {}
     
+    key = ('kpis', dataset_version, canonical_filters(filters))
+    cached = get_result_cache().get(key)
+    if cached is not None:
+        return cached
+    
     try:
         where_clause = build_where_clause(filters)
         query = f"""
         SELECT 
-            COUNT(*) as total_lignes,
+            {row_count} as total_lignes,
             SUM(REM) as total_rem,
             SUM(BSE) as total_bse,
             SUM(BOITES) as total_boites,
             COUNT(DISTINCT COALESCE(NULLIF(nom_etb, ''), NULLIF(raison_sociale_etb, ''), 'Non spécifié')) as nb_etablissements,
             COUNT(DISTINCT COALESCE(NULLIF(l_cip13, ''), 'Non spécifié')) as nb_medicaments,
             COUNT(DISTINCT COALESCE(NULLIF(nom_ville, ''), 'Non spécifiée')) as nb_villes
-        FROM `{project_id}.dataset.PHMEV2024`
+        FROM `{table}`
         WHERE {where_clause}
         """
         
@@ -480,18 +561,24 @@ def get_kpis(filters):
             for key, value in kpis_dict.items():
                 if pd.isna(value) or value is None:
                     kpis_dict[key] = 0
-            return kpis_dict
+            return get_result_cache().put(('kpis', dataset_version, canonical_filters(filters)), kpis_dict)
         return {}
     except Exception as e:
         # Erreur silencieuse pour les KPIs
         return {}
 
-def get_top_data(table_type, filters, limit=50):
-    """Récupère le TOP N pour un type de tableau"""
+def get_top_data(table_type, filters, limit=50, dataset_version=None):
+    """Récupère le TOP N pour un type de tableau (partagé entre sessions pour un même état de filtres)"""
     client, project_id = init_bigquery()
+    table, _ = route_query(filters, dataset_version)
     if not client:
         return pd.DataFrame()
     
+    key = (f'top_{table_type}', dataset_version, canonical_filters(filters), limit)
+    cached = get_result_cache().get(key)
+    if cached is not None:
+        return cached
+    
     try:
         where_clause = build_where_clause(filters)
         
@@ -506,7 +593,7 @@ def get_top_data(table_type, filters, limit=50):
                 SUM(BOITES) as BOITES,
                 SUM(REM) / SUM(BOITES) as cout_par_boite,
                 (SUM(REM) / SUM(BSE)) * 100 as taux_remboursement
-            FROM `{project_id}.dataset.PHMEV2024`
+            FROM `{table}`
             WHERE {where_clause}
             GROUP BY etablissement, ville, categorie
             ORDER BY REM DESC
@@ -524,7 +611,7 @@ def get_top_data(table_type, filters, limit=50):
                 COUNT(DISTINCT COALESCE(NULLIF(nom_etb, ''), NULLIF(raison_sociale_etb, ''), 'Non spécifié')) as nb_etablissements,
                 SUM(REM) / SUM(BOITES) as cout_par_boite,
                 (SUM(REM) / SUM(BSE)) * 100 as taux_remboursement
-            FROM `{project_id}.dataset.PHMEV2024`
+            FROM `{table}`
             WHERE {where_clause}
             GROUP BY medicament, atc1, l_atc1
             ORDER BY REM DESC
@@ -542,19 +629,84 @@ def get_top_data(table_type, filters, limit=50):
                 COUNT(DISTINCT COALESCE(NULLIF(nom_etb, ''), NULLIF(raison_sociale_etb, ''), 'Non spécifié')) as nb_etablissements,
                 SUM(REM) / SUM(BOITES) as cout_par_boite,
                 (SUM(REM) / SUM(BSE)) * 100 as taux_remboursement
-            FROM `{project_id}.dataset.PHMEV2024`
+            FROM `{table}`
             WHERE {where_clause}
             GROUP BY molecule, atc1, l_atc1
             ORDER BY REM DESC
             LIMIT {limit}
             """
         
-        return client.query(query).to_dataframe()
+        return get_result_cache().put(key, client.query(query).to_dataframe())
         
     except Exception as e:
         # Erreur silencieuse pour les données
         return pd.DataFrame()
 
+@st.cache_resource(show_spinner=False)
+def get_atc_tree(dataset_version=None):
+    """🌳 Arbre ATC issu des options de base : options ATC2..ATC5 = enfants des codes choisis, sans requête"""
+    return AtcTree.from_options(get_base_filter_options(dataset_version))
+
+@st.cache_resource(show_spinner=False)
+def get_search_index(filter_type, dataset_version=None):
+    """🔎 Index de trigrammes des options de base d'une liste (médicaments, établissements), une fois par version"""
+    return TrigramIndex(get_base_filter_options(dataset_version).get(filter_type, []))
+
+def get_narrowing_search(search_index, search_key):
+    """⌨️ Recherche au fil de la frappe d'un champ pour la session, recréée quand l'index change (nouvelle version)"""
+    narrowing = st.session_state.get(f"{search_key}_narrowing")
+    if narrowing is None or narrowing.shared is not search_index.prefix_cache:
+        narrowing = st.session_state[f"{search_key}_narrowing"] = search_index.narrowing()
+    return narrowing
+
+@st.cache_resource(show_spinner=False)
+def get_alias_index(dataset_version=None):
+    """🏷️ Index marque → CIP13 → molécule (ATC5), construit une fois par version des données
+
+    Depuis le cache généré par generate_filter_cache.py s'il correspond à la version, sinon BigQuery.
+    """
+    records = load_alias_cache(dataset_version)
+    if records is None:
+        client, _ = init_bigquery()
+        table, _ = get_phmev_table()
+        if not client or not table:
+            return AliasIndex({})
+        try:
+            query = f"""
+            SELECT DISTINCT CAST(CIP13 AS STRING) as cip13, l_cip13, ATC5 as atc5, L_ATC5 as l_atc5
+            FROM `{table}`
+            WHERE l_cip13 NOT IN ('Non restitué', 'Non spécifié', 'Honoraires de dispensation')
+            AND l_cip13 IS NOT NULL
+            """
+            records = client.query(query).to_dataframe().to_dict('list')
+        except Exception:
+            return AliasIndex({})
+    return AliasIndex(records)
+
+# Filtre → widget de la barre latérale (valeur lue dans st.session_state avant affichage)
+FILTER_WIDGETS = {
+    'atc1': 'atc1_filter',
+    'atc2': 'atc2_filter',
+    'atc3': 'atc3_filter',
+    'atc4': 'atc4_filter',
+    'atc5': 'atc5_filter',
+    'villes': 'villes_filter',
+    'categories': 'categories_filter',
+    'etablissements': 'etablissements_filter',
+    'medicaments': 'medicaments_filter',
+}
+
+def get_pending_filters(filters):
+    """🎛️ État complet des filtres, lu dans la session : une seule requête de facettes par exécution"""
+    pending = dict(filters)
+    for key, widget_key in FILTER_WIDGETS.items():
+        pending[key] = list(st.session_state.get(widget_key) or [])
+    # Un niveau ATC n'est affiché que si le niveau parent a une sélection
+    for parent, level in zip(ATC_LEVEL_KEYS, ATC_LEVEL_KEYS[1:]):
+        if not pending[parent]:
+            pending[level] = []
+    return pending
+
 def main():
     # En-tête
     st.markdown("""
@@ -569,10 +721,13 @@ def main():
     if 'filters' not in st.session_state:
         st.session_state.filters = {}
     
-    # Chargement des options de base (optimisé)
-    base_options = get_base_filter_options()
+    # Chargement des options de base (optimisé), pour la version courante des données
+    dataset_version = get_dataset_version()
+    base_options = get_base_filter_options(dataset_version)
     
     if not base_options:
+        # Échec transitoire : ne pas garder un résultat vide sans expiration
+        get_base_filter_options.clear()
         st.warning("⚠️ Chargement des données en cours...")
         st.stop()
     
@@ -585,6 +740,30 @@ def main():
     
     filters = {}
     
+    # Années disponibles (table partitionnée par année uniquement)
+    _, years = get_phmev_table()
+    if years:
+        st.sidebar.subheader("📅 Années")
+        filters['annees'] = st.sidebar.multiselect(
+            "Années analysées",
+            options=years,
+            default=[years[-1]],
+            key="annees_filter"
+        ) or [years[-1]]
+    
+    # Fonction pour obtenir les options filtrées de manière optimisée
+    def get_current_options(current_filters):
+        # L'année seule ne change pas les options de base (cache intégré)
+        if any(v for k, v in current_filters.items() if k != 'annees') and client:
+            return get_filtered_options(current_filters, dataset_version)
+        return base_options
+    
+    # Une requête de facettes pour toute la barre latérale (état complet des filtres de la session),
+    # listes ATC2..ATC5 lues dans l'arbre ATC : plus d'aller-retour BigQuery par niveau
+    atc_tree = get_atc_tree(dataset_version)
+    filtered_options = get_current_options(get_pending_filters(filters))
+    boites = filtered_options.get('boites', {})
+    
     # Classification ATC hiérarchique
     st.sidebar.subheader("🧬 Classification Thérapeutique")
     
@@ -593,85 +772,28 @@ def main():
     filters['atc1'] = st.sidebar.multiselect(
         "ATC Niveau 1", 
         options=[code for code, label in atc1_options],
-        format_func=lambda x: f"{x} - {dict(atc1_options).get(x, x)}",
+        format_func=lambda x: format_option(x, boites.get('atc1', {}).get(x), atc_tree.label('atc1', x)),
         key="atc1_filter"
     )
     
-    # Fonction pour obtenir les options filtrées de manière optimisée
-    def get_current_options(current_filters):
-        if any(current_filters.values()) and client:
-            return get_filtered_options(current_filters)
-        return base_options
-    
-    # Options initiales
-    filtered_options = get_current_options(filters)
-    
-    # ATC2 (conditionnel et dynamique)
-    if filters['atc1']:
-        atc2_options = filtered_options.get('atc2', [])
-        filters['atc2'] = st.sidebar.multiselect(
-            "ATC Niveau 2", 
-            options=[code for code, label in atc2_options],
-            format_func=lambda x: f"{x} - {dict(atc2_options).get(x, x)}",
-            key="atc2_filter"
-        )
-    else:
-        filters['atc2'] = []
-        st.sidebar.multiselect("ATC Niveau 2", [], disabled=True, help="Sélectionnez d'abord ATC Niveau 1")
-    
-    # Mise à jour des options si ATC2 sélectionné
-    if filters.get('atc2'):
-        filtered_options = get_current_options(filters)
-    
-    # ATC3 (conditionnel et dynamique)
-    if filters.get('atc2'):
-        atc3_options = filtered_options.get('atc3', [])
-        filters['atc3'] = st.sidebar.multiselect(
-            "ATC Niveau 3", 
-            options=[code for code, label in atc3_options],
-            format_func=lambda x: f"{x} - {dict(atc3_options).get(x, x)}",
-            key="atc3_filter"
-        )
-    else:
-        filters['atc3'] = []
-        st.sidebar.multiselect("ATC Niveau 3", [], disabled=True, help="Sélectionnez d'abord ATC Niveau 2")
-    
-    # Mise à jour des options si ATC3 sélectionné
-    if filters.get('atc3'):
-        filtered_options = get_current_options(filters)
-    
-    # ATC4 (conditionnel et dynamique)
-    if filters.get('atc3'):
-        atc4_options = filtered_options.get('atc4', [])
-        filters['atc4'] = st.sidebar.multiselect(
-            "ATC Niveau 4", 
-            options=[code for code, label in atc4_options],
-            format_func=lambda x: f"{x} - {dict(atc4_options).get(x, x)}",
-            key="atc4_filter"
-        )
-    else:
-        filters['atc4'] = []
-        st.sidebar.multiselect("ATC Niveau 4", [], disabled=True, help="Sélectionnez d'abord ATC Niveau 3")
-    
-    # Mise à jour des options si ATC4 sélectionné
-    if filters.get('atc4'):
-        filtered_options = get_current_options(filters)
-    
-    # ATC5 (conditionnel et dynamique)
-    if filters.get('atc4'):
-        atc5_options = filtered_options.get('atc5', [])
-        filters['atc5'] = st.sidebar.multiselect(
-            "ATC Niveau 5", 
-            options=[code for code, label in atc5_options],
-            format_func=lambda x: f"{x} - {dict(atc5_options).get(x, x)}",
-            key="atc5_filter"
-        )
-    else:
-        filters['atc5'] = []
-        st.sidebar.multiselect("ATC Niveau 5", [], disabled=True, help="Sélectionnez d'abord ATC Niveau 4")
-    
-    # Mise à jour finale des options avec tous les filtres ATC
-    filtered_options = get_current_options(filters)
+    # ATC2..ATC5 (conditionnels : enfants des codes choisis au niveau supérieur)
+    for parent, level in zip(ATC_LEVEL_KEYS, ATC_LEVEL_KEYS[1:]):
+        label = f"ATC Niveau {level[-1]}"
+        if filters.get(parent):
+            level_codes = [code for code, _ in atc_tree.options(level, filters)]
+            # Facettes connues : seuls les codes ayant des lignes pour les autres filtres (sélection conservée)
+            if level in boites:
+                selected = set(st.session_state.get(f"{level}_filter") or [])
+                level_codes = [code for code in level_codes if code in boites[level] or code in selected]
+            filters[level] = st.sidebar.multiselect(
+                label, 
+                options=level_codes,
+                format_func=lambda x, level=level: format_option(x, boites.get(level, {}).get(x), atc_tree.label(level, x)),
+                key=f"{level}_filter"
+            )
+        else:
+            filters[level] = []
+            st.sidebar.multiselect(label, [], disabled=True, help=f"Sélectionnez d'abord ATC Niveau {parent[-1]}")
     
     # Autres filtres dynamiques
     st.sidebar.subheader("🏥 Filtres Géographiques & Organisationnels")
@@ -679,12 +801,14 @@ def main():
     filters['villes'] = st.sidebar.multiselect(
         "🏙️ Villes", 
         options=filtered_options.get('villes', []),
+        format_func=lambda x: format_option(x, boites.get('villes', {}).get(x)),
         key="villes_filter"
     )
     
     filters['categories'] = st.sidebar.multiselect(
         "🏥 Catégories", 
         options=filtered_options.get('categories', []),
+        format_func=lambda x: format_option(x, boites.get('categories', {}).get(x)),
         key="categories_filter"
     )
     
@@ -699,13 +823,17 @@ def main():
     # Filtrer les établissements selon la recherche
     etab_options = filtered_options.get('etablissements', [])
     if search_etab:
-        search_lower = search_etab.lower().strip()
-        etab_options = [etab for etab in etab_options if search_lower in etab.lower()]
-        etab_options.sort()
+        # Index de trigrammes : sans accents, tolérant aux fautes, classé par qualité puis montant remboursé
+        etab_index = get_search_index('etablissements', dataset_version)
+        etab_options = etab_index.search(
+            search_etab, allowed=set(etab_options), weights=filtered_options.get('rem', {}).get('etablissements'),
+            positions=get_narrowing_search(etab_index, 'etab_search')(search_etab)
+        )
     
     filters['etablissements'] = st.sidebar.multiselect(
         "🏢 Établissements", 
         options=etab_options,
+        format_func=lambda x: format_option(x, boites.get('etablissements', {}).get(x)),
         help=f"{'❌ Aucun établissement trouvé pour \"' + search_etab + '\"' if search_etab and not etab_options else f'✅ {len(etab_options)} établissements disponibles'}",
         key="etablissements_filter"
     )
@@ -718,38 +846,29 @@ def main():
         key="med_search"
     )
     
-    # Mapping des noms commerciaux (maintenant on cherche directement dans l_cip13)
-    drug_aliases = {
-        'cabome': 'cabometyx',
-        'keytr': 'keytruda', 
-        'opdi': 'opdivo',
-        'tecfi': 'tecfidera',
-        'humi': 'humira',
-        'avast': 'avastin',
-        'hercep': 'herceptin'
-    }
-    
     # Utiliser les médicaments filtrés selon les autres critères
     med_options = filtered_options.get('medicaments', [])
     
     if search_term:
         search_lower = search_term.lower().strip()
-        # Recherche directe dans les noms commerciaux
-        direct_matches = [med for med in med_options if search_lower in med.lower()]
+        med_index = get_search_index('medicaments', dataset_version)
+        available = set(med_options)
+        med_rem = filtered_options.get('rem', {}).get('medicaments')
+        # Recherche directe dans les noms commerciaux (index de trigrammes, accents et fautes tolérés)
+        direct_matches = med_index.search(search_term, allowed=available, weights=med_rem,
+                                          positions=get_narrowing_search(med_index, 'med_search')(search_term))
         
-        # Recherche via alias (pour les abréviations)
-        alias_matches = []
-        for alias, full_name in drug_aliases.items():
-            if search_lower.startswith(alias):
-                alias_matches.extend([med for med in med_options if full_name.lower() in med.lower()])
+        # Recherche via alias (marque ou molécule → toutes les spécialités de la molécule), plus gros volumes d'abord
+        alias_labels = get_alias_index(dataset_version).resolve(search_lower) & available
+        alias_matches = sorted(alias_labels, key=lambda med: (-(med_rem or {}).get(med, 0), med))
         
-        # Combiner les résultats (sans doublons)
-        med_options = list(set(direct_matches + alias_matches))
-        med_options.sort()
+        # Combiner les résultats (sans doublons, ordre du classement)
+        med_options = list(dict.fromkeys(direct_matches + alias_matches))
     
     filters['medicaments'] = st.sidebar.multiselect(
         "💊 Médicaments", 
         options=med_options,
+        format_func=lambda x: format_option(x, boites.get('medicaments', {}).get(x)),
         key="medicaments_filter",
         help=f"{'❌ Aucun médicament trouvé pour \"' + search_term + '\"' if search_term and not med_options else f'✅ {len(med_options)} médicaments disponibles (filtrés automatiquement)'}"
     )
@@ -779,13 +898,14 @@ def main():
     with col2:
         if st.button("⚡ Actualiser", width="stretch"):
             st.cache_data.clear()
+            get_result_cache().clear()
             st.rerun()
     
     # KPIs (seulement si BigQuery disponible)
     client, project_id = init_bigquery()
     if client:
         with st.spinner("📊 Calcul des KPIs..."):
-            kpis = get_kpis(filters)
+            kpis = get_kpis(filters, dataset_version)
     else:
         # Mode cache uniquement - KPIs non disponibles
         kpis = {}
@@ -850,7 +970,7 @@ def main():
         with st.spinner("🏥 Chargement TOP établissements..."):
             client, project_id = init_bigquery()
             if client:
-                df_etabs = get_top_data("etablissements", filters, limit_etabs)
+                df_etabs = get_top_data("etablissements", filters, limit_etabs, dataset_version)
             else:
                 st.warning("⚠️ Données indisponibles - BigQuery non accessible")
                 df_etabs = pd.DataFrame()
@@ -882,7 +1002,7 @@ def main():
         with st.spinner("💊 Chargement TOP médicaments..."):
             client, project_id = init_bigquery()
             if client:
-                df_meds = get_top_data("medicaments", filters, limit_meds)
+                df_meds = get_top_data("medicaments", filters, limit_meds, dataset_version)
             else:
                 st.warning("⚠️ Données indisponibles - BigQuery non accessible")
                 df_meds = pd.DataFrame()
@@ -914,7 +1034,7 @@ def main():
         with st.spinner("🧬 Chargement TOP molécules..."):
             client, project_id = init_bigquery()
             if client:
-                df_mols = get_top_data("molecules", filters, limit_mols)
+                df_mols = get_top_data("molecules", filters, limit_mols, dataset_version)
             else:
                 st.warning("⚠️ Données indisponibles - BigQuery non accessible")
                 df_mols = pd.DataFrame()
@@ -10,10 +10,29 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import numpy as np
+import os
 from datetime import datetime
 import warnings
+from phmev_dataset import (DEFAULT_YEAR, LazyPhmevDataset, available_years, dataset_fingerprint,
+                           load_phmev_dataframe, load_year_dataframe, partitions_root, prepared_parquet_path,
+                           selectable_years, source_fingerprint, year_partition_path)
+from phmev_atc import AtcTree
+from phmev_cache import cached_result, get_result_cache
+from phmev_cooccurrence import CooccurrenceIndex
+from phmev_cube import (ROW_COUNT_COLUMN, PhmevCube, prepared_path_for_year, read_cubes, row_count,
+                        with_row_counts)
+from phmev_facets import FACET_COLUMNS, compute_facets, format_boites
+from phmev_index import BitmapIndex, FilterCascade
+from phmev_schema import FILTER_COLUMNS, cents_to_euros, isin_mask, present_pairs
+from phmev_search import TrigramIndex
+from phmev_store import (cooccurrence_key, cube_key, dataset_key, get_dataset_store, index_key,
+                         purge_session_copies)
 warnings.filterwarnings('ignore')
 
+if int(pd.__version__.split('.')[0]) < 3:
+    # Copy-on-Write : toute modification d'une vue dérivée copie au lieu d'écrire dans le dataset partagé (store)
+    pd.set_option('mode.copy_on_write', True)
+
 # Configuration de la page avec thème sombre
 st.set_page_config(
     page_title="🚀 PHMEV Analytics Pro",
@@ -576,433 +595,118 @@ setTimeout(function() {
 
 """, unsafe_allow_html=True)
 
-# Cache intelligent avec session_state pour éviter les rechargements
-def load_data_background(nrows=None):
-    """🚀 Charge les données PHMEV en arrière-plan (cache désactivé pour éviter les erreurs mémoire)"""
-    import os
+# Versions gardées par ressource en cache (une par année proposée) : celles d'un fichier remplacé sont libérées
+CACHED_VERSIONS = max(len(selectable_years()), 1)
+
+# Chargement des données : thread d'arrière-plan, résultat publié dans le store partagé (voir phmev_store.py)
+def load_data_background(report=None, year=DEFAULT_YEAR):
+    """🚀 Charge les données PHMEV dans le thread d'arrière-plan (aucun appel Streamlit : pas de session)"""
     import gc
     script_dir = os.path.dirname(os.path.abspath(__file__))
     
-    # UNIQUEMENT le fichier parquet complet (contient les 3,504,612 lignes)
-    parquet_path = os.path.join(script_dir, 'OPEN_PHMEV_2024.parquet')
-    
-    # Utiliser UNIQUEMENT OPEN_PHMEV_2024.parquet
-    if os.path.exists(parquet_path):
-        try:
-            # Message de progression pour Streamlit Cloud
-            progress_placeholder = st.empty()
-            progress_placeholder.info("🚀 Chargement des données PHMEV (3.5M lignes)...")
-            
-            # Optimisation mémoire pour Streamlit Cloud
-            df = pd.read_parquet(parquet_path, engine='pyarrow')
-            progress_placeholder.info("✅ Données chargées - Traitement en cours...")
-            
-            # Force garbage collection après chargement
-            gc.collect()
-            
-            # Filtrer les données non informatives
-            df = df[~df['l_cip13'].isin(['Non restitué', 'Non spécifié', 'Honoraires de dispensation'])]
-            df = df[df['l_cip13'].notna()]
-            progress_placeholder.info("🔄 Création des colonnes dérivées...")
-            
-            # Vérifier et créer les colonnes dérivées si nécessaire
-            if 'etablissement' not in df.columns:
-                df['etablissement'] = df['nom_etb'].astype(str).fillna('Non spécifié')
-                if 'raison_sociale_etb' in df.columns:
-                    df['etablissement'] = df['etablissement'].where(
-                        df['etablissement'] != 'nan', 
-                        df['raison_sociale_etb'].astype(str)
-                    )
-            
-            if 'medicament' not in df.columns:
-                df['medicament'] = df['L_ATC5'].astype(str).fillna('Non spécifié')
-            if 'categorie' not in df.columns:
-                df['categorie'] = df['categorie_jur'].astype(str).fillna('Non spécifiée')
-            if 'ville' not in df.columns:
-                df['ville'] = df['nom_ville'].astype(str).fillna('Non spécifiée')
-            if 'region' not in df.columns:
-                df['region'] = df['region_etb'].fillna(0)
-            if 'code_cip' not in df.columns:
-                df['code_cip'] = df['CIP13'].astype(str)
-            if 'libelle_cip' not in df.columns:
-                df['libelle_cip'] = df['l_cip13'].fillna('Non spécifié')
-            
-            # Calculs dérivés
-            if 'cout_par_boite' not in df.columns:
-                df['cout_par_boite'] = np.where(df['BOITES'] > 0, df['REM'] / df['BOITES'], 0)
-            if 'taux_remboursement' not in df.columns:
-                df['taux_remboursement'] = np.where(df['BSE'] > 0, (df['REM'] / df['BSE']) * 100, 0)
-            
-            progress_placeholder.success("✅ Données prêtes ! Application en cours de chargement...")
-            progress_placeholder.empty()
-            
-            return df
-        except MemoryError:
-            st.error("❌ Erreur mémoire : Le fichier est trop volumineux pour Streamlit Cloud")
-            st.info("💡 Essayez de réduire la taille du fichier ou utilisez un échantillon")
-            return None
-        except Exception as e:
-            st.error(f"❌ Erreur avec OPEN_PHMEV_2024.parquet: {e}")
-            st.info(f"🔍 Type d'erreur: {type(e).__name__}")
-            return None
-    
-    # Si le fichier n'existe pas, erreur
-    else:
-        st.error("❌ Fichier OPEN_PHMEV_2024.parquet non trouvé !")
-        st.info("💡 Veuillez vous assurer que le fichier OPEN_PHMEV_2024.parquet est présent dans le répertoire.")
-        return None
-        try:
-            import pyarrow.parquet as pq
-            df = pd.read_parquet(parquet_path, engine='pyarrow')
-            
-            # Vérifier si les colonnes dérivées existent déjà
-            if 'etablissement' not in df.columns:
-                st.info("🔧 Création des colonnes enrichies...")
-                # Création de colonnes enrichies avec gestion sécurisée des NaN
-                df['etablissement'] = df['nom_etb'].astype(str).fillna('Non spécifié')
-                if 'raison_sociale_etb' in df.columns:
-                    df['etablissement'] = df['etablissement'].where(
-                        df['etablissement'] != 'nan', 
-                        df['raison_sociale_etb'].astype(str)
-                    )
-                
-                df['medicament'] = df['L_ATC5'].astype(str).fillna('Non spécifié')
-                df['categorie'] = df['categorie_jur'].astype(str).fillna('Non spécifiée')
-                df['ville'] = df['nom_ville'].astype(str).fillna('Non spécifiée')
-                df['region'] = df['region_etb'].fillna(0)
-                df['code_cip'] = df['CIP13'].astype(str)
-                df['libelle_cip'] = df['l_cip13'].fillna('Non spécifié')
-                
-                # Calculs dérivés
-                df['cout_par_boite'] = np.where(df['BOITES'] > 0, df['REM'] / df['BOITES'], 0)
-                df['taux_remboursement'] = np.where(df['REM'] > 0, (df['BSE'] / df['REM']) * 100, 0)
-            
-            return df
-        except Exception as e:
-            st.warning(f"⚠️ Erreur avec le fichier Parquet: {e}. Essai avec le CSV...")
-    
-    # Fallback sur CSV
-    if os.path.exists(csv_path):
-        st.info("📁 Chargement depuis le fichier CSV")
+    if year in available_years():
+        # Disposition multi-années : seule la partition de l'année demandée est lue
+        df = load_year_dataframe(year, report=report)
     else:
-        # Si aucun fichier n'existe, utiliser les données d'exemple
-        try:
-            from sample_data import create_sample_data
-            st.warning("⚠️ Fichier PHMEV principal non trouvé. Utilisation de données d'exemple pour la démonstration.")
-            return create_sample_data()
-        except ImportError:
-            st.error("❌ Impossible de charger les données. Veuillez ajouter le fichier OPEN_PHMEV_2024_sample_10k.parquet")
-            return None
-    
-    # Types de données optimisés pour économiser la mémoire
-    dtype_dict = {
-        'CIP13': 'str', 
-        'l_cip13': 'str',
-        'BOITES': 'int32',
-        'region_etb': 'int16',
-        'nom_etb': 'string',
-        'raison_sociale_etb': 'string'
-    }
-    
-    try:
-        df = pd.read_csv(
-            csv_path, 
-            nrows=nrows, 
-            encoding='latin1', 
-            sep=';',
-            low_memory=True,
-            dtype=dtype_dict,
-            engine='c'
-        )
-        
-        # Création de colonnes enrichies avec gestion sécurisée des NaN
-        df['etablissement'] = df['nom_etb'].astype(str).fillna('Non spécifié')
-        if 'raison_sociale_etb' in df.columns:
-            df['etablissement'] = df['etablissement'].where(
-                df['etablissement'] != 'nan', 
-                df['raison_sociale_etb'].astype(str)
-            )
-        
-        df['medicament'] = df['L_ATC5'].astype(str).fillna('Non spécifié')
-        df['categorie'] = df['categorie_jur'].astype(str).fillna('Non spécifiée')
-        df['ville'] = df['nom_ville'].astype(str).fillna('Non spécifiée')
-        df['region'] = df['region_etb'].fillna(0)
-        
-        # Formatage des codes CIP et libellés (ajout pour cohérence avec load_data)
-        df['code_cip'] = df['CIP13'].astype(str)
-        df['libelle_cip'] = df['l_cip13'].fillna('Non spécifié')
-        
-        # Conversion des colonnes financières (format français)
-        def convert_french_decimal(series):
-            """Convertit les décimaux français (virgule) en float"""
-            cleaned = series.astype(str).str.strip()
-            cleaned = cleaned.replace(['', 'nan', 'NaN', 'NULL', 'null'], np.nan)
-            
-            def clean_french_number(x):
-                if pd.isna(x) or x == 'nan':
-                    return np.nan
-                x = str(x).strip()
-                if ',' in x:
-                    parts = x.split(',')
-                    if len(parts) == 2:
-                        entiere = parts[0].replace('.', '')
-                        decimale = parts[1]
-                        return f"{entiere}.{decimale}"
-                return x.replace('.', '') if '.' in x else x
-            
-            cleaned = cleaned.apply(clean_french_number)
-            return pd.to_numeric(cleaned, errors='coerce')
-        
-        # Conversion explicite en numérique pour éviter les erreurs de division
-        df['BOITES'] = pd.to_numeric(df['BOITES'], errors='coerce')
-        df['REM'] = convert_french_decimal(df['REM'])
-        df['BSE'] = convert_french_decimal(df['BSE'])
-        
-        # Calculs des métriques dérivées
-        df['cout_par_boite'] = np.where(df['BOITES'] > 0, df['REM'] / df['BOITES'], 0)
-        
-        return df
-        
-    except Exception as e:
-        st.error(f"❌ Erreur lors du chargement des données: {e}")
-        return None
+        # Copie IPC ou fichier préparé en priorité, sinon OPEN_PHMEV_2024.parquet (3,504,612 lignes)
+        df = load_phmev_dataframe(raw_path=os.path.join(script_dir, 'OPEN_PHMEV_2024.parquet'), report=report)
+    gc.collect()
+    return df
+
+def start_background_loading(year=DEFAULT_YEAR):
+    """🧵 Lance le chargement d'arrière-plan d'une année (une seule fois par processus, par année et par version)"""
+    # Empreinte du footer Parquet : un fichier reconstruit remplace immédiatement l'ancien dataset
+    return get_dataset_store().start_loading(
+        dataset_key(year), lambda report: load_data_background(report, year), version=source_fingerprint(year)
+    )
 
-def load_data(nrows=None):  # Charger toutes les lignes par défaut
-    """🚀 Interface de chargement avec pré-chargement automatique"""
-    
-    # Vérifier si les données sont déjà en session_state
-    if 'phmev_data_cached' in st.session_state and st.session_state.phmev_data_cached is not None:
-        return st.session_state.phmev_data_cached
+def get_bitmap_index(df, year=DEFAULT_YEAR):
+    """🗂️ Index bitmap du dataset, construit une fois en arrière-plan ; None tant qu'il n'est pas prêt"""
+    store = get_dataset_store()
+    future = store.start_loading(
+        index_key(year), lambda report: BitmapIndex.build(df, report), version=store.version(dataset_key(year))
+    )
+    if future.done() and future.exception() is None and len(future.result()) == len(df):
+        return future.result()
+    # En attendant : masques isin sur les codes entiers, mêmes résultats
+    return None
+
+def get_cooccurrence_index(df, year=DEFAULT_YEAR):
+    """🕸️ Matrices de co-occurrence du dataset, construites une fois en arrière-plan ; None tant qu'elles ne sont pas prêtes"""
+    store = get_dataset_store()
+    future = store.start_loading(
+        cooccurrence_key(year), lambda report: CooccurrenceIndex.build(df, report),
+        version=store.version(dataset_key(year))
+    )
+    if future.done() and future.exception() is None and len(future.result()) == len(df):
+        return future.result()
+    # En attendant : facettes calculées sur les lignes sélectionnées, mêmes résultats
+    return None
+
+def get_cube(df, year=DEFAULT_YEAR):
+    """🧊 Cube établissement × CIP13 du dataset : relu s'il a été écrit par le build, sinon agrégé en arrière-plan ; None tant qu'il n'est pas prêt"""
+    store = get_dataset_store()
+    future = store.start_loading(
+        cube_key(year), lambda report: PhmevCube.load_or_build(df, prepared_path_for_year(year), report),
+        version=store.version(dataset_key(year))
+    )
+    if future.done() and future.exception() is None and future.result().source_rows == len(df):
+        return future.result()
+    # En attendant : tableau de bord calculé sur les lignes filtrées, mêmes résultats
+    return None
+
+@st.cache_resource(show_spinner=False, max_entries=CACHED_VERSIONS)
+def get_lazy_cube(dataset_version, selected_years, partitioned):
+    """🧊 Cubes des années choisies en mode léger, lus depuis le build ; None si l'un manque ou n'est plus à jour"""
+    if partitioned:
+        return read_cubes({year: year_partition_path(year) for year in selected_years})
+    return read_cubes({None: prepared_parquet_path()})
+
+def get_filter_cascade(df, year=DEFAULT_YEAR, atc_tree=None):
+    """🪜 Cascade de filtres de la session : sélection de chaque niveau mémorisée d'une exécution à l'autre"""
+    version = (year, get_dataset_store().version(dataset_key(year)))
+    memo = st.session_state.get('filter_cascade_memo')
+    if memo is None or memo['version'] != version:
+        memo = st.session_state['filter_cascade_memo'] = {'version': version, 'levels': {}}
+    return FilterCascade(df, get_bitmap_index(df, year), memo['levels'], atc_tree)
+
+def load_data(nrows=None, year=DEFAULT_YEAR):  # Charger toutes les lignes par défaut
+    """🚀 Interface de chargement : attend le chargement d'arrière-plan partagé, sans jamais le relancer"""
+    from concurrent.futures import wait
+    purge_session_copies(st.session_state)
+    store = get_dataset_store()
+    future = start_background_loading(year)
+    
+    if not future.done():
+        # Progression en direct, mise à jour à chaque étape du thread de chargement
+        progress_bar = st.progress(0.0)
+        while not future.done():
+            fraction, message = store.progress(dataset_key(year))
+            progress_bar.progress(fraction, text=message)
+            wait([future], timeout=0.25)
+        progress_bar.empty()
     
     try:
-        # Interface de chargement uniquement si pas en cache
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        status_text.text("📁 Lecture du fichier CSV...")
-        progress_bar.progress(10)
-        
-        import os
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        # UNIQUEMENT le fichier parquet complet (contient les 3,504,612 lignes)
-        parquet_path = os.path.join(script_dir, 'OPEN_PHMEV_2024.parquet')
-        
-        # Utiliser UNIQUEMENT OPEN_PHMEV_2024.parquet
-        if os.path.exists(parquet_path):
-            status_text.text("🚀 Chargement des 3,504,612 lignes...")
-            progress_bar.progress(70)
-            try:
-                df = pd.read_parquet(parquet_path, engine='pyarrow')
-                progress_bar.progress(100)
-                status_text.text("✅ Données chargées avec succès !")
-                
-                # Nettoyage interface
-                import time, gc
-                time.sleep(0.5)
-                progress_bar.empty()
-                status_text.empty()
-                gc.collect()
-                
-                st.session_state.phmev_data_cached = df
-                return df
-            except Exception as e:
-                st.error(f"❌ Erreur avec OPEN_PHMEV_2024.parquet: {e}")
-                progress_bar.empty()
-                status_text.empty()
-                return None
-    
-        # Si le fichier n'existe pas, erreur
-        else:
-            progress_bar.empty()
-            status_text.empty()
-            st.error("❌ Fichier OPEN_PHMEV_2024.parquet non trouvé !")
-            st.info("💡 Veuillez vous assurer que le fichier OPEN_PHMEV_2024.parquet est présent dans le répertoire.")
-            return None
-        
-        # En local, essayer d'abord le format Parquet
-        if os.path.exists(parquet_path):
-            status_text.text("🚀 Chargement ultra-rapide depuis Parquet...")
-            progress_bar.progress(50)
-            try:
-                import pyarrow.parquet as pq
-                df = pd.read_parquet(parquet_path, engine='pyarrow')
-                
-                # Ajouter les colonnes dérivées si nécessaires
-                if 'etablissement' not in df.columns:
-                    df['etablissement'] = df['nom_etb'].astype(str).fillna('Non spécifié')
-                    if 'raison_sociale_etb' in df.columns:
-                        df['etablissement'] = df['etablissement'].where(
-                            df['etablissement'] != 'nan', 
-                            df['raison_sociale_etb'].astype(str)
-                        )
-                
-                if 'medicament' not in df.columns:
-                    df['medicament'] = df['L_ATC5'].astype(str).fillna('Non spécifié')
-                if 'categorie' not in df.columns:
-                    df['categorie'] = df['categorie_jur'].astype(str).fillna('Non spécifiée')
-                if 'ville' not in df.columns:
-                    df['ville'] = df['nom_ville'].astype(str).fillna('Non spécifiée')
-                if 'region' not in df.columns:
-                    df['region'] = df['region_etb'].fillna(0)
-                if 'code_cip' not in df.columns:
-                    df['code_cip'] = df['CIP13'].astype(str)
-                if 'libelle_cip' not in df.columns:
-                    df['libelle_cip'] = df['l_cip13'].fillna('Non spécifié')
-                
-                progress_bar.progress(100)
-                status_text.text("✅ Données Parquet chargées avec succès !")
-                st.session_state.phmev_data_cached = df
-                
-                # Nettoyage
-                import time, gc
-                time.sleep(1)
-                progress_bar.empty()
-                status_text.empty()
-                gc.collect()
-                
-                return df
-                
-            except Exception as e:
-                st.warning(f"⚠️ Erreur avec le fichier Parquet: {e}. Essai avec le CSV...")
-        
-        # Fallback sur CSV
-        if not os.path.exists(csv_path):
-            # Si aucun fichier n'existe, utiliser les données d'exemple
-            try:
-                from sample_data import create_sample_data
-                st.warning("⚠️ Fichier PHMEV principal non trouvé. Utilisation de données d'exemple pour la démonstration.")
-                df = create_sample_data()
-                st.session_state.phmev_data_cached = df
-                return df
-            except ImportError:
-                st.error("❌ Impossible de charger les données. Veuillez ajouter le fichier OPEN_PHMEV_2024_sample_10k.parquet")
-                return None
-        
-        # Optimisation mémoire maximale (sans category pour éviter les erreurs)
-        dtype_dict = {
-            'CIP13': 'str', 
-            'l_cip13': 'str',
-            'BOITES': 'int32',  # Au lieu de int64
-            'region_etb': 'int16',  # Au lieu de int64
-            'nom_etb': 'string',  # String nullable plus efficace
-            'raison_sociale_etb': 'string'
-        }
-        
-        df = pd.read_csv(
-            csv_path, 
-            nrows=nrows, 
-            encoding='latin1', 
-            sep=';',
-            low_memory=True,
-            dtype=dtype_dict,
-            engine='c'  # Moteur C plus rapide
-        )
-        
-        progress_bar.progress(40)
-        status_text.text("🔧 Nettoyage des données...")
-        
-        # Nettoyage et optimisation des données - vérification des colonnes
-        status_text.text("💰 Vérification des colonnes financières...")
-        
-        # Nettoyage des colonnes financières (format français avec virgules)
-        
-        # Conversion robuste des colonnes financières
-        def convert_french_decimal(series):
-            """Convertit les décimaux français (point milliers, virgule décimales) en float"""
-            cleaned = series.astype(str)
-            cleaned = cleaned.str.strip()
-            
-            # Remplacer les valeurs vides par NaN
-            cleaned = cleaned.replace(['', 'nan', 'NaN', 'NULL', 'null'], np.nan)
-            
-            # Gérer le format français : 336.578,01 → 336578.01
-            def clean_french_number(x):
-                if pd.isna(x) or x == 'nan':
-                    return np.nan
-                x = str(x).strip()
-                if ',' in x:
-                    # Séparer partie entière et décimales
-                    parts = x.split(',')
-                    if len(parts) == 2:
-                        # Partie entière : supprimer les points (milliers)
-                        entiere = parts[0].replace('.', '')
-                        # Partie décimale
-                        decimale = parts[1]
-                        # Reconstituer au format anglais
-                        return f"{entiere}.{decimale}"
-                # Si pas de virgule, supprimer les points (milliers seulement)
-                return x.replace('.', '') if '.' in x else x
-            
-            cleaned = cleaned.apply(clean_french_number)
-            return pd.to_numeric(cleaned, errors='coerce')
-        
-        # Appliquer la conversion
-        df['REM'] = convert_french_decimal(df['REM'])
-        df['BSE'] = convert_french_decimal(df['BSE'])
-        
-        # Statistiques de conversion
-        total_rows = len(df)
-        rem_valid = df['REM'].notna().sum()
-        bse_valid = df['BSE'].notna().sum()
-        
-        # Conversion réussie (message supprimé pour épurer l'interface)
-        
-        progress_bar.progress(60)
-        status_text.text("📊 Création des colonnes dérivées...")
-        
-        # Création de colonnes enrichies avec gestion sécurisée des NaN
-        df['etablissement'] = df['nom_etb'].astype(str).fillna('Non spécifié')
-        if 'raison_sociale_etb' in df.columns:
-            df['etablissement'] = df['etablissement'].where(
-                df['etablissement'] != 'nan', 
-                df['raison_sociale_etb'].astype(str)
-            )
-        
-        df['medicament'] = df['L_ATC5'].astype(str).fillna('Non spécifié')
-        df['categorie'] = df['categorie_jur'].astype(str).fillna('Non spécifiée')
-        df['ville'] = df['nom_ville'].astype(str).fillna('Non spécifiée')
-        df['region'] = df['region_etb'].fillna(0)
-        
-        # Formatage des codes CIP et libellés
-        df['code_cip'] = df['CIP13'].astype(str)
-        df['libelle_cip'] = df['l_cip13'].fillna('Non spécifié')
-        
-        # Garder les types par défaut pour éviter les problèmes de mémoire
-        
-        progress_bar.progress(80)
-        status_text.text("🧮 Calculs des métriques...")
-        
-        # Conversion explicite en numérique pour éviter les erreurs de division
-        # Note: REM et BSE sont déjà convertis par convert_french_decimal() plus haut
-        df['BOITES'] = pd.to_numeric(df['BOITES'], errors='coerce')
-        
-        # Calculs dérivés
-        df['cout_par_boite'] = df['REM'] / df['BOITES'].replace(0, np.nan)
-        df['taux_remboursement'] = (df['REM'] / df['BSE'].replace(0, np.nan) * 100).round(2)
-        
-        progress_bar.progress(100)
-        status_text.text("✅ Données chargées avec succès !")
-        
-        # Stocker en session_state pour éviter les rechargements
-        st.session_state.phmev_data_cached = df
-        
-        # Nettoyage de l'interface et mémoire
-        import time
-        import gc
-        time.sleep(1)  # Réduire le temps d'attente
-        progress_bar.empty()
-        status_text.empty()
-        gc.collect()  # Forcer le garbage collection
-        
-        return df
+        return future.result()
+    except FileNotFoundError:
+        st.error("❌ Fichier OPEN_PHMEV_2024.parquet non trouvé !")
+        st.info("💡 Veuillez vous assurer que le fichier OPEN_PHMEV_2024.parquet est présent dans le répertoire.")
+    except MemoryError:
+        st.error("❌ Erreur mémoire : Le fichier est trop volumineux pour Streamlit Cloud")
+        st.info("💡 Essayez de réduire la taille du fichier ou utilisez un échantillon")
     except Exception as e:
-        st.error(f"❌ Erreur lors du chargement: {e}")
-        return None
+        st.error(f"❌ Erreur avec OPEN_PHMEV_2024.parquet: {e}")
+        st.info(f"🔍 Type d'erreur: {type(e).__name__}")
+    return None
+
+@st.cache_data(show_spinner=False, persist=None)
+def get_all_filter_options(_df, dataset_version):
+    """🚀 Pré-calcule TOUTES les options de filtres en une seule fois pour une vitesse maximale
 
-@st.cache_data(show_spinner=False, ttl=1800, persist=None)
-def get_all_filter_options(df):
-    """🚀 Pré-calcule TOUTES les options de filtres en une seule fois pour une vitesse maximale"""
+    Clé de cache = version du dataset (empreinte de la source) : pas de hachage du DataFrame à chaque
+    exécution, pas d'expiration arbitraire, recalcul dès que de nouvelles données sont chargées.
+    """
+    df = _df
     
     def safe_sort_atc_items(items_dict):
         """Tri sécurisé des items ATC en gérant les types mixtes"""
@@ -1020,99 +724,286 @@ def get_all_filter_options(df):
         'atc4': safe_sort_atc_items(df[['atc4', 'L_ATC4']].drop_duplicates().set_index('atc4')['L_ATC4'].dropna().to_dict()),
         'atc5': safe_sort_atc_items(df[['ATC5', 'L_ATC5']].drop_duplicates().set_index('ATC5')['L_ATC5'].dropna().to_dict()),
         
-        # CIP avec index de recherche rapide (utiliser les colonnes originales)
+        # CIP (colonnes originales) ; la recherche passe par les index de trigrammes (get_search_index)
         'cip_codes': sorted([str(x) for x in df['CIP13'].dropna().unique()]),
         'cip_libelles': sorted([str(x) for x in df['l_cip13'].dropna().unique()]),
-        'cip_search_index': {str(lib).lower(): str(lib) for lib in df['l_cip13'].dropna().unique() if str(lib) not in ['Non restitué', 'Honoraires de dispensation']},
         
-        # Autres filtres avec index
+        # Autres filtres
         'etablissements': sorted([str(x) for x in df['etablissement'].dropna().unique()]),
-        'etablissements_index': {str(etab).lower(): str(etab) for etab in df['etablissement'].dropna().unique()},
         'categories': sorted([str(x) for x in df['categorie'].dropna().unique()]),
         'villes': sorted([str(x) for x in df['ville'].dropna().unique()]),
-        'villes_index': {str(ville).lower(): str(ville) for ville in df['ville'].dropna().unique()}
     }
     return options
 
-def ultra_fast_search(search_index, search_term, max_results=50):
-    """⚡ Recherche ultra-rapide avec scoring dans un index pré-calculé"""
-    if not search_term or len(search_term) < 2:
-        return []
+def get_filtered_dataframe(df, current_filters, cascade=None, dataset_version=None):
+    """🔄 Applique tous les filtres actuels et retourne le DataFrame filtré (cascade incrémentale ou masques sur codes)"""
+    if isinstance(df, LazyPhmevDataset):
+        # Mode léger : les filtres seront poussés vers la lecture Parquet
+        return df.filter(current_filters)
     
-    search_lower = search_term.lower().strip()
-    search_words = search_lower.split()
-    results = []
-    
-    for key_lower, original_value in search_index.items():
-        # Vérifier si tous les mots de recherche sont présents
-        if all(word in key_lower for word in search_words):
-            # Score: priorité aux correspondances exactes et au début
-            score = 0
-            if key_lower.startswith(search_lower):
-                score = -2  # Priorité maximale
-            elif search_lower in key_lower:
-                score = -1  # Priorité élevée
-            else:
-                score = len(search_words) - sum(1 for word in search_words if word in key_lower)
-            
-            results.append((score, original_value))
-    
-    # Trier par score puis alphabétiquement
-    results.sort(key=lambda x: (x[0], x[1].lower()))
-    return [item[1] for item in results[:max_results]]
-
-def get_filtered_dataframe(df, current_filters):
-    """🔄 Applique tous les filtres actuels et retourne le DataFrame filtré"""
-    df_filtered = df
-    
-    # Filtres ATC hiérarchiques
-    if current_filters.get('atc1_filtre'):
-        df_filtered = df_filtered[df_filtered['l_atc1'].isin(current_filters['atc1_filtre'])]
-    if current_filters.get('atc2_filtre'):
-        df_filtered = df_filtered[df_filtered['L_ATC2'].isin(current_filters['atc2_filtre'])]
-    if current_filters.get('atc3_filtre'):
-        df_filtered = df_filtered[df_filtered['L_ATC3'].isin(current_filters['atc3_filtre'])]
-    if current_filters.get('atc4_filtre'):
-        df_filtered = df_filtered[df_filtered['L_ATC4'].isin(current_filters['atc4_filtre'])]
-    if current_filters.get('atc5_filtre'):
-        df_filtered = df_filtered[df_filtered['L_ATC5'].isin(current_filters['atc5_filtre'])]
-    
-    # Filtres CIP/Médicaments
-    if current_filters.get('libelle_filtre'):
-        df_filtered = df_filtered[df_filtered['libelle_cip'].isin(current_filters['libelle_filtre'])]
+    if cascade is not None:
+        # Positions partagées entre sessions ; sinon niveaux inchangés servis par le memo de la session,
+        # le niveau modifié ne teste que les lignes déjà retenues
+        rows = cached_result('rows', dataset_version, current_filters, lambda: cascade.rows(current_filters))
+        return df if rows is None else df.take(rows)
+    
+    mask = None
+    for filter_key, column in FILTER_COLUMNS:
+        values = current_filters.get(filter_key)
+        if values:
+            column_mask = isin_mask(df[column], values)
+            mask = column_mask if mask is None else mask & column_mask
+    
+    return df if mask is None else df[mask]
+
+def get_dashboard_facts(df, current_filters, min_boites=0, cascade=None, cube=None, dataset_version=None):
+    """🧭 Routeur : cellules du cube si elles répondent à l'état de filtres, sinon lignes filtrées
+
+    Sommes et comptes distincts du tableau de bord sont identiques sur les cellules (établissement × CIP13),
+    bien moins nombreuses ; le seuil de boîtes par ligne reste évalué sur les lignes brutes.
+    """
+    if cube is not None and cube.answers(current_filters, min_boites):
+        return cube.filter(current_filters)
     
-    # Filtres géographiques et organisationnels
-    if current_filters.get('ville_filtre'):
-        df_filtered = df_filtered[df_filtered['ville'].isin(current_filters['ville_filtre'])]
-    if current_filters.get('categorie_filtre'):
-        df_filtered = df_filtered[df_filtered['categorie'].isin(current_filters['categorie_filtre'])]
-    if current_filters.get('etablissement_filtre'):
-        df_filtered = df_filtered[df_filtered['etablissement'].isin(current_filters['etablissement_filtre'])]
+    df_filtered = get_filtered_dataframe(df, current_filters, cascade, dataset_version)
+    if isinstance(df_filtered, LazyPhmevDataset):
+        # Mode léger : seules les lignes filtrées sont lues et décodées
+        df_filtered = df_filtered.scan()
     
+    # Appliquer le filtre de boîtes minimum
+    if min_boites > 0:
+        df_filtered = df_filtered[df_filtered['BOITES'] >= min_boites]
     return df_filtered
 
-def get_available_options(df_filtered, filter_type):
-    """📊 Retourne les options disponibles pour un type de filtre donné"""
-    if filter_type == 'atc1':
-        return sorted(df_filtered[['atc1', 'l_atc1']].drop_duplicates().set_index('atc1')['l_atc1'].dropna().to_dict().items())
-    elif filter_type == 'atc2':
-        return sorted(df_filtered[['atc2', 'L_ATC2']].drop_duplicates().set_index('atc2')['L_ATC2'].dropna().to_dict().items())
-    elif filter_type == 'atc3':
-        return sorted(df_filtered[['atc3', 'L_ATC3']].drop_duplicates().set_index('atc3')['L_ATC3'].dropna().to_dict().items())
-    elif filter_type == 'atc4':
-        return sorted(df_filtered[['atc4', 'L_ATC4']].drop_duplicates().set_index('atc4')['L_ATC4'].dropna().to_dict().items())
-    elif filter_type == 'atc5':
-        return sorted(df_filtered[['ATC5', 'L_ATC5']].drop_duplicates().set_index('ATC5')['L_ATC5'].dropna().to_dict().items())
-    elif filter_type == 'etablissements':
-        return sorted(df_filtered['etablissement'].dropna().unique().tolist())
-    elif filter_type == 'villes':
-        return sorted(df_filtered['ville'].dropna().unique().tolist())
-    elif filter_type == 'categories':
-        return sorted(df_filtered['categorie'].dropna().unique().tolist())
-    elif filter_type == 'medicaments':
-        return sorted([x for x in df_filtered['libelle_cip'].dropna().unique() if x not in ['Non restitué', 'Honoraires de dispensation']])
+# Libellés CIP exclus du top produits
+EXCLUDED_PRODUCT_LABELS = ['Non restitué', 'Non spécifié', 'Honoraires de dispensation']
+
+def compute_kpis(df_filtered):
+    """📊 Métriques globales de la sélection (REM/BSE en centimes entiers)"""
+    return {
+        'total_lignes': row_count(df_filtered),
+        'total_boites': df_filtered['BOITES'].sum(),
+        'total_rem': df_filtered['REM'].sum(),
+        'total_bse': df_filtered['BSE'].sum(),
+        'nb_etablissements': df_filtered['etablissement'].nunique(),
+    }
+
+def aggregate_etablissements(df_filtered):
+    """🏆 Boîtes, REM et BSE par établissement, avec coût par boîte et taux de remboursement"""
+    df_etb = df_filtered.groupby(['etablissement', 'ville', 'categorie'], observed=True).agg({
+        'BOITES': 'sum',
+        'REM': 'sum', 
+        'BSE': 'sum'
+    }).reset_index()
+    
+    # Sommes entières (BOITES int32, REM/BSE en centimes int64) : ni NaN ni conversion nécessaire
+    
+    # Calculer les métriques dérivées après le groupby avec gestion des zéros
+    df_etb['cout_par_boite'] = np.where(
+        df_etb['BOITES'] > 0, 
+        df_etb['REM'] / df_etb['BOITES'], 
+        0
+    )
+    df_etb['taux_remboursement'] = np.where(
+        df_etb['BSE'] > 0, 
+        (df_etb['REM'] / df_etb['BSE'] * 100).round(2), 
+        0
+    )
+    return df_etb
+
+def top_produits(df_filtered, n=15):
+    """💊 Top produits par boîtes (hors libellés non informatifs)"""
+    df_top_produits = df_filtered[
+        ~df_filtered['libelle_cip'].isin(EXCLUDED_PRODUCT_LABELS)
+    ].groupby(['libelle_cip'], observed=True).agg({
+        'BOITES': 'sum',
+        'REM': 'sum',
+        'BSE': 'sum',
+        'etablissement': 'nunique'
+    }).reset_index()
+    
+    # Calculer les métriques dérivées
+    df_top_produits['cout_par_boite'] = np.where(
+        df_top_produits['BOITES'] > 0,
+        df_top_produits['REM'] / df_top_produits['BOITES'],
+        0
+    )
+    df_top_produits['taux_remboursement'] = np.where(
+        df_top_produits['BSE'] > 0,
+        df_top_produits['REM'] / df_top_produits['BSE'] * 100,
+        0
+    )
+    
+    # Trier par nombre de boîtes et prendre le top
+    return df_top_produits.nlargest(n, 'BOITES')
+
+def top_molecules(df_filtered, n=15):
+    """🧪 Top molécules (ATC5) par boîtes, avec nombre d'établissements et de produits"""
+    # Filtrer les molécules valides (exclure "Non restitué" et NaN)
+    # Utiliser un masque pour éviter les problèmes de mémoire avec .copy()
+    mask_molecules = (
+        (df_filtered['L_ATC5'].notna()) & 
+        (df_filtered['L_ATC5'] != 'Non restitué') &
+        (df_filtered['L_ATC5'] != 'Non spécifié') &
+        (df_filtered['L_ATC5'].str.strip() != '')
+    )
+    df_molecules = df_filtered[mask_molecules]
+    
+    # Grouper par molécule (substance chimique)
+    df_top_molecules = df_molecules.groupby('L_ATC5', observed=True).agg({
+        'BOITES': 'sum',
+        'REM': 'sum',
+        'BSE': 'sum',
+        'etablissement': 'nunique',
+        'libelle_cip': 'nunique'  # Nombre de produits différents
+    }).reset_index()
+    
+    # Calculer les métriques dérivées
+    df_top_molecules['cout_par_boite'] = np.where(
+        df_top_molecules['BOITES'] > 0,
+        df_top_molecules['REM'] / df_top_molecules['BOITES'],
+        0
+    )
+    df_top_molecules['taux_remboursement'] = np.where(
+        df_top_molecules['BSE'] > 0,
+        df_top_molecules['REM'] / df_top_molecules['BSE'] * 100,
+        0
+    )
+    
+    # Trier par nombre de boîtes et prendre le top
+    return df_top_molecules.nlargest(n, 'BOITES')
+
+# Colonnes (code, libellé) de chaque niveau ATC
+ATC_OPTION_COLUMNS = {
+    'atc1': ('atc1', 'l_atc1'),
+    'atc2': ('atc2', 'L_ATC2'),
+    'atc3': ('atc3', 'L_ATC3'),
+    'atc4': ('atc4', 'L_ATC4'),
+    'atc5': ('ATC5', 'L_ATC5'),
+}
+
+# Liste d'options → filtre (et facette) correspondant
+OPTION_FILTERS = {
+    'atc1': 'atc1_filtre',
+    'atc2': 'atc2_filtre',
+    'atc3': 'atc3_filtre',
+    'atc4': 'atc4_filtre',
+    'atc5': 'atc5_filtre',
+    'medicaments': 'libelle_filtre',
+    'villes': 'ville_filtre',
+    'categories': 'categorie_filtre',
+    'etablissements': 'etablissement_filtre',
+}
+
+# Widget de chaque filtre interdépendant (valeur lue dans st.session_state avant affichage)
+FILTER_WIDGETS = {
+    'atc1': 'atc1_multiselect_interdep',
+    'atc2': 'atc2_multiselect_interdep',
+    'atc3': 'atc3_multiselect_interdep',
+    'atc4': 'atc4_multiselect_interdep',
+    'atc5': 'atc5_multiselect_interdep',
+    'medicaments': 'libelle_multiselect_interdep',
+    'villes': 'ville_multiselect_interdep',
+    'categories': 'categorie_multiselect_interdep',
+    'etablissements': 'etablissement_multiselect_interdep',
+}
+
+@st.cache_resource(show_spinner=False, max_entries=CACHED_VERSIONS)
+def get_atc_tree(_df, dataset_version):
+    """🌳 Arbre ATC du dataset (libellés, enfants, plages de lignes), construit une fois par version"""
+    df = _df
+    if isinstance(df, LazyPhmevDataset):
+        df = df.scan([col for columns in ATC_OPTION_COLUMNS.values() for col in columns])
+    return AtcTree.from_dataframe(df)
+
+# Listes avec champ de recherche (index de trigrammes sur la colonne de leur facette)
+SEARCH_FILTERS = ['medicaments', 'villes', 'etablissements']
+
+@st.cache_resource(show_spinner=False, max_entries=len(SEARCH_FILTERS) * CACHED_VERSIONS)
+def get_search_index(_df, dataset_version, filter_type):
+    """🔎 Index de trigrammes des libellés d'une liste, construit une fois par version (partagé entre sessions)"""
+    column = FACET_COLUMNS[OPTION_FILTERS[filter_type]]
+    values = _df.scan([column])[column] if isinstance(_df, LazyPhmevDataset) else _df[column]
+    values = values.cat.categories if isinstance(values.dtype, pd.CategoricalDtype) else values.dropna().unique()
+    return TrigramIndex(values)
+
+def get_narrowing_search(search_index, search_key):
+    """⌨️ Recherche au fil de la frappe d'un champ pour la session, recréée quand l'index change (nouvelle version)"""
+    narrowing = st.session_state.get(f"{search_key}_narrowing")
+    if narrowing is None or narrowing.shared is not search_index.prefix_cache:
+        narrowing = st.session_state[f"{search_key}_narrowing"] = search_index.narrowing()
+    return narrowing
+
+def get_pending_filters():
+    """🎛️ État complet des filtres interdépendants, lu dans les widgets de la session avant leur affichage
+
+    Les filtres ATC sont des ensembles de codes, évalués sur les colonnes de codes (libellés pour l'affichage).
+    """
+    return {OPTION_FILTERS[filter_type]: list(st.session_state.get(widget_key) or [])
+            for filter_type, widget_key in FILTER_WIDGETS.items()}
+
+def get_facets(df, current_filters, cascade=None, cooccurrence=None, dataset_version=None):
+    """🧮 Options + boîtes/REM de chaque filtre, chaque dimension ignorant son propre filtre (partagées entre sessions)"""
+    return cached_result('facets', dataset_version, current_filters, lambda: compute_facets(
+        df, current_filters, cascade.bitmap_index if cascade is not None else None, cooccurrence=cooccurrence
+    ))
+
+def get_available_options(facets, filter_type, atc_tree=None):
+    """📊 Options disponibles d'un filtre, lues dans les facettes ((code, libellé) pour l'ATC)"""
+    values = facets[OPTION_FILTERS[filter_type]].index
+    if filter_type in ATC_OPTION_COLUMNS:
+        return sorted((code, atc_tree.label(filter_type, code)) for code in values)
+    return sorted(values)
+
+def facet_multiselect(label, options, facets, filter_type, key):
+    """🎛️ Multiselect d'un filtre à facettes : options + sélection courante, boîtes affichées à côté"""
+    labels = dict(options) if filter_type in ATC_OPTION_COLUMNS else {}
+    values = list(labels) if labels else list(options)
+    # Une valeur sélectionnée reste proposée même si les autres filtres l'excluent (0 boîte)
+    offered = set(values)
+    values = [v for v in st.session_state.get(key) or [] if v not in offered] + values
+    facet = facets[OPTION_FILTERS[filter_type]]
+    boites = dict(zip(facet.index, facet['BOITES']))
+    return st.multiselect(
+        label,
+        options=values,
+        default=[],
+        format_func=lambda v: f"{v} - {labels[v]} {format_boites(boites.get(v, 0))}" if v in labels
+        else f"{v} {format_boites(boites.get(v, 0))}",
+        key=key
+    )
+
+@st.fragment
+def search_facet_multiselect(label, options, facets, filter_type, key, search_label, placeholder, search_key,
+                             empty_message=None, max_options=50, search_index=None):
+    """🔍 Fragment recherche + multiselect : une frappe ne relance que ce fragment ;
+    une sélection modifiée relance toute l'application (tout le tableau de bord dépend des filtres)
+
+    `search_index` (TrigramIndex) : recherche sans accents ni casse, tolérante aux fautes de frappe,
+    résultats classés par qualité de correspondance puis par montant remboursé pour les filtres actuels.
+    Au fil de la frappe, chaque recherche ne filtre que les résultats de la précédente (NarrowingSearch).
+    """
+    applied = list(st.session_state.get(key) or [])
+    search = st.text_input(search_label, placeholder=placeholder, key=search_key)
+    if search and search_index is not None:
+        facet = facets[OPTION_FILTERS[filter_type]]
+        shown = search_index.search(search, max_options, allowed=set(options), weights=dict(zip(facet.index, facet['REM'])),
+                                    positions=get_narrowing_search(search_index, search_key)(search))
+    elif search:
+        shown = [v for v in options if search.lower() in v.lower()][:max_options]
     else:
+        shown = options[:max_options]
+    
+    if not shown and not applied and empty_message:
+        st.info(empty_message)
         return []
+    selected = facet_multiselect(label, shown, facets, filter_type, key)
+    if st.session_state.get(f"{key}_applied", applied) != selected:
+        # Relance d'un fragment : la sélection change l'état des filtres de toute la page
+        st.session_state[f"{key}_applied"] = selected
+        st.rerun()
+    st.session_state[f"{key}_applied"] = selected
+    return selected
 
 def format_number(value):
     """💫 Formatage sexy des nombres"""
@@ -1128,9 +1019,10 @@ def format_number(value):
         return f"{value:,.0f}"
 
 def format_currency(value):
-    """💰 Formatage sexy des montants"""
+    """💰 Formatage sexy des montants (reçus en centimes entiers : seule conversion en euros de l'app)"""
     if pd.isna(value):
         return "N/A"
+    value = cents_to_euros(value)
     if value >= 1_000_000_000:
         return f"{value/1_000_000_000:.1f}B€"
     elif value >= 1_000_000:
@@ -1156,316 +1048,639 @@ def create_metric_card(title, value, delta=None, help_text="", icon="📊"):
     </div>
     """
 
-def initialize_app():
-    """🚀 Initialise l'application avec chargement en session uniquement"""
-    if 'data_preloaded' not in st.session_state:
-        st.session_state.data_preloaded = False
-        
-    if not st.session_state.data_preloaded:
-        # Pré-chargement en session uniquement (sans cache disque)
-        try:
-            if 'phmev_data_cached' not in st.session_state:
-                with st.spinner("🚀 Chargement initial des données optimisées..."):
-                    df = load_data_background()
-                    if df is not None:
-                        st.session_state.phmev_data_cached = df
-            st.session_state.data_preloaded = True
-        except Exception as e:
-            st.warning(f"⚠️ Chargement différé : {e}")
-            st.session_state.data_preloaded = True
+def initialize_app(year=DEFAULT_YEAR):
+    """🚀 Initialise l'application : lance le pré-chargement du dataset partagé sans bloquer l'affichage"""
+    try:
+        start_background_loading(year)
+    except Exception as e:
+        st.warning(f"⚠️ Chargement différé : {e}")
+
+def show_loading_preview():
+    """⏳ Pendant le chargement : aperçu des options depuis le cache intégré (aucune donnée ligne requise)"""
+    from filter_cache_embedded import get_embedded_cache
+    cache = get_embedded_cache()
+    st.markdown("## ⚡ **Filtres Interdépendants**")
+    st.info("⏳ Chargement des données en cours : les filtres seront actifs dans un instant")
+    st.caption(
+        f"🧬 {len(cache.get('atc1', []))} systèmes ATC · {len(cache.get('atc5', []))} substances · "
+        f"💊 {len(cache.get('medicaments', [])):,} médicaments"
+    )
+    st.caption(
+        f"🏙️ {len(cache.get('villes', [])):,} villes · 🏛️ {len(cache.get('categories', []))} types · "
+        f"🏥 {len(cache.get('etablissements', [])):,} établissements"
+    )
 
 def force_dark_theme():
     """Pas de thème - Streamlit par défaut"""
     pass
 
-def main():
-    # Forcer le thème sombre
-    force_dark_theme()
+@st.fragment
+def show_kpis(df_filtered, dataset_version, result_filters):
+    """💎 Fragment des métriques globales (dépend uniquement de l'état des filtres)"""
+    # 📊 KPIs Ultra Sexy
+    st.markdown('## 💎 Métriques Globales')
     
-    # Interface de configuration
-    st.sidebar.markdown("## ⚙️ **Configuration**")
+    # Le dataset est partagé en lecture seule : pas de conversion en place sur df_filtered
+    # (sans filtre actif, df_filtered EST le dataset partagé ou le cube). REM/BSE en centimes int64 : sommes entières
+    # exactes, converties en euros uniquement par format_currency().
     
-    # Option pour activer/désactiver le pré-chargement
-    auto_preload = st.sidebar.checkbox(
-        "🚀 Pré-chargement automatique", 
-        value=True, 
-        key="auto_preload_checkbox",
-        help="Charge les données automatiquement au démarrage"
-    )
+    # Calculs des métriques, partagés entre sessions pour un même état de filtres
+    kpis = cached_result('kpis', dataset_version, result_filters, lambda: compute_kpis(df_filtered))
+    total_boites = kpis['total_boites']
+    total_rem = kpis['total_rem']
+    total_bse = kpis['total_bse']
+    nb_etablissements = kpis['nb_etablissements']
     
-    # 🚀 Initialisation automatique au démarrage si activée
-    if auto_preload:
-        initialize_app()
+    # Calculer les métriques dérivées correctement
+    cout_moyen = total_rem / total_boites if total_boites > 0 else 0
+    taux_remb_moyen = (total_rem / total_bse * 100) if total_bse > 0 else 0
     
-    # 🔄 Vider le cache si nécessaire
-    if st.sidebar.button("🔄 Vider le cache"):
-        if 'phmev_data_cached' in st.session_state:
-            del st.session_state.phmev_data_cached
-        if 'data_preloaded' in st.session_state:
-            del st.session_state.data_preloaded
-        st.cache_data.clear()
-        st.rerun()
+    # Affichage des KPIs en grid ultra sexy
+    col1, col2, col3, col4 = st.columns(4)
     
-    # 🎨 Titre sexy de l'application
-    st.markdown("""
-    <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
-                padding: 2rem; border-radius: 15px; text-align: center; 
-                margin-bottom: 2rem; box-shadow: 0 10px 30px rgba(0,0,0,0.3);">
-        <h1 style="font-size: 3rem; font-weight: 700; margin: 0; color: white; 
-                   text-shadow: 2px 2px 4px rgba(0,0,0,0.3);">
-            🚀 PHMEV Analytics Pro
-        </h1>
-        <p style="font-size: 1.2rem; margin: 0.5rem 0 0 0; color: white; opacity: 0.9;">
-            ✨ Analyse avancée des délivrances pharmaceutiques
-        </p>
-    </div>
-    """, unsafe_allow_html=True)
+    with col1:
+        st.markdown(f"""
+        <div class="kpi-card boxes">
+            <div class="kpi-icon">📦</div>
+            <div class="kpi-value">{format_number(total_boites)}</div>
+            <div class="kpi-label">Total Boîtes</div>
+            <div class="kpi-delta">Boîtes délivrées</div>
+        </div>
+        """, unsafe_allow_html=True)
     
-    # 🔄 Chargement complet de toutes les données
-    df = load_data()  # Charger toutes les lignes du dataset
+    with col2:
+        st.markdown(f"""
+        <div class="kpi-card money">
+            <div class="kpi-icon">💰</div>
+            <div class="kpi-value">{format_currency(total_rem)}</div>
+            <div class="kpi-label">Montant Remboursé</div>
+            <div class="kpi-delta">Par l'Assurance Maladie</div>
+        </div>
+        """, unsafe_allow_html=True)
     
-    if df is None:
-        st.stop()
+    with col3:
+        st.markdown(f"""
+        <div class="kpi-card base">
+            <div class="kpi-icon">🏦</div>
+            <div class="kpi-value">{format_currency(total_bse)}</div>
+            <div class="kpi-label">Base Remboursable</div>
+            <div class="kpi-delta">Montant de référence</div>
+        </div>
+        """, unsafe_allow_html=True)
     
+    with col4:
+        st.markdown(f"""
+        <div class="kpi-card count">
+            <div class="kpi-icon">🏥</div>
+            <div class="kpi-value">{format_number(nb_etablissements)}</div>
+            <div class="kpi-label">Établissements</div>
+            <div class="kpi-delta">Établissements uniques</div>
+        </div>
+        """, unsafe_allow_html=True)
     
-    # 🚀 Pré-calcul ultra-rapide de TOUS les filtres
-    filter_options = get_all_filter_options(df)
+    # Métriques secondaires sexy
+    st.markdown("<br>", unsafe_allow_html=True)
+    col5, col6 = st.columns(2)
     
-    # 🎛️ Sidebar ultra moderne avec filtres interdépendants
-    with st.sidebar:
-        st.markdown("## ⚡ **Filtres Interdépendants**")
-        st.markdown("*Chaque sélection met à jour les autres filtres automatiquement*")
-        
-        # 🔄 SYSTÈME DE FILTRES INTERDÉPENDANTS
-        # Logique: ATC → Médicaments → Villes → Établissements
-        
-        # Initialiser les filtres actuels
-        current_filters = {}
-        
-        # ========== HIÉRARCHIE PHARMACEUTIQUE D'ABORD ==========
-        st.markdown("### 💊 **Hiérarchie Pharmaceutique (QUOI)**")
-        st.markdown("*Sélectionnez d'abord les médicaments qui vous intéressent*")
-        
-        # Niveau 1: ATC1
-        st.markdown("#### 🧬 **Systèmes Anatomiques (ATC1)**")
-        df_temp = get_filtered_dataframe(df, current_filters)
-        atc1_options = get_available_options(df_temp, 'atc1')
-        atc1_display = [f"{code} - {libelle}" for code, libelle in atc1_options]
-        
-        atc1_selection = st.multiselect(
-            f"Systèmes anatomiques ({len(atc1_options)} disponibles)",
-            options=atc1_display,
-            default=[],
-            key="atc1_multiselect_interdep"
-        )
-        
-        atc1_codes = [sel.split(' - ')[0] for sel in atc1_selection] if atc1_selection else []
-        atc1_filtre = [dict(atc1_options)[code] for code in atc1_codes] if atc1_codes else []
-        current_filters['atc1_filtre'] = atc1_filtre
-        
-        # Niveau 2: ATC2 (Groupes thérapeutiques)
-        st.markdown("#### 💉 **Groupes Thérapeutiques (ATC2)**")
-        df_temp = get_filtered_dataframe(df, current_filters)
-        atc2_options = get_available_options(df_temp, 'atc2')
-        atc2_display = [f"{code} - {libelle}" for code, libelle in atc2_options]
-        
-        if atc2_options:
-            atc2_selection = st.multiselect(
-                f"Groupes thérapeutiques ({len(atc2_options)} disponibles)",
-                options=atc2_display,
-                default=[],
-                key="atc2_multiselect_interdep"
-            )
-            
-            atc2_codes = [sel.split(' - ')[0] for sel in atc2_selection] if atc2_selection else []
-            atc2_filtre = [dict(atc2_options)[code] for code in atc2_codes] if atc2_codes else []
-        else:
-            atc2_filtre = []
-            st.info("👆 Sélectionnez d'abord des filtres pour voir les groupes thérapeutiques")
-        
-        current_filters['atc2_filtre'] = atc2_filtre
-        
-        # Niveau 3: ATC3 (Sous-groupes pharmacologiques)
-        st.markdown("#### 🔬 **Sous-groupes Pharmacologiques (ATC3)**")
-        df_temp = get_filtered_dataframe(df, current_filters)
-        atc3_options = get_available_options(df_temp, 'atc3')
-        atc3_display = [f"{code} - {libelle}" for code, libelle in atc3_options]
-        
-        if atc3_options:
-            atc3_selection = st.multiselect(
-                f"Sous-groupes pharmacologiques ({len(atc3_options)} disponibles)",
-                options=atc3_display,
-                default=[],
-                key="atc3_multiselect_interdep"
-            )
-            
-            atc3_codes = [sel.split(' - ')[0] for sel in atc3_selection] if atc3_selection else []
-            atc3_filtre = [dict(atc3_options)[code] for code in atc3_codes] if atc3_codes else []
-        else:
-            atc3_filtre = []
-            if current_filters.get('atc2_filtre'):
-                st.info("👆 Affinez vos sélections pour voir les sous-groupes")
-        
-        current_filters['atc3_filtre'] = atc3_filtre
-        
-        # Niveau 4: ATC4 (Groupes chimiques)
-        st.markdown("#### ⚗️ **Groupes Chimiques (ATC4)**")
-        df_temp = get_filtered_dataframe(df, current_filters)
-        atc4_options = get_available_options(df_temp, 'atc4')
-        atc4_display = [f"{code} - {libelle}" for code, libelle in atc4_options]
-        
-        if atc4_options:
-            atc4_selection = st.multiselect(
-                f"Groupes chimiques ({len(atc4_options)} disponibles)",
-                options=atc4_display,
-                default=[],
-                key="atc4_multiselect_interdep"
-            )
-            
-            atc4_codes = [sel.split(' - ')[0] for sel in atc4_selection] if atc4_selection else []
-            atc4_filtre = [dict(atc4_options)[code] for code in atc4_codes] if atc4_codes else []
-        else:
-            atc4_filtre = []
-        
-        current_filters['atc4_filtre'] = atc4_filtre
-        
-        # Niveau 5: ATC5 (Substances chimiques)
-        st.markdown("#### 🧪 **Substances Chimiques (ATC5)**")
-        df_temp = get_filtered_dataframe(df, current_filters)
-        atc5_options = get_available_options(df_temp, 'atc5')
-        atc5_display = [f"{code} - {libelle}" for code, libelle in atc5_options]
-        
-        if atc5_options:
-            atc5_selection = st.multiselect(
-                f"Substances chimiques ({len(atc5_options)} disponibles)",
-                options=atc5_display,
-                default=[],
-                key="atc5_multiselect_interdep"
-            )
-            
-            atc5_codes = [sel.split(' - ')[0] for sel in atc5_selection] if atc5_selection else []
-            atc5_filtre = [dict(atc5_options)[code] for code in atc5_codes] if atc5_codes else []
-        else:
-            atc5_filtre = []
-        
-        current_filters['atc5_filtre'] = atc5_filtre
-        
-        # Médicaments spécifiques
-        st.markdown("#### 💊 **Médicaments Spécifiques**")
-        df_temp = get_filtered_dataframe(df, current_filters)
-        medicaments_disponibles = get_available_options(df_temp, 'medicaments')
-        
-        libelle_search = st.text_input(
-            "🔍 Rechercher un médicament",
-            placeholder="Ex: cabometyx, doliprane, ventoline...",
-            key="libelle_search_interdep"
+    with col5:
+        st.markdown(f"""
+        <div class="kpi-card money" style="margin-top: 1rem;">
+            <div class="kpi-icon">💊</div>
+            <div class="kpi-value">{format_currency(cout_moyen)}</div>
+            <div class="kpi-label">Coût Moyen/Boîte</div>
+            <div class="kpi-delta">Par boîte délivrée</div>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    with col6:
+        taux_display = f"{taux_remb_moyen:.1f}%" if not pd.isna(taux_remb_moyen) else "N/A"
+        st.markdown(f"""
+        <div class="kpi-card base" style="margin-top: 1rem;">
+            <div class="kpi-icon">📊</div>
+            <div class="kpi-value">{taux_display}</div>
+            <div class="kpi-label">Taux Remboursement</div>
+            <div class="kpi-delta">Pourcentage moyen</div>
+        </div>
+        """, unsafe_allow_html=True)
+
+@st.fragment
+def show_top_etablissements(df_filtered, dataset_version, result_filters, current_filters):
+    """🏆 Fragment du classement des établissements : changer le nombre affiché ne relance que ce tableau"""
+    # 🏆 Analyse des Top établissements
+    title = st.empty()
+    col_top, col_pct = st.columns([3, 1])
+    with col_top:
+        top_n = st.slider(
+            "🏆 Top N établissements",
+            min_value=5,
+            max_value=100,
+            value=20,
+            step=5,
+            help="Nombre d'établissements dans le classement",
+            key="top_n_etablissements"
         )
+    with col_pct:
+        show_percentages = st.checkbox(
+            "📈 Afficher les pourcentages",
+            value=True,
+            help="Inclure les pourcentages dans les tableaux",
+            key="show_percentages"
+        )
+    title.markdown(f'## 🏆 Top {top_n} Établissements')
+    
+    # Agrégation par établissement (toutes lignes) : changer le nombre affiché relit le cache partagé
+    df_etb = cached_result('etablissements', dataset_version, result_filters,
+                           lambda: aggregate_etablissements(df_filtered))
+    
+    # Top N (les pourcentages sont calculés sur le top affiché, plus bas)
+    df_top = df_etb.nlargest(top_n, 'BOITES')
+    
+    # 📋 Tableau stylé
+    
+    # Formatage du tableau (optimisé mémoire)
+    df_display_data = {
+        'etablissement': df_top['etablissement'].tolist(),
+        'ville': df_top['ville'].tolist(),
+        'categorie': df_top['categorie'].tolist(),
+        'Boîtes': [format_number(x) for x in df_top['BOITES']],
+        'Remboursé': [format_currency(x) for x in df_top['REM']],
+        'Remboursable': [format_currency(x) for x in df_top['BSE']],
+        'Coût/Boîte': [format_currency(x) for x in df_top['cout_par_boite']],
+        'Taux Remb.': [f"{x:.1f}%" if not pd.isna(x) else "N/A" for x in df_top['taux_remboursement']]
+    }
+    
+    # Ajouter les colonnes ATC si nécessaires
+    if any([current_filters.get('atc1_filtre'), current_filters.get('atc2_filtre'), 
+            current_filters.get('atc3_filtre'), current_filters.get('atc4_filtre'), 
+            current_filters.get('atc5_filtre')]):
+        if current_filters.get('atc5_filtre') and 'L_ATC5' in df_top.columns:
+            df_display_data['L_ATC5'] = df_top['L_ATC5'].tolist()
+        elif current_filters.get('atc4_filtre') and 'L_ATC4' in df_top.columns:
+            df_display_data['L_ATC4'] = df_top['L_ATC4'].tolist()
+        elif current_filters.get('atc3_filtre') and 'L_ATC3' in df_top.columns:
+            df_display_data['L_ATC3'] = df_top['L_ATC3'].tolist()
+        elif current_filters.get('atc2_filtre') and 'L_ATC2' in df_top.columns:
+            df_display_data['L_ATC2'] = df_top['L_ATC2'].tolist()
+        elif current_filters.get('atc1_filtre') and 'l_atc1' in df_top.columns:
+            df_display_data['l_atc1'] = df_top['l_atc1'].tolist()
+    
+    # Ajouter les colonnes CIP si filtrées
+    if current_filters.get('libelle_filtre') and 'libelle_cip' in df_top.columns:
+        df_display_data['libelle_cip'] = df_top['libelle_cip'].tolist()
         
-        if libelle_search:
-            medicaments_filtered = [m for m in medicaments_disponibles if libelle_search.lower() in m.lower()][:50]
-        else:
-            medicaments_filtered = medicaments_disponibles[:50]
+    df_display = pd.DataFrame(df_display_data)
+    
+    # Les colonnes sont déjà nommées correctement dans df_display
+    columns_to_show = list(df_display.columns)
+    
+    # Calculer les pourcentages si demandés
+    if show_percentages:
+        # Recalculer les valeurs numériques pour les pourcentages
+        total_boites = df_top['BOITES'].sum()
+        total_rem = df_top['REM'].sum()
         
-        if medicaments_filtered:
-            libelle_filtre = st.multiselect(
-                f"Médicaments ({len(medicaments_disponibles)} disponibles)",
-                options=medicaments_filtered,
-                default=[],
-                key="libelle_multiselect_interdep"
-            )
-        else:
-            libelle_filtre = []
-            st.info("👆 Aucun médicament disponible pour cette sélection")
+        df_display['% Boîtes'] = [(x/total_boites*100) for x in df_top['BOITES']]
+        df_display['% Boîtes'] = [f"{x:.1f}%" for x in df_display['% Boîtes']]
         
-        current_filters['libelle_filtre'] = libelle_filtre
+        df_display['% Remboursé'] = [(x/total_rem*100) for x in df_top['REM']]
+        df_display['% Remboursé'] = [f"{x:.1f}%" for x in df_display['% Remboursé']]
         
-        st.markdown("---")
+        columns_to_show = list(df_display.columns)
+    
+    table_display = df_display
+    
+    st.dataframe(
+        table_display,
+        width='stretch',
+        hide_index=True
+    )
+    
+    # Export des données établissements (déplacé ici)
+    csv_data = table_display.to_csv(index=False).encode('utf-8')
+    st.download_button(
+        label="📥 Télécharger Top Établissements",
+        data=csv_data,
+        file_name=f"top_{top_n}_etablissements_phmev_pro_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+        mime="text/csv",
+        help="Export CSV du classement des établissements",
+        type="primary"
+    )
+
+@st.fragment
+def show_top_produits(df_filtered, dataset_version, result_filters):
+    """💊 Fragment du top produits"""
+    # 🏆 Top Produits pour les établissements sélectionnés
+    if len(df_filtered) > 0:
+        st.markdown('## 💊 Top Produits des Établissements Sélectionnés')
         
-        # ========== FILTRES GÉOGRAPHIQUES (OÙ) ==========
-        st.markdown("### 🌍 **Localisation Géographique (OÙ)**")
-        st.markdown("*Filtrez par localisation selon les médicaments sélectionnés*")
+        # Analyse des produits les plus délivrés (exclure Non restitué)
+        df_top_produits = cached_result('top_produits', dataset_version, result_filters,
+                                        lambda: top_produits(df_filtered))
         
-        # Villes (filtrées selon les médicaments sélectionnés)
-        st.markdown("#### 🏙️ **Villes**")
-        df_temp = get_filtered_dataframe(df, current_filters)
-        villes_disponibles = get_available_options(df_temp, 'villes')
+        # Formatage pour l'affichage (optimisé mémoire)
+        df_produits_data = {
+            'Produit': df_top_produits['libelle_cip'].tolist(),
+            'Boîtes': [format_number(x) for x in df_top_produits['BOITES']],
+            'Montant Remboursé': [format_currency(x) for x in df_top_produits['REM']],
+            'Base Remboursement': [format_currency(x) for x in df_top_produits['BSE']],
+            'Nb Établissements': df_top_produits['etablissement'].tolist(),
+            'Coût/Boîte': [format_currency(x) for x in df_top_produits['cout_par_boite']],
+            'Taux Remboursement': [f"{x:.1f}%" for x in df_top_produits['taux_remboursement']]
+        }
+        df_top_produits_display = pd.DataFrame(df_produits_data)
         
-        ville_search = st.text_input(
-            "🔍 Rechercher une ville",
-            placeholder="Tapez pour filtrer les villes...",
-            key="ville_search_interdep"
+        st.dataframe(
+            df_top_produits_display,
+            width='stretch',
+            hide_index=True
         )
         
-        if ville_search:
-            villes_filtered = [v for v in villes_disponibles if ville_search.lower() in v.lower()][:50]
-        else:
-            villes_filtered = villes_disponibles[:50]
-        
-        ville_filtre = st.multiselect(
-            f"Sélectionner les villes ({len(villes_disponibles)} disponibles)",
-            options=villes_filtered,
-            default=[],
-            key="ville_multiselect_interdep"
+        # Export des données produits
+        csv_data_produits = df_top_produits_display.to_csv(index=False).encode('utf-8')
+        st.download_button(
+            label="📥 Télécharger Top Produits",
+            data=csv_data_produits,
+            file_name=f"top_produits_phmev_pro_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+            mime="text/csv",
+            help="Export CSV du top des produits",
+            type="primary"
         )
-        current_filters['ville_filtre'] = ville_filtre
-        
-        st.markdown("---")
-        
-        # ========== FILTRES ORGANISATIONNELS (QUI) ==========
-        st.markdown("### 🏥 **Établissements de Santé (QUI)**")
-        st.markdown("*Filtrez par établissement selon médicaments et villes sélectionnés*")
-        
-        # Catégories d'établissements
-        st.markdown("#### 🏛️ **Types d'Établissements**")
-        df_temp = get_filtered_dataframe(df, current_filters)
-        categories_disponibles = get_available_options(df_temp, 'categories')
+
+@st.fragment
+def show_top_molecules(df_filtered, dataset_version, result_filters):
+    """🧪 Fragment du top molécules"""
+    # 🧪 TOP MOLÉCULES (SUBSTANCES CHIMIQUES)
+    if len(df_filtered) > 0 and 'L_ATC5' in df_filtered.columns:
+        st.markdown('## 🧪 Top Molécules (Substances Chimiques)')
         
-        categorie_filtre = st.multiselect(
-            f"Types d'établissement ({len(categories_disponibles)} disponibles)",
-            options=categories_disponibles,
-            default=[],
-            key="categorie_multiselect_interdep"
-        )
-        current_filters['categorie_filtre'] = categorie_filtre
+        df_top_molecules = cached_result('top_molecules', dataset_version, result_filters,
+                                         lambda: top_molecules(df_filtered))
         
-        # Établissements spécifiques
-        st.markdown("#### 🏥 **Établissements Spécifiques**")
-        df_temp = get_filtered_dataframe(df, current_filters)
-        etablissements_disponibles = get_available_options(df_temp, 'etablissements')
+        if len(df_top_molecules) > 0:
+            # Affichage du tableau uniquement (sans graphique)
+            # Formatage pour l'affichage (optimisé mémoire)
+            df_display_data = {
+                'Molécule': df_top_molecules['L_ATC5'].tolist(),
+                'Boîtes': [format_number(x) for x in df_top_molecules['BOITES']],
+                'Montant Remboursé': [format_currency(x) for x in df_top_molecules['REM']],
+                'Base Remboursement': [format_currency(x) for x in df_top_molecules['BSE']],
+                'Nb Établissements': df_top_molecules['etablissement'].tolist(),
+                'Nb Produits': df_top_molecules['libelle_cip'].tolist(),
+                'Coût/Boîte': [format_currency(x) for x in df_top_molecules['cout_par_boite']],
+                'Taux Remboursement': [f"{x:.1f}%" for x in df_top_molecules['taux_remboursement']]
+            }
+            df_top_molecules_display = pd.DataFrame(df_display_data)
+            
+            st.dataframe(
+                df_top_molecules_display,
+                width='stretch',
+                hide_index=True
+            )
+            
+            # Export des données molécules
+            csv_data_molecules = df_top_molecules_display.to_csv(index=False).encode('utf-8')
+            st.download_button(
+                label="📥 Télécharger Top Molécules",
+                data=csv_data_molecules,
+                file_name=f"top_molecules_phmev_pro_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                mime="text/csv",
+                help="Export CSV du top des molécules",
+                type="primary"
+            )
+        else:
+            st.info("🔍 Aucune molécule spécifique trouvée avec les filtres actuels.")
+
+@st.fragment
+def show_cip_analysis(df_filtered, current_filters):
+    """📋 Fragment de l'analyse des codes CIP sélectionnés"""
+    # 📋 Analyse des codes CIP si filtrés
+    if current_filters.get('libelle_filtre'):
+        st.markdown('<h2 class="section-header">📋 Analyse des Codes CIP</h2>', unsafe_allow_html=True)
         
-        etablissement_search = st.text_input(
-            "🔍 Rechercher un établissement",
-            placeholder="Tapez pour filtrer les établissements...",
-            key="etablissement_search_interdep"
-        )
+        # Analyse par code CIP
+        df_cip = with_row_counts(df_filtered).groupby(['code_cip', 'libelle_cip'], observed=True).agg({
+            'BOITES': 'sum',
+            'REM': 'sum',
+            'BSE': 'sum',
+            'etablissement': 'nunique',
+            'cout_par_boite': 'sum',
+            ROW_COUNT_COLUMN: 'sum'
+        }).reset_index()
         
-        if etablissement_search:
-            etablissements_filtered = [e for e in etablissements_disponibles if etablissement_search.lower() in e.lower()][:50]
-        else:
-            etablissements_filtered = etablissements_disponibles[:50]
+        # Moyenne par ligne brute : cellules du cube et lignes portent la somme et le nombre de lignes
+        df_cip['cout_par_boite'] = df_cip['cout_par_boite'] / df_cip.pop(ROW_COUNT_COLUMN)
         
-        etablissement_filtre = st.multiselect(
-            f"Sélectionner les établissements ({len(etablissements_disponibles)} disponibles)",
-            options=etablissements_filtered,
-            default=[],
-            key="etablissement_multiselect_interdep"
-        )
-        current_filters['etablissement_filtre'] = etablissement_filtre
+        df_cip.columns = ['Code CIP', 'Libellé', 'Boîtes', 'Remboursé', 'Remboursable', 'Nb Établissements', 'Coût Moyen/Boîte']
         
-        st.markdown("---")
+        # Formatage
+        df_cip['Boîtes'] = df_cip['Boîtes'].apply(format_number)
+        df_cip['Remboursé'] = df_cip['Remboursé'].apply(format_currency)
+        df_cip['Remboursable'] = df_cip['Remboursable'].apply(format_currency)
+        df_cip['Coût Moyen/Boîte'] = df_cip['Coût Moyen/Boîte'].apply(format_currency)
         
-        # ========== PARAMÈTRES D'ANALYSE ==========
+        st.markdown("### 💊 **Détail des Codes CIP Sélectionnés**")
+        st.dataframe(df_cip, width='stretch', hide_index=True)
         
-        st.markdown("### 📊 **Paramètres d'analyse**")
-        top_n = st.slider(
-            "🏆 Top N établissements",
-            min_value=5,
-            max_value=100,
-            value=20,
-            step=5,
-            help="Nombre d'établissements dans le classement"
+        # Graphique des CIP les plus délivrés
+        if len(df_cip) > 1:
+            # Créer un libellé court pour l'affichage (optimisé mémoire)
+            df_top10 = df_cip.head(10)
+            libelles_courts = [x[:30] + "..." if len(x) > 30 else x for x in df_top10['Libellé']]
+            boites_values = [float(x.replace('K', '000').replace('M', '000000').replace(',', '')) if 'K' in x or 'M' in x else float(x.replace(',', '')) for x in df_top10['Boîtes']]
+            
+            fig_cip = px.bar(
+                x=libelles_courts,
+                y=boites_values,
+                title="📋 Top 10 Codes CIP par Boîtes Délivrées",
+                color_discrete_sequence=['#f093fb'],
+                labels={'x': 'Libellé', 'y': 'Boîtes'}
+            )
+            
+            fig_cip.update_layout(
+                height=400,
+                plot_bgcolor='rgba(0,0,0,0)',
+                paper_bgcolor='rgba(0,0,0,0)',
+                font=dict(color='white'),
+                title_font_size=16,
+                xaxis_tickangle=-45
+            )
+            
+            st.plotly_chart(fig_cip, width='stretch')
+
+def main():
+    # Forcer le thème sombre
+    force_dark_theme()
+    
+    # Interface de configuration
+    st.sidebar.markdown("## ⚙️ **Configuration**")
+    
+    # Option pour activer/désactiver le pré-chargement
+    auto_preload = st.sidebar.checkbox(
+        "🚀 Pré-chargement automatique", 
+        value=True, 
+        key="auto_preload_checkbox",
+        help="Charge les données automatiquement au démarrage"
+    )
+    
+    # 🪶 Mode léger : pas de dataset en mémoire, chaque lecture filtre à la source (Streamlit Cloud)
+    lazy_mode = st.sidebar.checkbox(
+        "🪶 Mode léger (lecture filtrée)",
+        value=os.environ.get('PHMEV_LAZY_MODE') == '1',
+        key="lazy_mode_checkbox",
+        help="Ne lit que les lignes correspondant aux filtres actifs (nécessite le fichier préparé)"
+    )
+    
+    # 📅 Années : une partition par année (OPEN_PHMEV/year=YYYY/), chargée seulement si elle est choisie,
+    # et l'année du fichier historique OPEN_PHMEV_2024 tant qu'il existe (même sans partition)
+    years = available_years()
+    year_choices = selectable_years()
+    selected_years = [DEFAULT_YEAR]
+    if years:
+        selected_years = st.sidebar.multiselect(
+            "📅 Années analysées",
+            year_choices,
+            default=[year_choices[-1]],
+            key="annees_multiselect",
+            help="Plusieurs années : lecture filtrée des seules partitions choisies, sans les charger en mémoire"
+        ) or [year_choices[-1]]
+        if len(selected_years) > 1 and not lazy_mode:
+            st.sidebar.caption("🪶 Plusieurs années : mode léger activé")
+            lazy_mode = True
+    
+    # Mode léger : lecture des partitions choisies ; l'année du seul fichier historique se lit à part
+    lazy_partitioned = any(y in years for y in selected_years)
+    legacy_only = [y for y in selected_years if y not in years]
+    if lazy_mode and lazy_partitioned and legacy_only:
+        st.sidebar.warning(f"⚠️ {', '.join(map(str, legacy_only))} : fichier historique seul, non lu avec les "
+                           f"partitions (lancez build_analytics_dataset.py --year {legacy_only[0]})")
+        selected_years = [y for y in selected_years if y in years]
+    year = selected_years[0]
+    
+    lazy_source = partitions_root() if lazy_partitioned else prepared_parquet_path()
+    if lazy_mode and not os.path.exists(lazy_source):
+        st.sidebar.warning("⚠️ Mode léger indisponible : lancez build_analytics_dataset.py")
+        lazy_mode = False
+    
+    # 🚀 Initialisation automatique au démarrage si activée
+    if auto_preload and not lazy_mode:
+        initialize_app(year)
+    
+    # 🔄 Vider le cache si nécessaire
+    if st.sidebar.button("🔄 Vider le cache"):
+        # Libère les datasets partagés (toutes années) : ils seront relus au prochain chargement
+        get_dataset_store().evict()
+        get_result_cache().clear()
+        purge_session_copies(st.session_state)
+        st.cache_data.clear()
+        st.rerun()
+    
+    # 🎨 Titre sexy de l'application
+    st.markdown("""
+    <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
+                padding: 2rem; border-radius: 15px; text-align: center; 
+                margin-bottom: 2rem; box-shadow: 0 10px 30px rgba(0,0,0,0.3);">
+        <h1 style="font-size: 3rem; font-weight: 700; margin: 0; color: white; 
+                   text-shadow: 2px 2px 4px rgba(0,0,0,0.3);">
+            🚀 PHMEV Analytics Pro
+        </h1>
+        <p style="font-size: 1.2rem; margin: 0.5rem 0 0 0; color: white; opacity: 0.9;">
+            ✨ Analyse avancée des délivrances pharmaceutiques
+        </p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # 🔄 Chargement complet de toutes les données (ou vue filtrée à la source en mode léger)
+    preview = st.sidebar.empty()
+    if not lazy_mode:
+        future = get_dataset_store().loading_future(dataset_key(year))
+        if future is None or not future.done():
+            with preview.container():
+                show_loading_preview()
+    if lazy_mode:
+        # Filtre d'année poussé vers la lecture : les partitions non choisies ne sont jamais ouvertes
+        df = LazyPhmevDataset(lazy_source, {'annee_filtre': selected_years} if lazy_partitioned else None)
+    else:
+        df = load_data(year=year)  # Charger toutes les lignes de l'année
+    preview.empty()
+    
+    if df is None:
+        st.stop()
+    
+    # 💾 Une seule copie du dataset pour toutes les sessions du processus
+    memory = get_dataset_store().memory_report()
+    cache_stats = get_result_cache().stats()
+    st.sidebar.caption(
+        f"💾 Dataset partagé : {memory['datasets_bytes'] / 1024**2:,.0f} Mo · "
+        f"RSS processus : {memory['process_rss_bytes'] / 1024**2:,.0f} Mo · "
+        f"Cache résultats : {cache_stats['bytes'] / 1024**2:,.0f} Mo ({cache_stats['hit_rate']:.0%} de hits)"
+    )
+    
+    # 🚀 Pré-calcul ultra-rapide de TOUS les filtres
+    cascade, cooccurrence, cube = None, None, None
+    if lazy_mode:
+        dataset_version = (dataset_fingerprint(lazy_source), tuple(selected_years))
+    else:
+        dataset_version = get_dataset_store().version(dataset_key(year))
+        filter_options = get_all_filter_options(df, dataset_version)
+    atc_tree = get_atc_tree(df, dataset_version)
+    search_indexes = {filter_type: get_search_index(df, dataset_version, filter_type) for filter_type in SEARCH_FILTERS}
+    if lazy_mode:
+        cube = get_lazy_cube(dataset_version, tuple(selected_years), lazy_partitioned)
+    else:
+        cascade = get_filter_cascade(df, year, atc_tree)
+        cooccurrence = get_cooccurrence_index(df, year)
+        cube = get_cube(df, year)
+    if cube is not None:
+        st.sidebar.caption(f"🧊 Cube : {len(cube):,} cellules pour {cube.source_rows:,} lignes (÷{cube.compression:,.1f})")
+    
+    # 🎛️ Sidebar ultra moderne avec filtres interdépendants
+    with st.sidebar:
+        st.markdown("## ⚡ **Filtres Interdépendants**")
+        st.markdown("*Chaque sélection met à jour les autres filtres automatiquement*")
+        
+        # 🔄 SYSTÈME DE FILTRES INTERDÉPENDANTS
+        # Logique: ATC → Médicaments → Villes → Établissements
+        
+        # 🧮 Facettes : l'état complet des filtres est lu dans les widgets de la session avant leur affichage ;
+        # chaque liste ignore son propre filtre et affiche les boîtes de chaque option
+        current_filters = get_pending_filters()
+        facets = get_facets(df, current_filters, cascade, cooccurrence, dataset_version)
+        
+        # ========== HIÉRARCHIE PHARMACEUTIQUE D'ABORD ==========
+        st.markdown("### 💊 **Hiérarchie Pharmaceutique (QUOI)**")
+        st.markdown("*Sélectionnez d'abord les médicaments qui vous intéressent*")
+        
+        # Niveau 1: ATC1
+        st.markdown("#### 🧬 **Systèmes Anatomiques (ATC1)**")
+        atc1_options = get_available_options(facets, 'atc1', atc_tree)
+        atc1_codes = facet_multiselect(
+            f"Systèmes anatomiques ({len(atc1_options)} disponibles)",
+            atc1_options, facets, 'atc1', "atc1_multiselect_interdep"
+        )
+        current_filters['atc1_filtre'] = atc1_codes
+        
+        # Niveau 2: ATC2 (Groupes thérapeutiques)
+        st.markdown("#### 💉 **Groupes Thérapeutiques (ATC2)**")
+        atc2_options = get_available_options(facets, 'atc2', atc_tree)
+        
+        if atc2_options:
+            atc2_codes = facet_multiselect(
+                f"Groupes thérapeutiques ({len(atc2_options)} disponibles)",
+                atc2_options, facets, 'atc2', "atc2_multiselect_interdep"
+            )
+        else:
+            atc2_codes = []
+            st.info("👆 Sélectionnez d'abord des filtres pour voir les groupes thérapeutiques")
+        
+        current_filters['atc2_filtre'] = atc2_codes
+        
+        # Niveau 3: ATC3 (Sous-groupes pharmacologiques)
+        st.markdown("#### 🔬 **Sous-groupes Pharmacologiques (ATC3)**")
+        atc3_options = get_available_options(facets, 'atc3', atc_tree)
+        
+        if atc3_options:
+            atc3_codes = facet_multiselect(
+                f"Sous-groupes pharmacologiques ({len(atc3_options)} disponibles)",
+                atc3_options, facets, 'atc3', "atc3_multiselect_interdep"
+            )
+        else:
+            atc3_codes = []
+            if current_filters.get('atc2_filtre'):
+                st.info("👆 Affinez vos sélections pour voir les sous-groupes")
+        
+        current_filters['atc3_filtre'] = atc3_codes
+        
+        # Niveau 4: ATC4 (Groupes chimiques)
+        st.markdown("#### ⚗️ **Groupes Chimiques (ATC4)**")
+        atc4_options = get_available_options(facets, 'atc4', atc_tree)
+        
+        if atc4_options:
+            atc4_codes = facet_multiselect(
+                f"Groupes chimiques ({len(atc4_options)} disponibles)",
+                atc4_options, facets, 'atc4', "atc4_multiselect_interdep"
+            )
+        else:
+            atc4_codes = []
+        
+        current_filters['atc4_filtre'] = atc4_codes
+        
+        # Niveau 5: ATC5 (Substances chimiques)
+        st.markdown("#### 🧪 **Substances Chimiques (ATC5)**")
+        atc5_options = get_available_options(facets, 'atc5', atc_tree)
+        
+        if atc5_options:
+            atc5_codes = facet_multiselect(
+                f"Substances chimiques ({len(atc5_options)} disponibles)",
+                atc5_options, facets, 'atc5', "atc5_multiselect_interdep"
+            )
+        else:
+            atc5_codes = []
+        
+        current_filters['atc5_filtre'] = atc5_codes
+        
+        # Médicaments spécifiques
+        st.markdown("#### 💊 **Médicaments Spécifiques**")
+        medicaments_disponibles = get_available_options(facets, 'medicaments')
+        
+        current_filters['libelle_filtre'] = search_facet_multiselect(
+            f"Médicaments ({len(medicaments_disponibles)} disponibles)", medicaments_disponibles, facets,
+            'medicaments', "libelle_multiselect_interdep",
+            "🔍 Rechercher un médicament", "Ex: cabometyx, doliprane, ventoline...", "libelle_search_interdep",
+            empty_message="👆 Aucun médicament disponible pour cette sélection",
+            search_index=search_indexes['medicaments']
         )
         
+        st.markdown("---")
+        
+        # ========== FILTRES GÉOGRAPHIQUES (OÙ) ==========
+        st.markdown("### 🌍 **Localisation Géographique (OÙ)**")
+        st.markdown("*Filtrez par localisation selon les médicaments sélectionnés*")
+        
+        # Villes (filtrées selon les autres filtres sélectionnés)
+        st.markdown("#### 🏙️ **Villes**")
+        villes_disponibles = get_available_options(facets, 'villes')
+        
+        current_filters['ville_filtre'] = search_facet_multiselect(
+            f"Sélectionner les villes ({len(villes_disponibles)} disponibles)", villes_disponibles, facets,
+            'villes', "ville_multiselect_interdep",
+            "🔍 Rechercher une ville", "Tapez pour filtrer les villes...", "ville_search_interdep",
+            search_index=search_indexes['villes']
+        )
+        
+        st.markdown("---")
+        
+        # ========== FILTRES ORGANISATIONNELS (QUI) ==========
+        st.markdown("### 🏥 **Établissements de Santé (QUI)**")
+        st.markdown("*Filtrez par établissement selon médicaments et villes sélectionnés*")
+        
+        # Catégories d'établissements
+        st.markdown("#### 🏛️ **Types d'Établissements**")
+        categories_disponibles = get_available_options(facets, 'categories')
+        
+        categorie_filtre = facet_multiselect(
+            f"Types d'établissement ({len(categories_disponibles)} disponibles)",
+            categories_disponibles, facets, 'categories', "categorie_multiselect_interdep"
+        )
+        current_filters['categorie_filtre'] = categorie_filtre
+        
+        # Établissements spécifiques
+        st.markdown("#### 🏥 **Établissements Spécifiques**")
+        etablissements_disponibles = get_available_options(facets, 'etablissements')
+        
+        current_filters['etablissement_filtre'] = search_facet_multiselect(
+            f"Sélectionner les établissements ({len(etablissements_disponibles)} disponibles)",
+            etablissements_disponibles, facets, 'etablissements', "etablissement_multiselect_interdep",
+            "🔍 Rechercher un établissement", "Tapez pour filtrer les établissements...",
+            "etablissement_search_interdep", search_index=search_indexes['etablissements']
+        )
+        
+        st.markdown("---")
+        
+        # ========== PARAMÈTRES D'ANALYSE ==========
+        
+        st.markdown("### 📊 **Paramètres d'analyse**")
+        # Top N et pourcentages : réglés dans le fragment du classement (sans relancer tout le tableau de bord)
+        
         # Filtres avancés
         with st.expander("⚙️ **Filtres Avancés**"):
             min_boites = st.number_input(
@@ -1474,19 +1689,10 @@ def main():
                 value=0,
                 help="Seuil minimum de boîtes délivrées"
             )
-            
-            show_percentages = st.checkbox(
-                "📈 Afficher les pourcentages",
-                value=True,
-                help="Inclure les pourcentages dans les tableaux"
-            )
     
-    # 🔧 Application des filtres interdépendants
-    df_filtered = get_filtered_dataframe(df, current_filters)
-    
-    # Appliquer le filtre de boîtes minimum
-    if min_boites > 0:
-        df_filtered = df_filtered[df_filtered['BOITES'] >= min_boites]
+    # 🔧 Application des filtres interdépendants (cube pré-agrégé dès qu'il peut répondre)
+    df_filtered = get_dashboard_facts(df, current_filters, min_boites, cascade, cube, dataset_version)
+    n_lignes = row_count(df_filtered)
     
     # 📊 Indicateur de filtrage actif avec nouveau système
     filters_active = []
@@ -1511,10 +1717,10 @@ def main():
                 <span style="font-size: 2rem;">📅</span>
                 <div>
                     <div style="font-weight: 700; color: white; font-size: 1.3rem;">
-                        2024
+                        {", ".join(str(y) for y in selected_years)}
                     </div>
                     <div style="font-size: 0.9rem; color: rgba(255,255,255,0.8); text-transform: uppercase; letter-spacing: 0.5px;">
-                        Année étudiée
+                        {"Années étudiées" if len(selected_years) > 1 else "Année étudiée"}
                     </div>
                 </div>
             </div>
@@ -1555,7 +1761,7 @@ def main():
                         <span style="font-size: 1.5rem;">📊</span>
                         <div>
                             <div style="font-size: 1.8rem; font-weight: 700;">
-                                {len(df_filtered):,}
+                                {n_lignes:,}
                             </div>
                             <div style="font-size: 0.9rem; opacity: 0.8;">
                                 Lignes filtrées
@@ -1566,7 +1772,7 @@ def main():
                         <span style="font-size: 1.5rem;">📈</span>
                         <div>
                             <div style="font-size: 1.8rem; font-weight: 700;">
-                                {len(df_filtered)/len(df)*100:.1f}%
+                                {n_lignes/len(df)*100:.1f}%
                             </div>
                             <div style="font-size: 0.9rem; opacity: 0.8;">
                                 du dataset total
@@ -1599,387 +1805,29 @@ def main():
         """, unsafe_allow_html=True)
         st.stop()
     
-    # 📊 KPIs Ultra Sexy
-    st.markdown('## 💎 Métriques Globales')
-    
-    # Conversion finale des colonnes numériques pour éviter les erreurs de division
-    # Note: REM et BSE sont déjà au bon format numérique depuis le chargement
-    df_filtered['BOITES'] = pd.to_numeric(df_filtered['BOITES'], errors='coerce').fillna(0)
-    df_filtered['REM'] = df_filtered['REM'].fillna(0)
-    df_filtered['BSE'] = df_filtered['BSE'].fillna(0)
-    
-    # Calculs des métriques avec vérification
-    total_boites = df_filtered['BOITES'].sum()
-    total_rem = df_filtered['REM'].sum()
-    total_bse = df_filtered['BSE'].sum()
-    nb_etablissements = df_filtered['etablissement'].nunique()
-    
-    # Calculer les métriques dérivées correctement
-    cout_moyen = total_rem / total_boites if total_boites > 0 else 0
-    taux_remb_moyen = (total_rem / total_bse * 100) if total_bse > 0 else 0
-    
-    # Affichage des KPIs en grid ultra sexy
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        st.markdown(f"""
-        <div class="kpi-card boxes">
-            <div class="kpi-icon">📦</div>
-            <div class="kpi-value">{format_number(total_boites)}</div>
-            <div class="kpi-label">Total Boîtes</div>
-            <div class="kpi-delta">Boîtes délivrées</div>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    with col2:
-        st.markdown(f"""
-        <div class="kpi-card money">
-            <div class="kpi-icon">💰</div>
-            <div class="kpi-value">{format_currency(total_rem)}</div>
-            <div class="kpi-label">Montant Remboursé</div>
-            <div class="kpi-delta">Par l'Assurance Maladie</div>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    with col3:
-        st.markdown(f"""
-        <div class="kpi-card base">
-            <div class="kpi-icon">🏦</div>
-            <div class="kpi-value">{format_currency(total_bse)}</div>
-            <div class="kpi-label">Base Remboursable</div>
-            <div class="kpi-delta">Montant de référence</div>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    with col4:
-        st.markdown(f"""
-        <div class="kpi-card count">
-            <div class="kpi-icon">🏥</div>
-            <div class="kpi-value">{format_number(nb_etablissements)}</div>
-            <div class="kpi-label">Établissements</div>
-            <div class="kpi-delta">Établissements uniques</div>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    # Métriques secondaires sexy
-    st.markdown("<br>", unsafe_allow_html=True)
-    col5, col6 = st.columns(2)
-    
-    with col5:
-        st.markdown(f"""
-        <div class="kpi-card money" style="margin-top: 1rem;">
-            <div class="kpi-icon">💊</div>
-            <div class="kpi-value">{format_currency(cout_moyen)}</div>
-            <div class="kpi-label">Coût Moyen/Boîte</div>
-            <div class="kpi-delta">Par boîte délivrée</div>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    with col6:
-        taux_display = f"{taux_remb_moyen:.1f}%" if not pd.isna(taux_remb_moyen) else "N/A"
-        st.markdown(f"""
-        <div class="kpi-card base" style="margin-top: 1rem;">
-            <div class="kpi-icon">📊</div>
-            <div class="kpi-value">{taux_display}</div>
-            <div class="kpi-label">Taux Remboursement</div>
-            <div class="kpi-delta">Pourcentage moyen</div>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    
-    # 🏆 Analyse des Top établissements
-    st.markdown(f'## 🏆 Top {top_n} Établissements')
-    
-    # Agrégation avec les colonnes essentielles
-    groupby_cols = ['etablissement', 'ville', 'categorie']
-    
-    df_etb = df_filtered.groupby(groupby_cols).agg({
-        'BOITES': 'sum',
-        'REM': 'sum', 
-        'BSE': 'sum'
-    }).reset_index()
-    
-    # Conversion des colonnes numériques dans df_etb pour éviter les erreurs
-    # Note: REM et BSE sont déjà au bon format numérique depuis le chargement
-    df_etb['BOITES'] = pd.to_numeric(df_etb['BOITES'], errors='coerce').fillna(0)
-    df_etb['REM'] = df_etb['REM'].fillna(0)
-    df_etb['BSE'] = df_etb['BSE'].fillna(0)
-    
-    # Calculer les métriques dérivées après le groupby avec gestion des zéros
-    df_etb['cout_par_boite'] = np.where(
-        df_etb['BOITES'] > 0, 
-        df_etb['REM'] / df_etb['BOITES'], 
-        0
-    )
-    df_etb['taux_remboursement'] = np.where(
-        df_etb['BSE'] > 0, 
-        (df_etb['REM'] / df_etb['BSE'] * 100).round(2), 
-        0
-    )
-    
-    # Calcul des pourcentages avec protection contre division par zéro
-    if show_percentages:
-        df_etb['pct_boites'] = (df_etb['BOITES'] / max(total_boites, 1) * 100).round(2)
-        df_etb['pct_rem'] = (df_etb['REM'] / max(total_rem, 1) * 100).round(2)
-        df_etb['pct_bse'] = (df_etb['BSE'] / max(total_bse, 1) * 100).round(2)
-    
-    # Top N
-    df_top = df_etb.nlargest(top_n, 'BOITES')
-    
-    # 📋 Tableau stylé
-    
-    # Formatage du tableau (optimisé mémoire)
-    df_display_data = {
-        'etablissement': df_top['etablissement'].tolist(),
-        'ville': df_top['ville'].tolist(),
-        'categorie': df_top['categorie'].tolist(),
-        'Boîtes': [format_number(x) for x in df_top['BOITES']],
-        'Remboursé': [format_currency(x) for x in df_top['REM']],
-        'Remboursable': [format_currency(x) for x in df_top['BSE']],
-        'Coût/Boîte': [format_currency(x) for x in df_top['cout_par_boite']],
-        'Taux Remb.': [f"{x:.1f}%" if not pd.isna(x) else "N/A" for x in df_top['taux_remboursement']]
-    }
-    
-    # Ajouter les colonnes ATC si nécessaires
-    if any([current_filters.get('atc1_filtre'), current_filters.get('atc2_filtre'), 
-            current_filters.get('atc3_filtre'), current_filters.get('atc4_filtre'), 
-            current_filters.get('atc5_filtre')]):
-        if current_filters.get('atc5_filtre') and 'L_ATC5' in df_top.columns:
-            df_display_data['L_ATC5'] = df_top['L_ATC5'].tolist()
-        elif current_filters.get('atc4_filtre') and 'L_ATC4' in df_top.columns:
-            df_display_data['L_ATC4'] = df_top['L_ATC4'].tolist()
-        elif current_filters.get('atc3_filtre') and 'L_ATC3' in df_top.columns:
-            df_display_data['L_ATC3'] = df_top['L_ATC3'].tolist()
-        elif current_filters.get('atc2_filtre') and 'L_ATC2' in df_top.columns:
-            df_display_data['L_ATC2'] = df_top['L_ATC2'].tolist()
-        elif current_filters.get('atc1_filtre') and 'l_atc1' in df_top.columns:
-            df_display_data['l_atc1'] = df_top['l_atc1'].tolist()
-    
-    # Ajouter les colonnes CIP si filtrées
-    if current_filters.get('libelle_filtre') and 'libelle_cip' in df_top.columns:
-        df_display_data['libelle_cip'] = df_top['libelle_cip'].tolist()
-        
-    df_display = pd.DataFrame(df_display_data)
-    
-    # Les colonnes sont déjà nommées correctement dans df_display
-    columns_to_show = list(df_display.columns)
-    
-    # Calculer les pourcentages si demandés
-    if show_percentages:
-        # Recalculer les valeurs numériques pour les pourcentages
-        total_boites = df_top['BOITES'].sum()
-        total_rem = df_top['REM'].sum()
-        
-        df_display['% Boîtes'] = [(x/total_boites*100) for x in df_top['BOITES']]
-        df_display['% Boîtes'] = [f"{x:.1f}%" for x in df_display['% Boîtes']]
-        
-        df_display['% Remboursé'] = [(x/total_rem*100) for x in df_top['REM']]
-        df_display['% Remboursé'] = [f"{x:.1f}%" for x in df_display['% Remboursé']]
-        
-        columns_to_show = list(df_display.columns)
-    
-    table_display = df_display
-    
-    st.dataframe(
-        table_display,
-        width='stretch',
-        hide_index=True
-    )
-    
-    # Export des données établissements (déplacé ici)
-    csv_data = table_display.to_csv(index=False).encode('utf-8')
-    st.download_button(
-        label="📥 Télécharger Top Établissements",
-        data=csv_data,
-        file_name=f"top_{top_n}_etablissements_phmev_pro_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-        mime="text/csv",
-        help="Export CSV du classement des établissements",
-        type="primary"
-    )
-    
-    
-    # 🏆 Top Produits pour les établissements sélectionnés
-    if len(df_filtered) > 0:
-        st.markdown('## 💊 Top Produits des Établissements Sélectionnés')
-        
-        # Analyse des produits les plus délivrés (exclure Non restitué)
-        df_top_produits = df_filtered[
-            ~df_filtered['libelle_cip'].isin(['Non restitué', 'Non spécifié', 'Honoraires de dispensation'])
-        ].groupby(['libelle_cip']).agg({
-            'BOITES': 'sum',
-            'REM': 'sum',
-            'BSE': 'sum',
-            'etablissement': 'nunique'
-        }).reset_index()
-        
-        # Calculer les métriques dérivées
-        df_top_produits['cout_par_boite'] = np.where(
-            df_top_produits['BOITES'] > 0,
-            df_top_produits['REM'] / df_top_produits['BOITES'],
-            0
-        )
-        df_top_produits['taux_remboursement'] = np.where(
-            df_top_produits['BSE'] > 0,
-            df_top_produits['REM'] / df_top_produits['BSE'] * 100,
-            0
-        )
-        
-        # Trier par nombre de boîtes et prendre le top 15
-        df_top_produits = df_top_produits.nlargest(15, 'BOITES')
-        
-        # Formatage pour l'affichage (optimisé mémoire)
-        df_produits_data = {
-            'Produit': df_top_produits['libelle_cip'].tolist(),
-            'Boîtes': [format_number(x) for x in df_top_produits['BOITES']],
-            'Montant Remboursé': [format_currency(x) for x in df_top_produits['REM']],
-            'Base Remboursement': [format_currency(x) for x in df_top_produits['BSE']],
-            'Nb Établissements': df_top_produits['etablissement'].tolist(),
-            'Coût/Boîte': [format_currency(x) for x in df_top_produits['cout_par_boite']],
-            'Taux Remboursement': [f"{x:.1f}%" for x in df_top_produits['taux_remboursement']]
-        }
-        df_top_produits_display = pd.DataFrame(df_produits_data)
-        
-        st.dataframe(
-            df_top_produits_display,
-            width='stretch',
-            hide_index=True
-        )
-        
-        # Export des données produits
-        csv_data_produits = df_top_produits_display.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label="📥 Télécharger Top Produits",
-            data=csv_data_produits,
-            file_name=f"top_produits_phmev_pro_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-            mime="text/csv",
-            help="Export CSV du top des produits",
-            type="primary"
-        )
-        
-    
-    # 🧪 TOP MOLÉCULES (SUBSTANCES CHIMIQUES)
-    if len(df_filtered) > 0 and 'L_ATC5' in df_filtered.columns:
-        st.markdown('## 🧪 Top Molécules (Substances Chimiques)')
-        
-        # Filtrer les molécules valides (exclure "Non restitué" et NaN)
-        # Utiliser un masque pour éviter les problèmes de mémoire avec .copy()
-        mask_molecules = (
-            (df_filtered['L_ATC5'].notna()) & 
-            (df_filtered['L_ATC5'] != 'Non restitué') &
-            (df_filtered['L_ATC5'] != 'Non spécifié') &
-            (df_filtered['L_ATC5'].str.strip() != '')
+    # 📅 Comparaison annuelle (plusieurs partitions lues en mode léger)
+    if 'year' in df_filtered.columns and df_filtered['year'].nunique() > 1:
+        st.markdown('## 📅 Comparaison annuelle')
+        yearly = df_filtered.groupby('year', observed=True).agg(
+            Boites=('BOITES', 'sum'), Remboursement=('REM', 'sum'), Base=('BSE', 'sum'),
+            Etablissements=('etablissement', 'nunique'),
         )
-        df_molecules = df_filtered[mask_molecules]
-        
-        if len(df_molecules) > 0:
-            # Grouper par molécule (substance chimique)
-            df_top_molecules = df_molecules.groupby('L_ATC5').agg({
-                'BOITES': 'sum',
-                'REM': 'sum',
-                'BSE': 'sum',
-                'etablissement': 'nunique',
-                'libelle_cip': 'nunique'  # Nombre de produits différents
-            }).reset_index()
-            
-            # Calculer les métriques dérivées
-            df_top_molecules['cout_par_boite'] = np.where(
-                df_top_molecules['BOITES'] > 0,
-                df_top_molecules['REM'] / df_top_molecules['BOITES'],
-                0
-            )
-            df_top_molecules['taux_remboursement'] = np.where(
-                df_top_molecules['BSE'] > 0,
-                df_top_molecules['REM'] / df_top_molecules['BSE'] * 100,
-                0
-            )
-            
-            # Trier par nombre de boîtes et prendre le top 15
-            df_top_molecules = df_top_molecules.nlargest(15, 'BOITES')
-            
-            # Affichage du tableau uniquement (sans graphique)
-            # Formatage pour l'affichage (optimisé mémoire)
-            df_display_data = {
-                'Molécule': df_top_molecules['L_ATC5'].tolist(),
-                'Boîtes': [format_number(x) for x in df_top_molecules['BOITES']],
-                'Montant Remboursé': [format_currency(x) for x in df_top_molecules['REM']],
-                'Base Remboursement': [format_currency(x) for x in df_top_molecules['BSE']],
-                'Nb Établissements': df_top_molecules['etablissement'].tolist(),
-                'Nb Produits': df_top_molecules['libelle_cip'].tolist(),
-                'Coût/Boîte': [format_currency(x) for x in df_top_molecules['cout_par_boite']],
-                'Taux Remboursement': [f"{x:.1f}%" for x in df_top_molecules['taux_remboursement']]
-            }
-            df_top_molecules_display = pd.DataFrame(df_display_data)
-            
-            st.dataframe(
-                df_top_molecules_display,
-                width='stretch',
-                hide_index=True
-            )
-            
-            # Export des données molécules
-            csv_data_molecules = df_top_molecules_display.to_csv(index=False).encode('utf-8')
-            st.download_button(
-                label="📥 Télécharger Top Molécules",
-                data=csv_data_molecules,
-                file_name=f"top_molecules_phmev_pro_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                mime="text/csv",
-                help="Export CSV du top des molécules",
-                type="primary"
-            )
-        else:
-            st.info("🔍 Aucune molécule spécifique trouvée avec les filtres actuels.")
+        yearly['Remboursement'] = yearly['Remboursement'].apply(format_currency)
+        yearly['Base'] = yearly['Base'].apply(format_currency)
+        yearly['Boites'] = yearly['Boites'].apply(format_number)
+        st.dataframe(yearly, width='stretch')
+    
+    # 🧩 Tableau de bord en fragments : chacun dépend explicitement de l'état des filtres passé en argument
+    # et se relance seul quand l'un de ses widgets change (résultats relus dans le cache partagé)
+    result_filters = {**current_filters, 'min_boites': min_boites}
+    show_kpis(df_filtered, dataset_version, result_filters)
+    show_top_etablissements(df_filtered, dataset_version, result_filters, current_filters)
+    show_top_produits(df_filtered, dataset_version, result_filters)
+    show_top_molecules(df_filtered, dataset_version, result_filters)
     
     # Section "📊 Systèmes Thérapeutiques Sélectionnés" supprimée sur demande utilisateur
     
-    # 📋 Analyse des codes CIP si filtrés
-    if current_filters.get('libelle_filtre'):
-        st.markdown('<h2 class="section-header">📋 Analyse des Codes CIP</h2>', unsafe_allow_html=True)
-        
-        # Analyse par code CIP
-        df_cip = df_filtered.groupby(['code_cip', 'libelle_cip']).agg({
-            'BOITES': 'sum',
-            'REM': 'sum',
-            'BSE': 'sum',
-            'etablissement': 'nunique',
-            'cout_par_boite': 'mean'
-        }).reset_index()
-        
-        df_cip.columns = ['Code CIP', 'Libellé', 'Boîtes', 'Remboursé', 'Remboursable', 'Nb Établissements', 'Coût Moyen/Boîte']
-        
-        # Formatage
-        df_cip['Boîtes'] = df_cip['Boîtes'].apply(format_number)
-        df_cip['Remboursé'] = df_cip['Remboursé'].apply(format_currency)
-        df_cip['Remboursable'] = df_cip['Remboursable'].apply(format_currency)
-        df_cip['Coût Moyen/Boîte'] = df_cip['Coût Moyen/Boîte'].apply(format_currency)
-        
-        st.markdown("### 💊 **Détail des Codes CIP Sélectionnés**")
-        st.dataframe(df_cip, width='stretch', hide_index=True)
-        
-        # Graphique des CIP les plus délivrés
-        if len(df_cip) > 1:
-            # Créer un libellé court pour l'affichage (optimisé mémoire)
-            df_top10 = df_cip.head(10)
-            libelles_courts = [x[:30] + "..." if len(x) > 30 else x for x in df_top10['Libellé']]
-            boites_values = [float(x.replace('K', '000').replace('M', '000000').replace(',', '')) if 'K' in x or 'M' in x else float(x.replace(',', '')) for x in df_top10['Boîtes']]
-            
-            fig_cip = px.bar(
-                x=libelles_courts,
-                y=boites_values,
-                title="📋 Top 10 Codes CIP par Boîtes Délivrées",
-                color_discrete_sequence=['#f093fb'],
-                labels={'x': 'Libellé', 'y': 'Boîtes'}
-            )
-            
-            fig_cip.update_layout(
-                height=400,
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                font=dict(color='white'),
-                title_font_size=16,
-                xaxis_tickangle=-45
-            )
-            
-            st.plotly_chart(fig_cip, width='stretch')
+    show_cip_analysis(df_filtered, current_filters)
     
     # Section d'export supprimée - boutons déplacés sous chaque tableau
     
@@ -1988,8 +1836,8 @@ def main():
         st.markdown(f"""
         ### 📊 **Statistiques du Dataset**
         - **Lignes totales:** {len(df):,}
-        - **Lignes filtrées:** {len(df_filtered):,}
-        - **Taux de filtrage:** {(len(df_filtered)/len(df)*100):.1f}%
+        - **Lignes filtrées:** {n_lignes:,}
+        - **Taux de filtrage:** {(n_lignes/len(df)*100):.1f}%
         - **Source:** OPEN_PHMEV_2024.parquet
         
         ### 🔧 **Colonnes Analysées**
@@ -13,6 +13,11 @@ import duckdb
 import os
 import gc
 from datetime import datetime
+from phmev_atc import ATC_LEVELS, AtcTree
+from phmev_cache import ResultCache
+from phmev_dataset import (euros_select_sql, open_prepared_ipc, prepared_ipc_path, prepared_parquet_path,
+                           source_fingerprint)
+from phmev_search import PREFIX_CACHE_MB, substring_search
 
 # Configuration de la page
 st.set_page_config(
@@ -148,55 +153,73 @@ def load_data_duckdb():
     try:
         progress_placeholder.info("🦆 Initialisation DuckDB...")
         
-        if not os.path.exists(parquet_path):
-            st.error("❌ Fichier OPEN_PHMEV_2024.parquet non trouvé !")
-            return None
+        prepared_path = prepared_parquet_path()
+        if os.path.exists(prepared_ipc_path()):
+            # Copie IPC mappée en mémoire : DuckDB lit la table Arrow sans la copier, et les pages
+            # du fichier sont partagées entre processus Streamlit
+            progress_placeholder.info("🗺️ Ouverture de la copie Arrow mappée en mémoire...")
+            conn.register('phmev_arrow', open_prepared_ipc())
+            # Montants stockés en centimes entiers : reconvertis en euros dans la vue
+            conn.execute(f"CREATE VIEW phmev AS {euros_select_sql(conn, 'phmev_arrow')}")
+        elif os.path.exists(prepared_path):
+            # Fichier préparé (build_analytics_dataset.py) : nettoyage et colonnes dérivées déjà faits
+            progress_placeholder.info("📊 Chargement du fichier préparé dans DuckDB...")
+            conn.execute("""
+                CREATE TABLE phmev_prepared AS 
+                SELECT * FROM read_parquet(?)
+            """, [prepared_path])
+            conn.execute(f"CREATE VIEW phmev AS {euros_select_sql(conn, 'phmev_prepared')}")
+        else:
+            if not os.path.exists(parquet_path):
+                st.error("❌ Fichier OPEN_PHMEV_2024.parquet non trouvé !")
+                return None
             
-        progress_placeholder.info("📊 Chargement du fichier parquet dans DuckDB...")
-        
-        # Créer une table DuckDB à partir du fichier parquet
-        conn.execute("""
-            CREATE TABLE phmev AS 
-            SELECT * FROM read_parquet(?)
-        """, [parquet_path])
-        
-        progress_placeholder.info("🔄 Filtrage des données non informatives...")
-        
-        # Filtrer les données non informatives directement en SQL
-        conn.execute("""
-            DELETE FROM phmev 
-            WHERE l_cip13 IN ('Non restitué', 'Non spécifié', 'Honoraires de dispensation')
-            OR l_cip13 IS NULL
-        """)
-        
-        progress_placeholder.info("✨ Création des colonnes dérivées...")
-        
-        # Ajouter les colonnes dérivées avec SQL
-        conn.execute("""
-            ALTER TABLE phmev ADD COLUMN etablissement VARCHAR;
-            ALTER TABLE phmev ADD COLUMN medicament VARCHAR;
-            ALTER TABLE phmev ADD COLUMN categorie VARCHAR;
-            ALTER TABLE phmev ADD COLUMN ville VARCHAR;
-            ALTER TABLE phmev ADD COLUMN region_clean VARCHAR;
-            ALTER TABLE phmev ADD COLUMN code_cip VARCHAR;
-            ALTER TABLE phmev ADD COLUMN libelle_cip VARCHAR;
-            ALTER TABLE phmev ADD COLUMN cout_par_boite DOUBLE;
-            ALTER TABLE phmev ADD COLUMN taux_remboursement DOUBLE;
-        """)
-        
-        # Remplir les colonnes dérivées
-        conn.execute("""
-            UPDATE phmev SET
-                etablissement = COALESCE(NULLIF(nom_etb, ''), NULLIF(raison_sociale_etb, ''), 'Non spécifié'),
-                medicament = COALESCE(NULLIF(L_ATC5, ''), 'Non spécifié'),
-                categorie = COALESCE(NULLIF(categorie_jur, ''), 'Non spécifiée'),
-                ville = COALESCE(NULLIF(nom_ville, ''), 'Non spécifiée'),
-                region_clean = COALESCE(region_etb, 0),
-                code_cip = CAST(CIP13 AS VARCHAR),
-                libelle_cip = COALESCE(NULLIF(l_cip13, ''), 'Non spécifié'),
-                cout_par_boite = CASE WHEN BOITES > 0 THEN REM / BOITES ELSE 0 END,
-                taux_remboursement = CASE WHEN BSE > 0 THEN (REM / BSE) * 100 ELSE 0 END
-        """)
+            progress_placeholder.info("📊 Chargement du fichier parquet dans DuckDB...")
+        
+            # Créer une table DuckDB à partir du fichier parquet
+            conn.execute("""
+                CREATE TABLE phmev AS 
+                SELECT * FROM read_parquet(?)
+            """, [parquet_path])
+        
+            progress_placeholder.info("🔄 Filtrage des données non informatives...")
+        
+            # Filtrer les données non informatives directement en SQL
+            conn.execute("""
+                DELETE FROM phmev 
+                WHERE l_cip13 IN ('Non restitué', 'Non spécifié', 'Honoraires de dispensation')
+                OR l_cip13 IS NULL
+            """)
+        
+            progress_placeholder.info("✨ Création des colonnes dérivées...")
+        
+            # Ajouter les colonnes dérivées avec SQL
+            conn.execute("""
+                ALTER TABLE phmev ADD COLUMN etablissement VARCHAR;
+                ALTER TABLE phmev ADD COLUMN medicament VARCHAR;
+                ALTER TABLE phmev ADD COLUMN categorie VARCHAR;
+                ALTER TABLE phmev ADD COLUMN ville VARCHAR;
+                ALTER TABLE phmev ADD COLUMN region_clean VARCHAR;
+                ALTER TABLE phmev ADD COLUMN code_cip VARCHAR;
+                ALTER TABLE phmev ADD COLUMN libelle_cip VARCHAR;
+                ALTER TABLE phmev ADD COLUMN cout_par_boite DOUBLE;
+                ALTER TABLE phmev ADD COLUMN taux_remboursement DOUBLE;
+            """)
+        
+            # Remplir les colonnes dérivées
+            conn.execute("""
+                UPDATE phmev SET
+                    etablissement = COALESCE(NULLIF(nom_etb, ''), NULLIF(raison_sociale_etb, ''), 'Non spécifié'),
+                    medicament = COALESCE(NULLIF(L_ATC5, ''), 'Non spécifié'),
+                    categorie = COALESCE(NULLIF(categorie_jur, ''), 'Non spécifiée'),
+                    ville = COALESCE(NULLIF(nom_ville, ''), 'Non spécifiée'),
+                    region_clean = COALESCE(region_etb, 0),
+                    code_cip = CAST(CIP13 AS VARCHAR),
+                    libelle_cip = COALESCE(NULLIF(l_cip13, ''), 'Non spécifié'),
+                    cout_par_boite = CASE WHEN BOITES > 0 THEN REM / BOITES ELSE 0 END,
+                    taux_remboursement = CASE WHEN BSE > 0 THEN (REM / BSE) * 100 ELSE 0 END
+            """)
+        
         
         # Obtenir le nombre de lignes
         count_result = conn.execute("SELECT COUNT(*) FROM phmev").fetchone()
@@ -225,27 +248,27 @@ def get_filter_options_duckdb(conn, filter_type, current_filters=None):
         if current_filters:
             if current_filters.get('atc1_filtre'):
                 placeholders = ','.join(['?' for _ in current_filters['atc1_filtre']])
-                where_clauses.append(f"l_atc1 IN ({placeholders})")
+                where_clauses.append(f"atc1 IN ({placeholders})")
                 params.extend(current_filters['atc1_filtre'])
                 
             if current_filters.get('atc2_filtre'):
                 placeholders = ','.join(['?' for _ in current_filters['atc2_filtre']])
-                where_clauses.append(f"L_ATC2 IN ({placeholders})")
+                where_clauses.append(f"atc2 IN ({placeholders})")
                 params.extend(current_filters['atc2_filtre'])
                 
             if current_filters.get('atc3_filtre'):
                 placeholders = ','.join(['?' for _ in current_filters['atc3_filtre']])
-                where_clauses.append(f"L_ATC3 IN ({placeholders})")
+                where_clauses.append(f"atc3 IN ({placeholders})")
                 params.extend(current_filters['atc3_filtre'])
                 
             if current_filters.get('atc4_filtre'):
                 placeholders = ','.join(['?' for _ in current_filters['atc4_filtre']])
-                where_clauses.append(f"L_ATC4 IN ({placeholders})")
+                where_clauses.append(f"atc4 IN ({placeholders})")
                 params.extend(current_filters['atc4_filtre'])
                 
             if current_filters.get('atc5_filtre'):
                 placeholders = ','.join(['?' for _ in current_filters['atc5_filtre']])
-                where_clauses.append(f"L_ATC5 IN ({placeholders})")
+                where_clauses.append(f"ATC5 IN ({placeholders})")
                 params.extend(current_filters['atc5_filtre'])
                 
             if current_filters.get('ville_filtre'):
@@ -353,6 +376,18 @@ def get_filter_options_duckdb(conn, filter_type, current_filters=None):
         st.error(f"Erreur lors de la récupération des options {filter_type}: {e}")
         return []
 
+@st.cache_resource
+def get_atc_tree_duckdb(_conn):
+    """🌳 Arbre ATC construit une fois (couples code/libellé distincts) : options ATC2..ATC5 sans requête"""
+    options = {}
+    for level, code_col, label_col, _ in ATC_LEVELS:
+        options[level] = _conn.execute(f"""
+            SELECT DISTINCT {code_col}, {label_col}
+            FROM phmev
+            WHERE {code_col} IS NOT NULL AND {label_col} IS NOT NULL
+        """).fetchall()
+    return AtcTree.from_options(options)
+
 def get_filtered_data_duckdb(conn, filters, min_boites=0):
     """🔄 Applique les filtres et retourne les données"""
     if conn is None:
@@ -365,27 +400,27 @@ def get_filtered_data_duckdb(conn, filters, min_boites=0):
         # Construire les clauses WHERE pour tous les niveaux ATC
         if filters.get('atc1_filtre'):
             placeholders = ','.join(['?' for _ in filters['atc1_filtre']])
-            where_clauses.append(f"l_atc1 IN ({placeholders})")
+            where_clauses.append(f"atc1 IN ({placeholders})")
             params.extend(filters['atc1_filtre'])
             
         if filters.get('atc2_filtre'):
             placeholders = ','.join(['?' for _ in filters['atc2_filtre']])
-            where_clauses.append(f"L_ATC2 IN ({placeholders})")
+            where_clauses.append(f"atc2 IN ({placeholders})")
             params.extend(filters['atc2_filtre'])
             
         if filters.get('atc3_filtre'):
             placeholders = ','.join(['?' for _ in filters['atc3_filtre']])
-            where_clauses.append(f"L_ATC3 IN ({placeholders})")
+            where_clauses.append(f"atc3 IN ({placeholders})")
             params.extend(filters['atc3_filtre'])
             
         if filters.get('atc4_filtre'):
             placeholders = ','.join(['?' for _ in filters['atc4_filtre']])
-            where_clauses.append(f"L_ATC4 IN ({placeholders})")
+            where_clauses.append(f"atc4 IN ({placeholders})")
             params.extend(filters['atc4_filtre'])
             
         if filters.get('atc5_filtre'):
             placeholders = ','.join(['?' for _ in filters['atc5_filtre']])
-            where_clauses.append(f"L_ATC5 IN ({placeholders})")
+            where_clauses.append(f"ATC5 IN ({placeholders})")
             params.extend(filters['atc5_filtre'])
             
         if filters.get('ville_filtre'):
@@ -428,32 +463,40 @@ def get_filtered_data_duckdb(conn, filters, min_boites=0):
         st.error(f"Erreur lors du filtrage: {e}")
         return pd.DataFrame()
 
+@st.cache_data(ttl=60, show_spinner=False)  # Sonde de métadonnées : footers Parquet seulement
+def get_source_version():
+    """🔖 Empreinte des données lues par DuckDB : un fichier reconstruit invalide les préfixes partagés"""
+    return source_fingerprint()
+
+@st.cache_resource
+def get_medication_prefix_cache():
+    """♻️ Préfixes courts de la recherche de médicaments, partagés entre sessions (LRU borné en octets)"""
+    return ResultCache(PREFIX_CACHE_MB * 1024**2)
+
 def search_medications_duckdb(conn, search_term, max_results=50):
-    """🔍 Recherche de médicaments avec DuckDB"""
+    """🔍 Recherche de médicaments avec DuckDB
+
+    Au fil de la frappe (« c », « ca », « cab »…), une recherche qui prolonge la précédente filtre ses
+    résultats en mémoire au lieu de relancer une requête (phmev_search.substring_search).
+    """
     if conn is None or not search_term:
         return []
     
-    try:
-        # Recherche insensible à la casse avec LIKE
-        search_pattern = f"%{search_term.lower()}%"
-        
+    def query_all(term):
+        # Tous les libellés contenant la recherche, sans limite : base des recherches suivantes
         query = """
             SELECT DISTINCT libelle_cip
             FROM phmev
-            WHERE LOWER(libelle_cip) LIKE ?
+            WHERE contains(LOWER(libelle_cip), ?)
             AND libelle_cip IS NOT NULL 
             AND libelle_cip != 'Non spécifié'
-            ORDER BY 
-                CASE WHEN LOWER(libelle_cip) LIKE ? THEN 1 ELSE 2 END,
-                LENGTH(libelle_cip),
-                libelle_cip
-            LIMIT ?
         """
-        
-        exact_pattern = f"{search_term.lower()}%"
-        result = conn.execute(query, [search_pattern, exact_pattern, max_results]).fetchall()
-        
-        return [row[0] for row in result]
+        return [row[0] for row in conn.execute(query, [term]).fetchall()]
+    
+    try:
+        # Une recherche par session, recréée avec la connexion ; préfixes partagés rangés par version des données
+        return substring_search(st.session_state, 'med_search_narrowing', query_all, search_term, max_results,
+                                conn, get_medication_prefix_cache(), get_source_version())
         
     except Exception as e:
         st.error(f"Erreur lors de la recherche: {e}")
@@ -488,6 +531,9 @@ def main():
         
         # Initialiser les filtres actuels
         current_filters = {}
+        # Codes ATC choisis par niveau : les options du niveau suivant sont leurs enfants dans l'arbre
+        atc_tree = get_atc_tree_duckdb(conn)
+        atc_codes = {}
         
         # ========== HIÉRARCHIE PHARMACEUTIQUE D'ABORD ==========
         st.markdown("### 💊 **Hiérarchie Pharmaceutique (QUOI)**")
@@ -495,7 +541,7 @@ def main():
         
         # Niveau 1: ATC1
         st.markdown("#### 🧬 **Systèmes Anatomiques (ATC1)**")
-        atc1_options = get_filter_options_duckdb(conn, 'atc1', current_filters)
+        atc1_options = atc_tree.options('atc1', atc_codes)
         atc1_display = [f"{code} - {libelle}" for code, libelle in atc1_options]
         
         atc1_selection = st.multiselect(
@@ -506,12 +552,13 @@ def main():
         )
         
         atc1_codes = [sel.split(' - ')[0] for sel in atc1_selection] if atc1_selection else []
-        atc1_filtre = [dict(atc1_options)[code] for code in atc1_codes] if atc1_codes else []
-        current_filters['atc1_filtre'] = atc1_filtre
+        # Filtres ATC par codes (colonnes atc1..ATC5) : les libellés ne servent qu'à l'affichage
+        current_filters['atc1_filtre'] = atc1_codes
+        atc_codes['atc1'] = atc1_codes
         
         # Niveau 2: ATC2 (Groupes thérapeutiques)
         st.markdown("#### 💉 **Groupes Thérapeutiques (ATC2)**")
-        atc2_options = get_filter_options_duckdb(conn, 'atc2', current_filters)
+        atc2_options = atc_tree.options('atc2', atc_codes)
         atc2_display = [f"{code} - {libelle}" for code, libelle in atc2_options]
         
         if atc2_options:
@@ -523,16 +570,16 @@ def main():
             )
             
             atc2_codes = [sel.split(' - ')[0] for sel in atc2_selection] if atc2_selection else []
-            atc2_filtre = [dict(atc2_options)[code] for code in atc2_codes] if atc2_codes else []
         else:
-            atc2_filtre = []
+            atc2_codes = []
             st.info("👆 Sélectionnez d'abord des filtres pour voir les groupes thérapeutiques")
         
-        current_filters['atc2_filtre'] = atc2_filtre
+        current_filters['atc2_filtre'] = atc2_codes
+        atc_codes['atc2'] = atc2_codes
         
         # Niveau 3: ATC3 (Sous-groupes pharmacologiques)
         st.markdown("#### 🔬 **Sous-groupes Pharmacologiques (ATC3)**")
-        atc3_options = get_filter_options_duckdb(conn, 'atc3', current_filters)
+        atc3_options = atc_tree.options('atc3', atc_codes)
         atc3_display = [f"{code} - {libelle}" for code, libelle in atc3_options]
         
         if atc3_options:
@@ -544,17 +591,17 @@ def main():
             )
             
             atc3_codes = [sel.split(' - ')[0] for sel in atc3_selection] if atc3_selection else []
-            atc3_filtre = [dict(atc3_options)[code] for code in atc3_codes] if atc3_codes else []
         else:
-            atc3_filtre = []
+            atc3_codes = []
             if current_filters.get('atc2_filtre'):
                 st.info("👆 Affinez vos sélections pour voir les sous-groupes")
         
-        current_filters['atc3_filtre'] = atc3_filtre
+        current_filters['atc3_filtre'] = atc3_codes
+        atc_codes['atc3'] = atc3_codes
         
         # Niveau 4: ATC4 (Groupes chimiques)
         st.markdown("#### ⚗️ **Groupes Chimiques (ATC4)**")
-        atc4_options = get_filter_options_duckdb(conn, 'atc4', current_filters)
+        atc4_options = atc_tree.options('atc4', atc_codes)
         atc4_display = [f"{code} - {libelle}" for code, libelle in atc4_options]
         
         if atc4_options:
@@ -566,15 +613,15 @@ def main():
             )
             
             atc4_codes = [sel.split(' - ')[0] for sel in atc4_selection] if atc4_selection else []
-            atc4_filtre = [dict(atc4_options)[code] for code in atc4_codes] if atc4_codes else []
         else:
-            atc4_filtre = []
+            atc4_codes = []
         
-        current_filters['atc4_filtre'] = atc4_filtre
+        current_filters['atc4_filtre'] = atc4_codes
+        atc_codes['atc4'] = atc4_codes
         
         # Niveau 5: ATC5 (Substances chimiques)
         st.markdown("#### 🧪 **Substances Chimiques (ATC5)**")
-        atc5_options = get_filter_options_duckdb(conn, 'atc5', current_filters)
+        atc5_options = atc_tree.options('atc5', atc_codes)
         atc5_display = [f"{code} - {libelle}" for code, libelle in atc5_options]
         
         if atc5_options:
@@ -586,11 +633,11 @@ def main():
             )
             
             atc5_codes = [sel.split(' - ')[0] for sel in atc5_selection] if atc5_selection else []
-            atc5_filtre = [dict(atc5_options)[code] for code in atc5_codes] if atc5_codes else []
         else:
-            atc5_filtre = []
+            atc5_codes = []
         
-        current_filters['atc5_filtre'] = atc5_filtre
+        current_filters['atc5_filtre'] = atc5_codes
+        atc_codes['atc5'] = atc5_codes
         
         # Médicaments spécifiques
         st.markdown("#### 💊 **Médicaments Spécifiques**")
@@ -13,6 +13,11 @@ import duckdb
 import os
 import gc
 from datetime import datetime
+from phmev_cache import ResultCache
+from phmev_dataset import (available_years, dataset_fingerprint, euros_select_sql, open_prepared_ipc,
+                           partition_files, partitions_root, prepared_ipc_path, prepared_parquet_path,
+                           source_fingerprint)
+from phmev_search import PREFIX_CACHE_MB, substring_search
 
 # Configuration de la page
 st.set_page_config(
@@ -123,55 +128,82 @@ def load_data_duckdb():
     try:
         progress_placeholder.info("🦆 Initialisation DuckDB...")
         
-        if not os.path.exists(parquet_path):
-            st.error("❌ Fichier OPEN_PHMEV_2024.parquet non trouvé !")
-            return None
+        prepared_path = prepared_parquet_path()
+        if available_years():
+            # Disposition multi-années (OPEN_PHMEV/year=YYYY/) : vue sur les partitions, rien n'est chargé ;
+            # un filtre sur `year` n'ouvre que les fichiers des années choisies
+            progress_placeholder.info("📅 Ouverture des partitions annuelles...")
+            # Une vue ne peut pas être préparée : liste de fichiers en littéral SQL (quotes échappées)
+            files = ', '.join("'" + path.replace("'", "''") + "'" for path in partition_files())
+            source = f"read_parquet([{files}], hive_partitioning = true)"
+            # Montants stockés en centimes entiers : reconvertis en euros dans la vue
+            conn.execute(f"CREATE VIEW phmev AS {euros_select_sql(conn, source)}")
+        elif os.path.exists(prepared_ipc_path()):
+            # Copie IPC mappée en mémoire : DuckDB lit la table Arrow sans la copier, et les pages
+            # du fichier sont partagées entre processus Streamlit
+            progress_placeholder.info("🗺️ Ouverture de la copie Arrow mappée en mémoire...")
+            conn.register('phmev_arrow', open_prepared_ipc())
+            # Montants stockés en centimes entiers : reconvertis en euros dans la vue
+            conn.execute(f"CREATE VIEW phmev AS {euros_select_sql(conn, 'phmev_arrow')}")
+        elif os.path.exists(prepared_path):
+            # Fichier préparé (build_analytics_dataset.py) : nettoyage et colonnes dérivées déjà faits
+            progress_placeholder.info("📊 Chargement du fichier préparé dans DuckDB...")
+            conn.execute("""
+                CREATE TABLE phmev_prepared AS 
+                SELECT * FROM read_parquet(?)
+            """, [prepared_path])
+            conn.execute(f"CREATE VIEW phmev AS {euros_select_sql(conn, 'phmev_prepared')}")
+        else:
+            if not os.path.exists(parquet_path):
+                st.error("❌ Fichier OPEN_PHMEV_2024.parquet non trouvé !")
+                return None
             
-        progress_placeholder.info("📊 Chargement du fichier parquet dans DuckDB...")
+            progress_placeholder.info("📊 Chargement du fichier parquet dans DuckDB...")
+        
+            # Créer une table DuckDB à partir du fichier parquet
+            conn.execute("""
+                CREATE TABLE phmev AS 
+                SELECT * FROM read_parquet(?)
+            """, [parquet_path])
         
-        # Créer une table DuckDB à partir du fichier parquet
-        conn.execute("""
-            CREATE TABLE phmev AS 
-            SELECT * FROM read_parquet(?)
-        """, [parquet_path])
+            progress_placeholder.info("🔄 Filtrage des données non informatives...")
         
-        progress_placeholder.info("🔄 Filtrage des données non informatives...")
+            # Filtrer les données non informatives directement en SQL
+            conn.execute("""
+                DELETE FROM phmev 
+                WHERE l_cip13 IN ('Non restitué', 'Non spécifié', 'Honoraires de dispensation')
+                OR l_cip13 IS NULL
+            """)
         
-        # Filtrer les données non informatives directement en SQL
-        conn.execute("""
-            DELETE FROM phmev 
-            WHERE l_cip13 IN ('Non restitué', 'Non spécifié', 'Honoraires de dispensation')
-            OR l_cip13 IS NULL
-        """)
+            progress_placeholder.info("✨ Création des colonnes dérivées...")
         
-        progress_placeholder.info("✨ Création des colonnes dérivées...")
+            # Ajouter les colonnes dérivées avec SQL
+            conn.execute("""
+                ALTER TABLE phmev ADD COLUMN etablissement VARCHAR;
+                ALTER TABLE phmev ADD COLUMN medicament VARCHAR;
+                ALTER TABLE phmev ADD COLUMN categorie VARCHAR;
+                ALTER TABLE phmev ADD COLUMN ville VARCHAR;
+                ALTER TABLE phmev ADD COLUMN region_clean VARCHAR;
+                ALTER TABLE phmev ADD COLUMN code_cip VARCHAR;
+                ALTER TABLE phmev ADD COLUMN libelle_cip VARCHAR;
+                ALTER TABLE phmev ADD COLUMN cout_par_boite DOUBLE;
+                ALTER TABLE phmev ADD COLUMN taux_remboursement DOUBLE;
+            """)
         
-        # Ajouter les colonnes dérivées avec SQL
-        conn.execute("""
-            ALTER TABLE phmev ADD COLUMN etablissement VARCHAR;
-            ALTER TABLE phmev ADD COLUMN medicament VARCHAR;
-            ALTER TABLE phmev ADD COLUMN categorie VARCHAR;
-            ALTER TABLE phmev ADD COLUMN ville VARCHAR;
-            ALTER TABLE phmev ADD COLUMN region_clean VARCHAR;
-            ALTER TABLE phmev ADD COLUMN code_cip VARCHAR;
-            ALTER TABLE phmev ADD COLUMN libelle_cip VARCHAR;
-            ALTER TABLE phmev ADD COLUMN cout_par_boite DOUBLE;
-            ALTER TABLE phmev ADD COLUMN taux_remboursement DOUBLE;
-        """)
+            # Remplir les colonnes dérivées
+            conn.execute("""
+                UPDATE phmev SET
+                    etablissement = COALESCE(NULLIF(nom_etb, ''), NULLIF(raison_sociale_etb, ''), 'Non spécifié'),
+                    medicament = COALESCE(NULLIF(L_ATC5, ''), 'Non spécifié'),
+                    categorie = COALESCE(NULLIF(categorie_jur, ''), 'Non spécifiée'),
+                    ville = COALESCE(NULLIF(nom_ville, ''), 'Non spécifiée'),
+                    region_clean = COALESCE(region_etb, 0),
+                    code_cip = CAST(CIP13 AS VARCHAR),
+                    libelle_cip = COALESCE(NULLIF(l_cip13, ''), 'Non spécifié'),
+                    cout_par_boite = CASE WHEN BOITES > 0 THEN REM / BOITES ELSE 0 END,
+                    taux_remboursement = CASE WHEN BSE > 0 THEN (REM / BSE) * 100 ELSE 0 END
+            """)
         
-        # Remplir les colonnes dérivées
-        conn.execute("""
-            UPDATE phmev SET
-                etablissement = COALESCE(NULLIF(nom_etb, ''), NULLIF(raison_sociale_etb, ''), 'Non spécifié'),
-                medicament = COALESCE(NULLIF(L_ATC5, ''), 'Non spécifié'),
-                categorie = COALESCE(NULLIF(categorie_jur, ''), 'Non spécifiée'),
-                ville = COALESCE(NULLIF(nom_ville, ''), 'Non spécifiée'),
-                region_clean = COALESCE(region_etb, 0),
-                code_cip = CAST(CIP13 AS VARCHAR),
-                libelle_cip = COALESCE(NULLIF(l_cip13, ''), 'Non spécifié'),
-                cout_par_boite = CASE WHEN BOITES > 0 THEN REM / BOITES ELSE 0 END,
-                taux_remboursement = CASE WHEN BSE > 0 THEN (REM / BSE) * 100 ELSE 0 END
-        """)
         
         # Obtenir le nombre de lignes
         count_result = conn.execute("SELECT COUNT(*) FROM phmev").fetchone()
@@ -198,9 +230,14 @@ def get_filter_options_duckdb(conn, filter_type, current_filters=None):
         params = []
         
         if current_filters:
+            if current_filters.get('annee_filtre'):
+                placeholders = ','.join(['?' for _ in current_filters['annee_filtre']])
+                where_clauses.append(f"year IN ({placeholders})")
+                params.extend(current_filters['annee_filtre'])
+                
             if current_filters.get('atc1_filtre'):
                 placeholders = ','.join(['?' for _ in current_filters['atc1_filtre']])
-                where_clauses.append(f"l_atc1 IN ({placeholders})")
+                where_clauses.append(f"atc1 IN ({placeholders})")
                 params.extend(current_filters['atc1_filtre'])
                 
             if current_filters.get('ville_filtre'):
@@ -281,14 +318,19 @@ def get_filtered_data_duckdb(conn, filters):
         params = []
         
         # Construire les clauses WHERE
+        if filters.get('annee_filtre'):
+            placeholders = ','.join(['?' for _ in filters['annee_filtre']])
+            where_clauses.append(f"year IN ({placeholders})")
+            params.extend(filters['annee_filtre'])
+            
         if filters.get('atc1_filtre'):
             placeholders = ','.join(['?' for _ in filters['atc1_filtre']])
-            where_clauses.append(f"l_atc1 IN ({placeholders})")
+            where_clauses.append(f"atc1 IN ({placeholders})")
             params.extend(filters['atc1_filtre'])
             
         if filters.get('atc5_filtre'):
             placeholders = ','.join(['?' for _ in filters['atc5_filtre']])
-            where_clauses.append(f"L_ATC5 IN ({placeholders})")
+            where_clauses.append(f"ATC5 IN ({placeholders})")
             params.extend(filters['atc5_filtre'])
             
         if filters.get('ville_filtre'):
@@ -321,32 +363,40 @@ def get_filtered_data_duckdb(conn, filters):
         st.error(f"Erreur lors du filtrage: {e}")
         return pd.DataFrame()
 
+@st.cache_data(ttl=60, show_spinner=False)  # Sonde de métadonnées : footers Parquet seulement
+def get_source_version():
+    """🔖 Empreinte des données lues par DuckDB : un fichier reconstruit invalide les préfixes partagés"""
+    return dataset_fingerprint(partitions_root()) if available_years() else source_fingerprint()
+
+@st.cache_resource
+def get_medication_prefix_cache():
+    """♻️ Préfixes courts de la recherche de médicaments, partagés entre sessions (LRU borné en octets)"""
+    return ResultCache(PREFIX_CACHE_MB * 1024**2)
+
 def search_medications_duckdb(conn, search_term, max_results=50):
-    """🔍 Recherche de médicaments avec DuckDB"""
+    """🔍 Recherche de médicaments avec DuckDB
+
+    Au fil de la frappe (« c », « ca », « cab »…), une recherche qui prolonge la précédente filtre ses
+    résultats en mémoire au lieu de relancer une requête (phmev_search.substring_search).
+    """
     if conn is None or not search_term:
         return []
     
-    try:
-        # Recherche insensible à la casse avec LIKE
-        search_pattern = f"%{search_term.lower()}%"
-        
+    def query_all(term):
+        # Tous les libellés contenant la recherche, sans limite : base des recherches suivantes
         query = """
             SELECT DISTINCT libelle_cip
             FROM phmev
-            WHERE LOWER(libelle_cip) LIKE ?
+            WHERE contains(LOWER(libelle_cip), ?)
             AND libelle_cip IS NOT NULL 
             AND libelle_cip != 'Non spécifié'
-            ORDER BY 
-                CASE WHEN LOWER(libelle_cip) LIKE ? THEN 1 ELSE 2 END,
-                LENGTH(libelle_cip),
-                libelle_cip
-            LIMIT ?
         """
-        
-        exact_pattern = f"{search_term.lower()}%"
-        result = conn.execute(query, [search_pattern, exact_pattern, max_results]).fetchall()
-        
-        return [row[0] for row in result]
+        return [row[0] for row in conn.execute(query, [term]).fetchall()]
+    
+    try:
+        # Une recherche par session, recréée avec la connexion ; préfixes partagés rangés par version des données
+        return substring_search(st.session_state, 'med_search_narrowing', query_all, search_term, max_results,
+                                conn, get_medication_prefix_cache(), get_source_version())
         
     except Exception as e:
         st.error(f"Erreur lors de la recherche: {e}")
@@ -382,9 +432,20 @@ def main():
         if 'filters' not in st.session_state:
             st.session_state.filters = {}
         
+        # Filtre Année (partitions annuelles)
+        years = available_years()
+        if years:
+            st.subheader("📅 Années")
+            st.session_state.filters['annee_filtre'] = st.multiselect(
+                "Années analysées:",
+                options=years,
+                default=[years[-1]],
+                key="annee_select"
+            ) or [years[-1]]
+        
         # Filtre ATC1
         st.subheader("🧬 Classification ATC")
-        atc1_options = get_filter_options_duckdb(conn, 'atc1')
+        atc1_options = get_filter_options_duckdb(conn, 'atc1', {'annee_filtre': st.session_state.filters.get('annee_filtre')})
         if atc1_options:
             atc1_labels = [f"{code} - {label}" for code, label in atc1_options]
             atc1_selected = st.multiselect(
@@ -392,8 +453,9 @@ def main():
                 options=atc1_labels,
                 key="atc1_select"
             )
+            # Filtre par codes ATC (colonne atc1) : le libellé ne sert qu'à l'affichage
             st.session_state.filters['atc1_filtre'] = [
-                label.split(' - ')[1] for label in atc1_selected
+                label.split(' - ')[0] for label in atc1_selected
             ] if atc1_selected else []
         
         # Filtre Ville
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Test de l'index d'alias PHMEV (marque → CIP13 → molécule ATC5)
+Vérifie l'arbre de préfixes, la chaîne d'alias, le cache généré et la latence
+"""
+
+import sys
+import os
+import time
+import tempfile
+import traceback
+from datetime import datetime
+import numpy as np
+
+# Ajouter le répertoire courant au path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phmev_alias import AliasIndex, PrefixTrie, brand_name, load_alias_cache, save_alias_cache
+
+RECORDS = {
+    'cip13': ['3400930000001', '3400930000002', '3400930000003', '3400930000004', '3400930000005',
+              '3400930000006', '3400930000007'],
+    'l_cip13': ['CABOMETYX 20MG CPR 30', 'CABOMETYX 40MG CPR 30', 'COMETRIQ 20MG GELULE', 'DOLIPRANE 1G CPR 8',
+                'PARACETAMOL BGA 1G CPR', 'ACIDE FOLIQUE CCD 5MG CPR 90', 'KEYTRUDA 25MG/ML SOL INJ'],
+    'atc5': ['L01EX07', 'L01EX07', 'L01EX07', 'N02BE01', 'N02BE01', 'B03BB01', None],
+    'l_atc5': ['CABOZANTINIB', 'CABOZANTINIB', 'CABOZANTINIB', 'PARACÉTAMOL', 'PARACÉTAMOL', 'ACIDE FOLIQUE', None],
+}
+
+
+def test_prefix_trie():
+    """Mêmes identifiants qu'un parcours des mots de toutes les clés"""
+    print("🧪 Test: Arbre de préfixes...")
+    rng = np.random.default_rng(0)
+    alphabet = list('abcde ')
+    keys = [' '.join(''.join(rng.choice(alphabet[:-1], rng.integers(1, 6))) for _ in range(rng.integers(1, 4)))
+            for _ in range(500)]
+    # Chaque clé aussi à partir de chacun de ses mots
+    trie = PrefixTrie((' '.join(key.split()[start:]), i) for i, key in enumerate(keys) for start in range(len(key.split())))
+    prefixes = ['', 'a', 'ab', 'abc', 'e', 'edc', 'aaaaa', 'abcdea', 'f']
+    for prefix in prefixes:
+        expected = {i for i, key in enumerate(keys) if any(word.startswith(prefix) for word in key.split())}
+        assert set(trie.lookup(prefix).tolist()) == expected, prefix
+    print(f"✅ {len(prefixes)} préfixes identiques au parcours ({len(trie)} nœuds pour {len(keys)} clés)")
+
+
+def test_alias_chain():
+    """Marque → CIP13 → ATC5 → molécule, et molécule → toutes ses spécialités"""
+    print("\n🧪 Test: Chaîne d'alias...")
+    assert brand_name('CABOMETYX 20MG CPR 30') == 'cabometyx'
+    assert brand_name('ACIDE FOLIQUE CCD 5MG CPR 90') == 'acide folique ccd'
+    index = AliasIndex(RECORDS)
+    cabozantinib = {'CABOMETYX 20MG CPR 30', 'CABOMETYX 40MG CPR 30', 'COMETRIQ 20MG GELULE'}
+    # Une marque mène aussi aux autres spécialités de sa molécule
+    assert index.resolve('cabome') == cabozantinib and index.molecules('cabome') == ['CABOZANTINIB']
+    assert index.resolve('CABOZAN') == cabozantinib
+    assert index.resolve('paracetam') == {'DOLIPRANE 1G CPR 8', 'PARACETAMOL BGA 1G CPR'}
+    assert index.resolve('foli') == {'ACIDE FOLIQUE CCD 5MG CPR 90'}
+    # Marque trouvée par son début seulement (« ccd » est un laboratoire, pas une marque)
+    assert index.resolve('ccd') == set() and index.resolve('acide fo') == {'ACIDE FOLIQUE CCD 5MG CPR 90'}
+    # Sans ATC5 : la marque seule ; préfixe trop court ou inconnu : rien
+    assert index.resolve('keytr') == {'KEYTRUDA 25MG/ML SOL INJ'}
+    assert index.resolve('ca') == set() and index.resolve('zzz') == set()
+    print(f"✅ cabome → {index.molecules('cabome')[0]} → {len(cabozantinib)} spécialités")
+
+
+def test_alias_cache():
+    """Cache relu à l'identique pour la même version des données, ignoré sinon"""
+    print("\n🧪 Test: Cache d'alias...")
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {'pickle_path': os.path.join(tmp, 'alias.pkl'), 'json_path': os.path.join(tmp, 'alias.json')}
+        assert load_alias_cache('v1', **paths) is None
+        save_alias_cache(RECORDS, {'fingerprint': 'v1'}, **paths)
+        assert load_alias_cache('v1', **paths) == RECORDS and load_alias_cache(**paths) == RECORDS
+        assert load_alias_cache('v2', **paths) is None
+        # Sans pickle, le JSON suffit
+        os.remove(paths['pickle_path'])
+        assert AliasIndex(load_alias_cache('v1', **paths)).resolve('cabome') == AliasIndex(RECORDS).resolve('cabome')
+    print("✅ Cache pickle / JSON avec empreinte de version")
+
+
+def test_alias_latency():
+    """📈 Latence de résolution indépendante du nombre de marques"""
+    print("\n🧪 Test: Latence...")
+    rng = np.random.default_rng(1)
+    for n in (10_000, 100_000):
+        names = [''.join(rng.choice(list('abcdefghijklmnopqrstuvwxyz'), 9)).upper() for _ in range(n)]
+        records = {
+            'cip13': [str(3400930000000 + i) for i in range(n)],
+            'l_cip13': [f"{name} {rng.integers(1, 1000)}MG CPR" for name in names],
+            'atc5': [f"X{i % 2000:05d}" for i in range(n)],
+            'l_atc5': [f"MOLECULE {i % 2000}" for i in range(n)],
+        }
+        start = time.perf_counter()
+        index = AliasIndex(records)
+        t_build = time.perf_counter() - start
+        prefixes = [name[:5].lower() for name in names[:200]]
+        start = time.perf_counter()
+        for prefix in prefixes:
+            index.lookup(prefix)
+        t_lookup = (time.perf_counter() - start) / len(prefixes)
+        assert records['l_cip13'][0] in index.resolve(prefixes[0])
+        print(f"✅ {n:,} CIP13 | construction {t_build:.2f}s, préfixe: {t_lookup * 1e6:.0f} µs")
+
+
+def run_all_tests():
+    """Exécuter tous les tests de l'index d'alias"""
+    print("🚀 TESTS DE L'INDEX D'ALIAS PHMEV")
+    print("=" * 60)
+    print(f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 60)
+
+    tests = [
+        ("Arbre de préfixes", test_prefix_trie),
+        ("Chaîne d'alias", test_alias_chain),
+        ("Cache d'alias", test_alias_cache),
+        ("Latence", test_alias_latency),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            results.append((test_name, True))
+        except Exception as e:
+            print(f"❌ ERREUR dans {test_name}: {e}")
+            traceback.print_exc()
+            results.append((test_name, False))
+
+    print("\n" + "=" * 60)
+    failed = sum(1 for _, ok in results if not ok)
+    for test_name, ok in results:
+        print(f"{test_name:.<30} {'✅ PASSÉ' if ok else '❌ ÉCHOUÉ'}")
+    print(f"Total: {len(results)} tests | Réussis: {len(results) - failed} | Échoués: {failed}")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Test de l'arbre ATC PHMEV
+Vérifie enfants, options et plages de lignes de l'arbre contre un parcours complet du DataFrame
+"""
+
+import sys
+import os
+import time
+import traceback
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# Ajouter le répertoire courant au path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phmev_atc import ATC_LEVELS, ATC_LEVEL_KEYS, AtcTree, contiguous_row_ranges
+from phmev_index import FilterCascade
+from phmev_schema import FILTER_COLUMNS, isin_mask
+from phmev_testdata import make_df
+
+
+def scan_options(df, level, selected):
+    """Options attendues : couples distincts du niveau parmi les lignes des codes choisis en amont"""
+    mask = np.ones(len(df), dtype=bool)
+    for upper, code_col, _, _ in ATC_LEVELS[:ATC_LEVEL_KEYS.index(level)]:
+        if selected.get(upper):
+            mask &= isin_mask(df[code_col], selected[upper])
+    _, code_col, label_col, _ = ATC_LEVELS[ATC_LEVEL_KEYS.index(level)]
+    pairs = df.loc[mask, [code_col, label_col]].astype(str).drop_duplicates().sort_values(code_col)
+    return list(pairs.itertuples(index=False, name=None))
+
+
+def test_tree_options():
+    """Options de chaque niveau : identiques au parcours des lignes, depuis le DataFrame ou les options"""
+    print("🧪 Test: Options de l'arbre ATC...")
+    df = make_df()
+    tree = AtcTree.from_dataframe(df)
+    cached = AtcTree.from_options({level: tree.options(level, {}) for level in ATC_LEVEL_KEYS})
+    states = [{}, {'atc1': ['A']}, {'atc1': ['A', 'C'], 'atc2': ['C02']}, {'atc1': ['B'], 'atc2': ['B01'],
+              'atc3': ['B01A', 'B01B'], 'atc4': ['B01BA']}, {'atc1': ['A'], 'atc3': ['X99Z']}]
+    for selected in states:
+        for level in ATC_LEVEL_KEYS:
+            expected = scan_options(df, level, selected)
+            assert tree.options(level, selected) == expected, (level, selected)
+            assert cached.options(level, selected) == expected, (level, selected)
+    assert tree.children(['A01']) == ['A01A', 'A01B'] and tree.children(['A01AA', 'A01A']) == ['A01AA', 'A01AA01', 'A01AA02', 'A01AA03', 'A01AA04']
+    assert tree.label('atc2', 'A01') == 'GROUPE A01' and tree.label('atc2', 'Z99') == 'Z99'
+    print(f"✅ {len(states)} états x {len(ATC_LEVEL_KEYS)} niveaux identiques au parcours")
+
+
+def test_row_ranges():
+    """Plages de lignes : mêmes positions que isin sur le fichier trié, libellés sans effet sur les plages"""
+    print("\n🧪 Test: Plages de lignes...")
+    df = make_df()
+    tree = AtcTree.from_dataframe(df)
+    for level, code_col, _, _ in ATC_LEVELS:
+        codes = list(tree.labels[level])[:3]
+        assert np.array_equal(tree.rows(level, codes), np.flatnonzero(isin_mask(df[code_col], codes))), level
+    assert len(tree.rows('atc1', ['Z'])) == 0
+
+    # Lignes d'un code dispersées : pas de plage, repli sur isin
+    assert contiguous_row_ranges(pd.Series(['A', 'A', 'B', 'A'])) == {'B': (2, 3)}
+    # Code à deux libellés : le filtre porte sur le code, sa plage reste exacte
+    mixed = df.copy()
+    mixed['l_atc1'] = mixed['l_atc1'].astype(str)
+    mixed.loc[0, 'l_atc1'] = 'AUTRE SYSTEME'
+    tree = AtcTree.from_dataframe(mixed)
+    assert np.array_equal(tree.rows('atc1', ['A']), np.flatnonzero(isin_mask(df['atc1'], ['A'])))
+    print(f"✅ Plages identiques à isin, y compris pour un code à deux libellés")
+
+
+def test_cascade_with_tree():
+    """Cascade sans index bitmap : niveaux ATC par plages de l'arbre, mêmes lignes que isin"""
+    print("\n🧪 Test: Cascade avec l'arbre ATC...")
+    df = make_df()
+    tree = AtcTree.from_dataframe(df)
+    current_filters = {'atc2_filtre': ['A01', 'C03'], 'atc4_filtre': ['A01AA', 'C03BA'],
+                       'ville_filtre': ['VILLE 1', 'VILLE 2']}
+    expected = np.ones(len(df), dtype=bool)
+    for filter_key, column in FILTER_COLUMNS:
+        if current_filters.get(filter_key):
+            expected &= isin_mask(df[column], current_filters[filter_key])
+    start = time.perf_counter()
+    rows = FilterCascade(df, atc_tree=tree).rows(current_filters)
+    t_tree = time.perf_counter() - start
+    start = time.perf_counter()
+    reference = FilterCascade(df).rows(current_filters)
+    t_isin = time.perf_counter() - start
+    assert np.array_equal(rows, np.flatnonzero(expected)) and np.array_equal(rows, reference)
+    print(f"✅ Lignes identiques | isin: {t_isin * 1000:.1f} ms, arbre: {t_tree * 1000:.1f} ms")
+
+
+def run_all_tests():
+    """Exécuter tous les tests de l'arbre ATC"""
+    print("🚀 TESTS DE L'ARBRE ATC PHMEV")
+    print("=" * 60)
+    print(f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 60)
+
+    tests = [
+        ("Options", test_tree_options),
+        ("Plages de lignes", test_row_ranges),
+        ("Cascade", test_cascade_with_tree),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            results.append((test_name, True))
+        except Exception as e:
+            print(f"❌ ERREUR dans {test_name}: {e}")
+            traceback.print_exc()
+            results.append((test_name, False))
+
+    print("\n" + "=" * 60)
+    failed = sum(1 for _, ok in results if not ok)
+    for test_name, ok in results:
+        print(f"{test_name:.<30} {'✅ PASSÉ' if ok else '❌ ÉCHOUÉ'}")
+    print(f"Total: {len(results)} tests | Réussis: {len(results) - failed} | Échoués: {failed}")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
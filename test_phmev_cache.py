@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Test du cache de résultats partagé PHMEV
+Vérifie la clé canonique des filtres, l'éviction LRU bornée en octets et les compteurs hits/misses
+"""
+
+import sys
+import os
+import threading
+import traceback
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# Ajouter le répertoire courant au path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phmev_cache import ResultCache, cached_result, canonical_filters, get_result_cache, result_nbytes
+
+
+def test_canonical_filters():
+    """Même état de filtres quel que soit l'ordre des clés, des valeurs, les doublons et les listes vides"""
+    print("🧪 Test: Clé canonique des filtres...")
+    a = {'ville_filtre': ['B', 'A', 'A'], 'categorie_filtre': [], 'annees': [2024, 2023], 'min_boites': 0}
+    b = {'min_boites': 0, 'annees': [2023, 2024], 'ville_filtre': ('A', 'B'), 'atc1_filtre': None}
+    assert canonical_filters(a) == canonical_filters(b)
+    assert canonical_filters(a) == (('annees', (2023, 2024)), ('min_boites', 0), ('ville_filtre', ('A', 'B')))
+    assert canonical_filters({}) == canonical_filters(None) == canonical_filters({'ville_filtre': []}) == ()
+    assert canonical_filters({'ville_filtre': ['A']}) != canonical_filters({'ville_filtre': ['A', 'B']})
+    hash(canonical_filters(a))
+    print("✅ Ordre, doublons et listes vides normalisés")
+
+
+def test_lru_eviction():
+    """Budget en octets respecté, entrée la moins récemment lue évincée d'abord"""
+    print("\n🧪 Test: Éviction LRU...")
+    block = np.zeros(1000, dtype=np.int64)
+    cache = ResultCache(max_bytes=3 * block.nbytes)
+    for name in 'abc':
+        cache.put(name, block.copy())
+    assert cache.get('a') is not None  # 'a' redevient la plus récente
+    cache.put('d', block.copy())
+    assert 'b' not in cache and all(k in cache for k in 'acd')
+    assert cache.bytes <= cache.max_bytes and cache.stats()['evictions'] == 1
+
+    # Résultat plus gros que le budget : retourné mais jamais gardé
+    big = np.zeros(10_000, dtype=np.int64)
+    assert cache.put('big', big) is big and 'big' not in cache and len(cache) == 3
+
+    # Remplacer une clé ne compte pas sa taille deux fois
+    cache.put('a', block.copy())
+    assert cache.bytes == 3 * block.nbytes
+    cache.clear()
+    assert len(cache) == 0 and cache.bytes == 0
+    print(f"✅ Budget {cache.max_bytes} octets respecté")
+
+
+def test_hits_and_misses():
+    """get_or_compute : un seul calcul par clé, None mis en cache, compteurs exacts"""
+    print("\n🧪 Test: Hits et misses...")
+    cache = ResultCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return None  # « toutes les lignes » : résultat valide
+
+    for _ in range(3):
+        assert cache.get_or_compute('rows', compute) is None
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (2, 1) and abs(stats['hit_rate'] - 2 / 3) < 1e-9
+
+    df = pd.DataFrame({'etablissement': ['CH A', 'CH B'], 'BOITES': [1, 2]})
+    assert result_nbytes(df) == df.memory_usage(deep=True).sum()
+    assert result_nbytes({'kpis': np.zeros(10)}) > 80
+    print(f"✅ 1 calcul pour 3 lectures | taux de hits {stats['hit_rate']:.0%}")
+
+
+def test_shared_cache():
+    """Cache du processus : deux sessions avec le même état (ordre différent) partagent le résultat"""
+    print("\n🧪 Test: Cache partagé entre sessions...")
+    calls = []
+
+    def run_session(filters):
+        return cached_result('test_kpis', ('v1',), filters, lambda: calls.append(1) or {'total': 42})
+
+    threads = [threading.Thread(target=run_session, args=({'ville_filtre': ['A', 'B']},)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert run_session({'ville_filtre': ['B', 'A'], 'categorie_filtre': []}) == {'total': 42}
+    assert 1 <= len(calls) <= len(threads)
+    # Nouvelle version des données : nouvelle clé, nouveau calcul
+    cached_result('test_kpis', ('v2',), {'ville_filtre': ['A', 'B']}, lambda: calls.append(1) or {})
+    assert len(calls) >= 2 and get_result_cache().stats()['entries'] >= 2
+    print(f"✅ {len(calls)} calculs pour {len(threads) + 2} sessions")
+
+
+def run_all_tests():
+    """Exécuter tous les tests du cache de résultats"""
+    print("🚀 TESTS DU CACHE DE RÉSULTATS PHMEV")
+    print("=" * 60)
+    print(f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 60)
+
+    tests = [
+        ("Clé canonique", test_canonical_filters),
+        ("Éviction LRU", test_lru_eviction),
+        ("Hits et misses", test_hits_and_misses),
+        ("Cache partagé", test_shared_cache),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            results.append((test_name, True))
+        except Exception as e:
+            print(f"❌ ERREUR dans {test_name}: {e}")
+            traceback.print_exc()
+            results.append((test_name, False))
+
+    print("\n" + "=" * 60)
+    failed = sum(1 for _, ok in results if not ok)
+    for test_name, ok in results:
+        print(f"{test_name:.<30} {'✅ PASSÉ' if ok else '❌ ÉCHOUÉ'}")
+    print(f"Total: {len(results)} tests | Réussis: {len(results) - failed} | Échoués: {failed}")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Test des matrices de co-occurrence PHMEV
+Vérifie que les options croisées lues dans les matrices creuses égalent le filtrage des lignes
+"""
+
+import sys
+import os
+import time
+import traceback
+from datetime import datetime
+import numpy as np
+
+# Ajouter le répertoire courant au path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phmev_cooccurrence import COOCCURRENCE_PAIRS, CooccurrenceIndex, IncidenceMatrix
+from phmev_facets import FACET_COLUMNS, bincount_facet, compute_facets
+from phmev_schema import isin_mask
+from phmev_testdata import make_df
+
+
+def assert_same_facet(got, expected, context):
+    got, expected = got.sort_index(), expected.sort_index()
+    assert list(got.index.astype(str)) == list(expected.index.astype(str)), context
+    for col in ('lignes', 'BOITES', 'REM'):
+        assert np.array_equal(got[col].to_numpy(), expected[col].to_numpy()), (context, col)
+
+
+def test_matrix_product():
+    """Produit par un vecteur indicateur = bincount sur les lignes filtrées, dans les deux sens"""
+    print("🧪 Test: Produit matrice-vecteur...")
+    df = make_df(300_000, villes_na=True, with_rem=True)
+    rng = np.random.default_rng(1)
+    for row_col, col_col in COOCCURRENCE_PAIRS:
+        matrix = IncidenceMatrix.build(df, row_col, col_col)
+        for a, b, m in ((row_col, col_col, matrix), (col_col, row_col, matrix.transpose())):
+            values = list(df[a].cat.categories)
+            picked = [values[i] for i in rng.integers(0, len(values), 3)] + ['INCONNUE']
+            rows = np.flatnonzero(isin_mask(df[a], picked))
+            assert_same_facet(m.product(picked), bincount_facet(df, b, rows), (a, b))
+        # Double transposition : mêmes indices, mesures partagées sans copie
+        twice = matrix.transpose().transpose()
+        assert np.array_equal(twice.indptr, matrix.indptr) and np.array_equal(twice.indices, matrix.indices)
+        assert twice.values is matrix.values
+    assert len(matrix.product([])) == 0
+    print(f"✅ {len(COOCCURRENCE_PAIRS)} couples x 2 sens identiques au filtrage des lignes")
+
+
+def test_facets_with_cooccurrence():
+    """Facettes avec matrices : identiques au calcul sur les lignes, un ou plusieurs filtres actifs"""
+    print("\n🧪 Test: Facettes avec co-occurrences...")
+    df = make_df(300_000, villes_na=True, with_rem=True)
+    cooccurrence = CooccurrenceIndex.build(df)
+    assert len(cooccurrence) == len(df)
+    states = [
+        {},
+        {'libelle_filtre': ['MEDICAMENT A01AA01 3', 'MEDICAMENT C02BA04 7']},
+        {'etablissement_filtre': ['CH 1', 'CH 2', 'CH 999']},
+        {'ville_filtre': ['VILLE 5']},
+        {'atc5_filtre': ['B01AA02']},
+        {'libelle_filtre': ['MEDICAMENT A01AA01 3'], 'ville_filtre': ['VILLE 5', 'VILLE 6']},
+    ]
+    for current_filters in states:
+        expected = compute_facets(df, current_filters)
+        got = compute_facets(df, current_filters, cooccurrence=cooccurrence)
+        assert set(got) == set(FACET_COLUMNS)
+        for key in FACET_COLUMNS:
+            assert_same_facet(got[key], expected[key], (current_filters, key))
+    print(f"✅ {len(states)} états x {len(FACET_COLUMNS)} facettes identiques")
+
+
+def test_cooccurrence_memory_and_speed():
+    """📈 Taille des matrices et options croisées : matrice vs filtrage des lignes"""
+    print("\n🧪 Test: Mémoire et vitesse des co-occurrences...")
+    df = make_df(300_000, villes_na=True, with_rem=True)
+    start = time.perf_counter()
+    cooccurrence = CooccurrenceIndex.build(df)
+    t_build = time.perf_counter() - start
+    picked = [f"MEDICAMENT A01AA0{i} {j}" for i in range(1, 5) for j in range(5)]
+    start = time.perf_counter()
+    for _ in range(20):
+        bincount_facet(df, 'etablissement', np.flatnonzero(isin_mask(df['libelle_cip'], picked)))
+    t_rows = (time.perf_counter() - start) / 20
+    start = time.perf_counter()
+    for _ in range(20):
+        cooccurrence.facet('libelle_cip', picked, 'etablissement')
+    t_matrix = (time.perf_counter() - start) / 20
+    print(f"✅ Construction {t_build:.2f}s | {cooccurrence.nbytes / 1024**2:.1f} Mo")
+    print(f"   lignes: {t_rows * 1000:.2f} ms, matrice: {t_matrix * 1000:.2f} ms")
+
+
+def run_all_tests():
+    """Exécuter tous les tests des matrices de co-occurrence"""
+    print("🚀 TESTS DES MATRICES DE CO-OCCURRENCE PHMEV")
+    print("=" * 60)
+    print(f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 60)
+
+    tests = [
+        ("Produit matrice-vecteur", test_matrix_product),
+        ("Facettes", test_facets_with_cooccurrence),
+        ("Mémoire et vitesse", test_cooccurrence_memory_and_speed),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            results.append((test_name, True))
+        except Exception as e:
+            print(f"❌ ERREUR dans {test_name}: {e}")
+            traceback.print_exc()
+            results.append((test_name, False))
+
+    print("\n" + "=" * 60)
+    failed = sum(1 for _, ok in results if not ok)
+    for test_name, ok in results:
+        print(f"{test_name:.<30} {'✅ PASSÉ' if ok else '❌ ÉCHOUÉ'}")
+    print(f"Total: {len(results)} tests | Réussis: {len(results) - failed} | Échoués: {failed}")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
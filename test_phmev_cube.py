@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Test du cube OLAP PHMEV (établissement × CIP13)
+Vérifie que KPIs, tops et comptes distincts lus dans le cube égalent les lignes brutes, le routeur et le fichier
+"""
+
+import sys
+import os
+import time
+import tempfile
+import traceback
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# Ajouter le répertoire courant au path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phmev_cube import (ROW_COUNT_COLUMN, PhmevCube, bigquery_cube_sql, bigquery_cube_table, build_cube,
+                        cube_path_for, read_cube, read_cubes, row_count, with_row_counts, write_cube)
+from phmev_schema import encode_dimensions
+
+
+def make_df(n=300_000, seed=0, n_etb=400, n_cip=300):
+    """Dataset synthétique au format PHMEV : beaucoup de lignes par couple (établissement, CIP13)"""
+    rng = np.random.default_rng(seed)
+    cips = np.arange(3400930000000, 3400930000000 + n_cip)
+    atc5 = np.array([f"{l}{i:02d}{k}A{j:02d}" for l in "ABCL" for i in range(1, 4) for k in "AB" for j in range(1, 5)])
+    cip_atc5 = atc5[rng.integers(0, len(atc5), n_cip)]
+    etb_ville = np.array([f"VILLE {i}" for i in rng.integers(0, 60, n_etb)], dtype=object)
+    etb_ville[::17] = None
+    etb_categorie = np.array([f"CATEGORIE {i}" for i in rng.integers(0, 6, n_etb)])
+    etb, cip = rng.integers(0, n_etb, n), rng.integers(0, n_cip, n)
+    codes = cip_atc5[cip]
+    boites = rng.integers(1, 100, n).astype('int32')
+    rem = rng.integers(0, 10**7, n)
+    labels = np.array(['Non restitué'] + [f"MEDICAMENT {i} 10MG CPR" for i in range(1, n_cip)])
+    df = pd.DataFrame({
+        'atc1': [c[:1] for c in codes], 'atc2': [c[:3] for c in codes], 'atc3': [c[:4] for c in codes],
+        'atc4': [c[:5] for c in codes], 'ATC5': codes, 'L_ATC5': [f"MOLECULE {c}" for c in codes],
+        'CIP13': cips[cip], 'code_cip': cips[cip].astype(str), 'libelle_cip': labels[cip],
+        'etablissement': [f"CH {i}" for i in etb], 'ville': etb_ville[etb], 'categorie': etb_categorie[etb],
+        'BOITES': boites, 'REM': rem, 'BSE': rem + rng.integers(0, 10**6, n),
+        'cout_par_boite': rem / boites,
+    })
+    return encode_dimensions(df)
+
+
+FILTER_STATES = [
+    {},
+    {'atc1_filtre': ['A', 'L']},
+    {'atc5_filtre': ['A01AA01', 'B02BA03'], 'categorie_filtre': ['CATEGORIE 1', 'CATEGORIE 2']},
+    {'ville_filtre': ['VILLE 3', 'VILLE 7', 'VILLE 11']},
+    {'libelle_filtre': ['MEDICAMENT 5 10MG CPR', 'Non restitué'], 'etablissement_filtre': ['CH 1', 'CH 2', 'CH 3']},
+    {'etablissement_filtre': ['INCONNU']},
+]
+
+
+def raw_filter(df, current_filters):
+    """Référence : filtrage des lignes brutes"""
+    columns = {'atc1_filtre': 'atc1', 'atc5_filtre': 'ATC5', 'libelle_filtre': 'libelle_cip', 'ville_filtre': 'ville',
+               'categorie_filtre': 'categorie', 'etablissement_filtre': 'etablissement'}
+    mask = np.ones(len(df), dtype=bool)
+    for key, values in current_filters.items():
+        mask &= df[columns[key]].isin(values).to_numpy()
+    return df[mask]
+
+
+def dashboard(frame):
+    """Agrégations du tableau de bord (compute_kpis, tops, analyse CIP) sur des lignes ou des cellules"""
+    frame = with_row_counts(frame)
+    kpis = (row_count(frame), frame['BOITES'].sum(), frame['REM'].sum(), frame['BSE'].sum(),
+            frame['etablissement'].nunique())
+    etablissements = frame.groupby(['etablissement', 'ville', 'categorie'], observed=True)[['BOITES', 'REM', 'BSE']].sum()
+    produits = frame.groupby('libelle_cip', observed=True).agg(
+        {'BOITES': 'sum', 'REM': 'sum', 'BSE': 'sum', 'etablissement': 'nunique'})
+    molecules = frame.groupby('L_ATC5', observed=True).agg(
+        {'BOITES': 'sum', 'REM': 'sum', 'etablissement': 'nunique', 'libelle_cip': 'nunique'})
+    cip = frame.groupby(['code_cip', 'libelle_cip'], observed=True)[['cout_par_boite', ROW_COUNT_COLUMN]].sum()
+    cout_moyen = cip['cout_par_boite'] / cip[ROW_COUNT_COLUMN]
+    return kpis, etablissements.sort_index(), produits.sort_index(), molecules.sort_index(), cout_moyen.sort_index()
+
+
+def test_cube_equivalence():
+    """KPIs, tops, comptes distincts et coût moyen par ligne identiques aux lignes brutes"""
+    print("🧪 Test: Équivalence avec les lignes brutes...")
+    df = make_df()
+    cube = PhmevCube.build(df)
+    assert cube.source_rows == len(df) and len(cube) < len(df) / 2
+    for current_filters in FILTER_STATES:
+        assert cube.answers(current_filters)
+        cells, rows = cube.filter(current_filters), raw_filter(df, current_filters)
+        got, expected = dashboard(cells), dashboard(rows)
+        assert got[0] == expected[0], (current_filters, got[0], expected[0])
+        for got_frame, expected_frame in zip(got[1:4], expected[1:4]):
+            assert got_frame.astype('int64').equals(expected_frame.astype('int64')), current_filters
+        # Moyenne par ligne brute du coût par boîte (cout_par_boite: 'mean' sur les lignes)
+        raw_mean = rows.groupby(['code_cip', 'libelle_cip'], observed=True)['cout_par_boite'].mean().sort_index()
+        assert np.allclose(got[4].to_numpy(), raw_mean.to_numpy()), current_filters
+    # Villes manquantes : lignes comptées dans une cellule sans ville, comme dans les lignes brutes
+    assert cube.cells['ville'].isna().any() and row_count(cube.filter({})) == len(df)
+    print(f"✅ {len(FILTER_STATES)} états de filtres identiques ({len(cube):,} cellules pour {len(df):,} lignes)")
+
+
+def test_router():
+    """Seuil de boîtes par ligne ou dimension absente du cube : lignes brutes"""
+    print("\n🧪 Test: Routeur...")
+    df = make_df(20_000)
+    cube = PhmevCube.build(df)
+    assert cube.answers({'atc1_filtre': ['A']}) and cube.answers({'atc1_filtre': ['A']}, min_boites=0)
+    assert not cube.answers({'atc1_filtre': ['A']}, min_boites=5) and not cube.answers({'min_boites': 5})
+    # Année sans colonne year : pas de réponse du cube ; filtre vide : ignoré
+    assert not cube.answers({'annee_filtre': [2024]}) and cube.answers({'annee_filtre': []})
+    partial = PhmevCube(build_cube(df, ['etablissement', 'CIP13', 'libelle_cip']))
+    assert partial.answers({'libelle_filtre': ['MEDICAMENT 1 10MG CPR']}) and not partial.answers({'ville_filtre': ['VILLE 1']})
+    # Lignes brutes : une ligne par ligne ; cellules : somme de nb_lignes
+    assert row_count(df) == len(df) and row_count(cube.cells) == len(df)
+    print("✅ min_boites et dimensions absentes renvoyées aux lignes brutes")
+
+
+def test_cube_file():
+    """Cube relu à l'identique tant que le fichier préparé n'a pas changé ; années réunies avec leur colonne year"""
+    print("\n🧪 Test: Fichier du cube...")
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {}
+        for year, seed in ((2023, 1), (2024, 2)):
+            df = make_df(20_000, seed=seed)
+            paths[year] = os.path.join(tmp, f"OPEN_PHMEV_{year}_analytics.parquet")
+            df.to_parquet(paths[year])
+            assert read_cube(cube_path_for(paths[year]), paths[year]) is None
+            write_cube(PhmevCube.build(df), cube_path_for(paths[year]), paths[year])
+            cube = read_cube(cube_path_for(paths[year]), paths[year])
+            assert cube.source_rows == len(df) and dashboard(cube.cells)[0] == dashboard(df)[0]
+            assert PhmevCube.load_or_build(df, paths[year]).source_rows == len(df)
+        both = read_cubes(paths)
+        assert both.source_rows == 40_000 and sorted(both.cells['year'].unique()) == [2023, 2024]
+        assert row_count(both.filter({'annee_filtre': [2023]})) == 20_000
+        assert row_count(both.filter({'annee_filtre': [2023], 'etablissement_filtre': ['CH 1']})) == len(
+            raw_filter(make_df(20_000, seed=1), {'etablissement_filtre': ['CH 1']}))
+        # Fichier préparé reconstruit : l'ancien cube n'est plus relu
+        make_df(10_000, seed=3).to_parquet(paths[2024])
+        assert read_cube(cube_path_for(paths[2024]), paths[2024]) is None and read_cubes(paths) is None
+    print("✅ Empreinte du fichier préparé vérifiée, années réunies")
+
+
+def test_bigquery_sql():
+    """Cube BigQuery : colonnes brutes, sommes, nombre de lignes, version de la source"""
+    print("\n🧪 Test: Cube BigQuery...")
+    sql = bigquery_cube_sql('projet.dataset.PHMEV2024', 'PHMEV2024@2025-01-01T00:00:00')
+    assert 'CREATE OR REPLACE TABLE `projet.dataset.PHMEV2024_CUBE`' in sql
+    assert 'COUNT(*) AS nb_lignes' in sql and 'SUM(REM) AS REM' in sql and 'PARTITION BY' not in sql
+    assert "description='phmev_cube:1:PHMEV2024@2025-01-01T00:00:00'" in sql
+    assert 'GROUP BY atc1, l_atc1' in sql and 'nom_etb, raison_sociale_etb, nom_ville, categorie_jur' in sql
+    sql = bigquery_cube_sql('projet.dataset.PHMEV', 'PHMEV@v', partitioned=True)
+    assert 'SELECT\n        year, atc1' in sql and 'RANGE_BUCKET(year' in sql
+    assert bigquery_cube_table('projet.dataset.PHMEV') == 'projet.dataset.PHMEV_CUBE'
+    print("✅ Requête de matérialisation du cube")
+
+
+def test_cube_latency():
+    """📈 Tableau de bord sur les cellules vs sur les lignes brutes"""
+    print("\n🧪 Test: Latence...")
+    df = make_df(2_000_000, n_etb=1_000, n_cip=500)
+    start = time.perf_counter()
+    cube = PhmevCube.build(df)
+    t_build = time.perf_counter() - start
+    timings = []
+    for frame_of in (lambda f: raw_filter(df, f), cube.filter):
+        start = time.perf_counter()
+        for current_filters in FILTER_STATES:
+            dashboard(frame_of(current_filters))
+        timings.append((time.perf_counter() - start) / len(FILTER_STATES) * 1000)
+    print(f"✅ {len(df):,} lignes → {len(cube):,} cellules (÷{cube.compression:.1f}) en {t_build:.2f}s, "
+          f"{cube.nbytes / 1024**2:.1f} Mo")
+    print(f"   tableau de bord: lignes {timings[0]:.1f} ms, cube {timings[1]:.1f} ms")
+
+
+def run_all_tests():
+    """Exécuter tous les tests du cube"""
+    print("🚀 TESTS DU CUBE OLAP PHMEV")
+    print("=" * 60)
+    print(f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 60)
+
+    tests = [
+        ("Équivalence", test_cube_equivalence),
+        ("Routeur", test_router),
+        ("Fichier du cube", test_cube_file),
+        ("Cube BigQuery", test_bigquery_sql),
+        ("Latence", test_cube_latency),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            results.append((test_name, True))
+        except Exception as e:
+            print(f"❌ ERREUR dans {test_name}: {e}")
+            traceback.print_exc()
+            results.append((test_name, False))
+
+    print("\n" + "=" * 60)
+    failed = sum(1 for _, ok in results if not ok)
+    for test_name, ok in results:
+        print(f"{test_name:.<30} {'✅ PASSÉ' if ok else '❌ ÉCHOUÉ'}")
+    print(f"Total: {len(results)} tests | Réussis: {len(results) - failed} | Échoués: {failed}")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
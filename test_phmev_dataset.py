@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Test de la lecture du dataset PHMEV
+Vérifie la projection des colonnes et les différents formats de lecture
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import traceback
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# Ajouter le répertoire courant au path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phmev_schema import DASHBOARD_COLUMNS, FILTER_COLUMNS, NON_INFORMATIVE_CIP_LABELS, is_encoded, isin_mask
+from phmev_dataset import (PREPARED_FORMAT_VERSION, LazyPhmevDataset, available_years, build_analytics_dataset,
+                           convert_csv_to_parquet, dataset_fingerprint, euros_select_sql, filter_expression,
+                           ipc_path_for, is_prepared_parquet, load_phmev_dataframe, load_year_dataframe,
+                           open_prepared_ipc, partition_files, prepare_dataframe, projected_columns,
+                           read_prepared_ipc, read_prepared_parquet, read_projected_parquet, selectable_years,
+                           source_fingerprint, year_partition_path)
+
+
+def make_raw_df(n=5000, seed=0):
+    """Extrait synthétique au format du fichier OPEN_PHMEV (colonnes brutes + colonnes inutilisées)"""
+    rng = np.random.default_rng(seed)
+    atc5 = np.array([f"{l}{i:02d}AA{j:02d}" for l in "ABL" for i in range(1, 4) for j in range(1, 4)])
+    codes = atc5[rng.integers(0, len(atc5), n)]
+    libelles = np.array(['CABOMETYX 20MG CPR 30', 'DOLIPRANE 1000MG CPR 8', 'KEYTRUDA 25MG/ML',
+                         'Non restitué', 'Honoraires de dispensation', None], dtype=object)
+    etb = rng.integers(0, 50, n)
+    df = pd.DataFrame({
+        'atc1': [c[:1] for c in codes], 'l_atc1': [f"SYSTEME {c[:1]}" for c in codes],
+        'atc2': [c[:3] for c in codes], 'L_ATC2': [f"GROUPE {c[:3]}" for c in codes],
+        'atc3': [c[:4] for c in codes], 'L_ATC3': [f"SOUS-GROUPE {c[:4]}" for c in codes],
+        'atc4': [c[:5] for c in codes], 'L_ATC4': [f"CHIMIQUE {c[:5]}" for c in codes],
+        'ATC5': codes, 'L_ATC5': [f"MOLECULE {c}" for c in codes],
+        'CIP13': rng.integers(3400930000000, 3400930000020, n),
+        'l_cip13': libelles[rng.integers(0, len(libelles), n)],
+        'nom_etb': [f"CH {i}" if i % 5 else None for i in etb],
+        'raison_sociale_etb': [f"CENTRE HOSPITALIER {i}" for i in etb],
+        'categorie_jur': [f"CAT {i % 4}" for i in etb],
+        'nom_ville': [f"VILLE {i % 12}" for i in etb],
+        'region_etb': (etb % 13 + 1).astype('int16'),
+        'BOITES': rng.integers(0, 500, n),
+        'REM': np.round(rng.random(n) * 1000, 2),
+        'BSE': np.round(rng.random(n) * 1200, 2),
+        # Colonnes non utilisées par le dashboard
+        'TOP_GEN': rng.integers(0, 2, n),
+        'GEN_NUM': rng.integers(0, 900, n),
+        'adresse_etb': [f"{i} RUE DE LA SANTE" for i in etb],
+    })
+    return df
+
+
+def test_projected_read():
+    """Seules les colonnes du manifeste présentes dans le fichier sont lues"""
+    print("🧪 Test: Lecture projetée...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'OPEN_PHMEV_2024.parquet')
+        raw = make_raw_df()
+        raw.to_parquet(path)
+
+        columns = projected_columns(path)
+        assert columns == DASHBOARD_COLUMNS
+        df = read_projected_parquet(path)
+        assert list(df.columns) == DASHBOARD_COLUMNS
+        assert 'adresse_etb' not in df.columns and len(df) == len(raw)
+
+        # Colonnes dérivées déjà présentes dans le fichier : conservées
+        raw.assign(etablissement=raw['raison_sociale_etb']).to_parquet(path)
+        assert 'etablissement' in read_projected_parquet(path).columns
+        print(f"✅ {len(columns)} colonnes lues sur {len(raw.columns)}")
+
+
+def test_prepare_matches_sql():
+    """Nettoyage et colonnes dérivées identiques aux requêtes SQL de la version DuckDB"""
+    print("\n🧪 Test: Préparation vs SQL DuckDB...")
+    import duckdb
+    raw = make_raw_df()
+    raw.loc[raw.index[::7], 'nom_etb'] = ''
+    prepared = prepare_dataframe(raw.copy())
+
+    expected = duckdb.sql("""
+        SELECT COALESCE(NULLIF(nom_etb, ''), NULLIF(raison_sociale_etb, ''), 'Non spécifié') AS etablissement,
+               COALESCE(NULLIF(nom_ville, ''), 'Non spécifiée') AS ville,
+               CASE WHEN BSE > 0 THEN (REM / BSE) * 100 ELSE 0 END AS taux_remboursement
+        FROM raw
+        WHERE l_cip13 NOT IN ('Non restitué', 'Non spécifié', 'Honoraires de dispensation')
+        AND l_cip13 IS NOT NULL
+    """).df()
+    assert len(prepared) == len(expected)
+    assert not prepared['l_cip13'].isin(NON_INFORMATIVE_CIP_LABELS).any()
+    assert prepared['etablissement'].astype(str).tolist() == expected['etablissement'].tolist()
+    assert prepared['ville'].astype(str).tolist() == expected['ville'].tolist()
+    assert np.allclose(prepared['taux_remboursement'], expected['taux_remboursement'])
+    assert 'None' not in set(prepared['etablissement'].astype(str))
+    assert prepared['BOITES'].dtype == 'int32' and is_encoded(prepared['etablissement'])
+    print(f"✅ {len(prepared):,} lignes identiques à la version SQL")
+
+
+def test_build_analytics_dataset():
+    """Le fichier préparé est relu tel quel : trié, typé, encodé, en plusieurs row groups"""
+    print("\n🧪 Test: Construction du fichier préparé...")
+    import pyarrow.parquet as pq
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_path = os.path.join(tmp, 'OPEN_PHMEV_2024.parquet')
+        prepared_path = os.path.join(tmp, 'OPEN_PHMEV_2024_analytics.parquet')
+        make_raw_df(20_000).to_parquet(raw_path)
+
+        # Sans fichier préparé : préparation à la volée
+        on_the_fly = load_phmev_dataframe(prepared_path, raw_path)
+
+        rows = build_analytics_dataset(raw_path, prepared_path, row_group_size=4096)
+        assert is_prepared_parquet(prepared_path) and not is_prepared_parquet(raw_path)
+        assert pq.ParquetFile(prepared_path).metadata.num_row_groups > 1
+
+        os.remove(ipc_path_for(prepared_path))
+        df = load_phmev_dataframe(prepared_path, raw_path)
+        assert len(df) == rows == len(on_the_fly)
+        assert df['ATC5'].astype(str).is_monotonic_increasing
+        assert is_encoded(df['etablissement']) and df['BOITES'].dtype == 'int32'
+        assert set(df.columns) == set(on_the_fly.columns)
+        assert np.isclose(df['REM'].sum(), on_the_fly['REM'].sum())
+        print(f"✅ {rows:,} lignes, {pq.ParquetFile(prepared_path).metadata.num_row_groups} row groups")
+
+
+def test_memory_mapped_ipc():
+    """La copie IPC est relue par memory_map sans copie, avec le même contenu que le Parquet préparé"""
+    print("\n🧪 Test: Copie Arrow IPC mappée en mémoire...")
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_path = os.path.join(tmp, 'OPEN_PHMEV_2024.parquet')
+        prepared_path = os.path.join(tmp, 'OPEN_PHMEV_2024_analytics.parquet')
+        make_raw_df(20_000).to_parquet(raw_path)
+        build_analytics_dataset(raw_path, prepared_path, row_group_size=4096)
+        ipc_path = ipc_path_for(prepared_path)
+        assert os.path.exists(ipc_path)
+
+        table = open_prepared_ipc(ipc_path)
+        assert table.schema.metadata[b'phmev_prepared'] == PREPARED_FORMAT_VERSION.encode()
+        # Aucun buffer alloué : toutes les données pointent dans le fichier mappé
+        import pyarrow as pa
+        assert pa.total_allocated_bytes() < table.nbytes // 10
+
+        df = read_prepared_ipc(ipc_path)
+        assert not df['REM'].to_numpy().flags.writeable
+        expected = read_prepared_parquet(prepared_path)
+        pd.testing.assert_frame_equal(df.astype({'CIP13': 'int64'}), expected.astype({'CIP13': 'int64'}))
+        assert load_phmev_dataframe(prepared_path, raw_path)['REM'].sum() == df['REM'].sum()
+        print(f"✅ {len(df):,} lignes, {os.path.getsize(ipc_path) / 1024:,.0f} Ko mappés")
+        del table, df
+
+
+def to_french_csv(df, csv_path):
+    """Écrit un extrait au format de l'export : latin1, « ; », montants 336.578,01"""
+    export = df.copy()
+    for col in ('REM', 'BSE'):
+        export[col] = [f"{v:,.2f}".replace(',', ' ').replace('.', ',').replace(' ', '.') for v in export[col]]
+    export.to_csv(csv_path, sep=';', index=False, encoding='latin1')
+
+
+def test_streaming_csv_conversion():
+    """Conversion CSV → Parquet bloc par bloc : mêmes valeurs, types compacts, plusieurs row groups"""
+    print("\n🧪 Test: Conversion CSV en streaming...")
+    import pyarrow.parquet as pq
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = make_raw_df(30_000)
+        raw['REM'] = raw['REM'] * 1000  # Montants avec séparateurs de milliers
+        csv_path = os.path.join(tmp, 'OPEN_PHMEV_2024.CSV')
+        parquet_path = os.path.join(tmp, 'OPEN_PHMEV_2024.parquet')
+        to_french_csv(raw, csv_path)
+
+        rows = convert_csv_to_parquet(csv_path, parquet_path, block_size=64 * 1024, row_group_size=8192)
+        assert rows == len(raw)
+        metadata = pq.ParquetFile(parquet_path).metadata
+        assert metadata.num_row_groups == 4
+        assert max(metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)) == 8192
+
+        df = pd.read_parquet(parquet_path)
+        assert df['BOITES'].dtype == 'int32' and df['region_etb'].dtype == 'int16'
+        assert df['CIP13'].dtype == 'int64' and df['REM'].dtype == 'float64'
+        assert np.allclose(df['REM'], raw['REM']) and np.allclose(df['BSE'], raw['BSE'])
+        assert df['l_cip13'].isna().sum() == raw['l_cip13'].isna().sum()
+        assert (df['l_cip13'] == 'Non restitué').sum() == (raw['l_cip13'] == 'Non restitué').sum()
+        assert df['nom_etb'].isna().sum() == raw['nom_etb'].isna().sum()
+        print(f"✅ {rows:,} lignes, {metadata.num_row_groups} row groups, montants identiques")
+
+
+def test_lazy_pushdown():
+    """Lecture filtrée à la source == filtrage en mémoire, avec élagage des row groups"""
+    print("\n🧪 Test: Lecture filtrée (predicate pushdown)...")
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_path = os.path.join(tmp, 'OPEN_PHMEV_2024.parquet')
+        prepared_path = os.path.join(tmp, 'OPEN_PHMEV_2024_analytics.parquet')
+        make_raw_df(40_000).to_parquet(raw_path)
+        build_analytics_dataset(raw_path, prepared_path, row_group_size=2048)
+        full = read_prepared_parquet(prepared_path)
+        lazy = LazyPhmevDataset(prepared_path)
+        assert len(lazy) == len(full) and filter_expression({}) is None
+
+        filters = {'atc5_filtre': ['A01AA02'], 'ville_filtre': ['VILLE 1', 'VILLE 3']}
+        mask = np.ones(len(full), dtype=bool)
+        for filter_key, column in FILTER_COLUMNS:
+            if filters.get(filter_key):
+                mask &= isin_mask(full[column], filters[filter_key])
+        expected = full[mask].reset_index(drop=True)
+
+        view = lazy.filter({'atc5_filtre': filters['atc5_filtre']}).filter({'ville_filtre': filters['ville_filtre']})
+        got = view.scan()
+        assert len(view) == len(got) == len(expected) > 0
+        assert np.isclose(got['REM'].sum(), expected['REM'].sum())
+        assert set(got['ville'].astype(str)) <= set(filters['ville_filtre'])
+        assert list(view.scan(['etablissement', 'BOITES']).columns) == ['etablissement', 'BOITES']
+
+        # Fichier trié par ATC5 : seuls quelques row groups sont candidats
+        expression = filter_expression(filters)
+        total = sum(f.num_row_groups for f in lazy.dataset.get_fragments())
+        kept = sum(len(f.split_by_row_group(expression)) for f in lazy.dataset.get_fragments(filter=expression))
+        assert kept < total
+        print(f"✅ {len(got):,} lignes identiques, {kept}/{total} row groups lus")
+
+
+def test_year_partitions():
+    """Disposition multi-années : chargement d'une seule année, élagage des partitions par le filtre d'année"""
+    print("\n🧪 Test: Partitions annuelles...")
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, 'OPEN_PHMEV')
+        for year, seed in ((2023, 1), (2024, 2)):
+            raw_path = os.path.join(tmp, f'OPEN_PHMEV_{year}.parquet')
+            make_raw_df(3000, seed=seed).to_parquet(raw_path)
+            build_analytics_dataset(raw_path, year_partition_path(year, root))
+        assert available_years(root) == [2023, 2024] and available_years(os.path.join(tmp, 'absent')) == []
+        # Partition 2023 seule : le fichier historique 2024 reste proposé tant qu'il existe
+        only_2023 = os.path.join(tmp, 'OPEN_PHMEV_2023_seule')
+        os.makedirs(os.path.dirname(year_partition_path(2023, only_2023)))
+        shutil.copy(year_partition_path(2023, root), year_partition_path(2023, only_2023))
+        assert selectable_years(only_2023, legacy=True) == [2023, 2024] and selectable_years(only_2023, legacy=False) == [2023]
+        assert selectable_years(root, legacy=True) == [2023, 2024]
+        assert partition_files(root, years=[2024]) == [year_partition_path(2024, root)]
+
+        # Une année = une seule partition lue, sans colonne year
+        df_2023 = load_year_dataframe(2023, root)
+        assert len(df_2023) == len(read_prepared_parquet(year_partition_path(2023, root)))
+        try:
+            load_year_dataframe(2019, root)
+        except FileNotFoundError:
+            pass
+        else:
+            raise AssertionError("Une année absente doit lever FileNotFoundError")
+
+        # Plusieurs années en lecture filtrée : la colonne year vient du chemin, les autres partitions sont ignorées
+        lazy = LazyPhmevDataset(root)
+        both = lazy.scan(['year', 'BOITES'])
+        assert sorted(both['year'].unique()) == [2023, 2024]
+        view = lazy.filter({'annee_filtre': [2023]})
+        assert len(view) == len(df_2023)
+        assert view.scan(['year'])['year'].unique().tolist() == [2023]
+        expression = filter_expression(view.filters)
+        assert len(list(lazy.dataset.get_fragments(filter=expression))) == 1
+        print(f"✅ {len(both):,} lignes sur 2 années, 1/2 partition lue pour 2023")
+
+
+def test_dataset_fingerprint():
+    """Empreinte du footer : stable tant que le fichier ne change pas, différente dès qu'il est reconstruit"""
+    print("\n🧪 Test: Empreinte de version du dataset...")
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_path = os.path.join(tmp, 'OPEN_PHMEV_2024.parquet')
+        root = os.path.join(tmp, 'OPEN_PHMEV')
+        prepared_path = year_partition_path(2024, root)
+        make_raw_df(3000).to_parquet(raw_path)
+        build_analytics_dataset(raw_path, prepared_path)
+
+        first = dataset_fingerprint(prepared_path)
+        assert first == dataset_fingerprint(prepared_path) == source_fingerprint(2024, root)
+        root_first = dataset_fingerprint(root)
+        os.utime(prepared_path, (0, 0))  # mtime seule : même contenu, même empreinte
+        assert dataset_fingerprint(prepared_path) == first
+
+        make_raw_df(3000, seed=7).to_parquet(raw_path)
+        build_analytics_dataset(raw_path, prepared_path)
+        assert dataset_fingerprint(prepared_path) != first
+        assert dataset_fingerprint(root) != root_first
+        assert source_fingerprint(2019, root) is None
+        print(f"✅ {first} -> {dataset_fingerprint(prepared_path)} après reconstruction")
+
+
+def test_money_in_cents():
+    """Fichier préparé : REM/BSE en centimes int64, totaux exacts, euros côté DuckDB"""
+    print("\n🧪 Test: Montants en centimes dans le fichier préparé...")
+    import duckdb
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_path = os.path.join(tmp, 'OPEN_PHMEV_2024.parquet')
+        prepared_path = os.path.join(tmp, 'OPEN_PHMEV_2024_analytics.parquet')
+        raw = make_raw_df(20_000)
+        raw.to_parquet(raw_path)
+        build_analytics_dataset(raw_path, prepared_path)
+
+        df = read_prepared_parquet(prepared_path)
+        assert df['REM'].dtype == 'int64' and df['BSE'].dtype == 'int64' and df['BOITES'].dtype == 'int32'
+        kept = raw[raw['l_cip13'].notna() & ~raw['l_cip13'].isin(NON_INFORMATIVE_CIP_LABELS)]
+        assert df['REM'].sum() == sum(round(x * 100) for x in kept['REM'])
+        assert read_prepared_ipc(ipc_path_for(prepared_path))['BSE'].sum() == df['BSE'].sum()
+
+        conn = duckdb.connect()
+        conn.register('prepared', open_prepared_ipc(ipc_path_for(prepared_path)))
+        total = conn.execute(f"SELECT SUM(REM) FROM ({euros_select_sql(conn, 'prepared')})").fetchone()[0]
+        assert np.isclose(total, df['REM'].sum() / 100)
+        print(f"✅ {df['REM'].sum():,} centimes, {total:,.2f}€ côté DuckDB")
+
+
+def run_all_tests():
+    """Exécuter tous les tests de lecture du dataset"""
+    print("🚀 TESTS DE LECTURE DU DATASET PHMEV")
+    print("=" * 60)
+    print(f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 60)
+
+    tests = [
+        ("Lecture projetée", test_projected_read),
+        ("Préparation vs SQL", test_prepare_matches_sql),
+        ("Fichier préparé", test_build_analytics_dataset),
+        ("Copie IPC mappée", test_memory_mapped_ipc),
+        ("Conversion CSV", test_streaming_csv_conversion),
+        ("Lecture filtrée", test_lazy_pushdown),
+        ("Partitions annuelles", test_year_partitions),
+        ("Empreinte de version", test_dataset_fingerprint),
+        ("Montants en centimes", test_money_in_cents),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            results.append((test_name, True))
+        except Exception as e:
+            print(f"❌ ERREUR dans {test_name}: {e}")
+            traceback.print_exc()
+            results.append((test_name, False))
+
+    print("\n" + "=" * 60)
+    failed = sum(1 for _, ok in results if not ok)
+    for test_name, ok in results:
+        print(f"{test_name:.<30} {'✅ PASSÉ' if ok else '❌ ÉCHOUÉ'}")
+    print(f"Total: {len(results)} tests | Réussis: {len(results) - failed} | Échoués: {failed}")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
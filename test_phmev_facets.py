@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Test du moteur de facettes PHMEV
+Vérifie options et sommes par facette (chaque dimension ignorant son propre filtre) contre un groupby pandas
+"""
+
+import sys
+import os
+import time
+import traceback
+from datetime import datetime
+import numpy as np
+
+# Ajouter le répertoire courant au path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phmev_facets import FACET_COLUMNS, compute_facets, facet_groups, format_boites
+from phmev_index import BitmapIndex
+from phmev_schema import FILTER_COLUMNS
+from phmev_testdata import make_df
+
+
+def reference_facet(df, current_filters, filter_key):
+    """Facette attendue : filtres actifs sauf celui de la dimension, puis groupby sur les chaînes"""
+    mask = np.ones(len(df), dtype=bool)
+    for key, column in FILTER_COLUMNS:
+        if key != filter_key and current_filters.get(key):
+            mask &= df[column].astype(str).isin(current_filters[key]).to_numpy()
+    subset = df[mask]
+    column = FACET_COLUMNS[filter_key]
+    grouped = subset.groupby(subset[column].astype(str), observed=True)
+    return grouped.agg(lignes=('BOITES', 'size'), BOITES=('BOITES', 'sum'), REM=('REM', 'sum')).sort_index()
+
+
+def test_facet_groups():
+    """Sans filtre : une seule sélection ; k filtres actifs : k + 1 sélections"""
+    print("🧪 Test: Groupes de facettes...")
+    assert len(facet_groups({})) == 1
+    groups = facet_groups({'atc1_filtre': ['A'], 'ville_filtre': ['VILLE 1'], 'categorie_filtre': []})
+    assert len(groups) == 3
+    assert groups[('ville_filtre',)] == ['atc1_filtre'] and groups[('atc1_filtre',)] == ['ville_filtre']
+    assert len(groups[('atc1_filtre', 'ville_filtre')]) == len(FACET_COLUMNS) - 2
+    print(f"✅ {len(groups)} sélections pour 2 filtres actifs")
+
+
+def test_facets_equivalence():
+    """Options, lignes, boîtes et REM identiques au groupby pandas, avec et sans index bitmap"""
+    print("\n🧪 Test: Équivalence des facettes...")
+    df = make_df(with_rem=True)
+    states = [
+        {},
+        {'atc1_filtre': ['A', 'C']},
+        {'atc1_filtre': ['A'], 'ville_filtre': ['VILLE 1', 'VILLE 2'], 'categorie_filtre': ['CATEGORIE 3']},
+        {'atc5_filtre': ['A01AA01'], 'etablissement_filtre': ['CH 7', 'CH 8', 'INCONNU']},
+    ]
+    for bitmap_index in (None, BitmapIndex.build(df)):
+        for current_filters in states:
+            facets = compute_facets(df, current_filters, bitmap_index)
+            assert set(facets) == set(FACET_COLUMNS)
+            for filter_key in FACET_COLUMNS:
+                expected = reference_facet(df, current_filters, filter_key)
+                got = facets[filter_key].sort_index()
+                assert list(got.index.astype(str)) == list(expected.index), filter_key
+                for col in ('lignes', 'BOITES', 'REM'):
+                    assert np.array_equal(got[col].to_numpy(), expected[col].to_numpy()), (filter_key, col)
+    # Un filtre ne réduit pas ses propres options : toutes les villes restent proposées
+    facets = compute_facets(df, {'ville_filtre': ['VILLE 1']})
+    assert len(facets['ville_filtre']) == 300 and len(facets['etablissement_filtre']) < 1000
+    assert facets['atc1_filtre']['REM'].dtype == np.int64
+    print(f"✅ {len(states)} états x {len(FACET_COLUMNS)} facettes identiques (REM exact en centimes)")
+
+
+def test_facets_speed():
+    """📈 Toutes les facettes en une passe par sélection vs un groupby par dimension"""
+    print("\n🧪 Test: Vitesse des facettes...")
+    df = make_df(with_rem=True)
+    current_filters = {'atc1_filtre': ['A', 'B'], 'categorie_filtre': ['CATEGORIE 1']}
+    start = time.perf_counter()
+    for filter_key in FACET_COLUMNS:
+        reference_facet(df, current_filters, filter_key)
+    t_groupby = time.perf_counter() - start
+    start = time.perf_counter()
+    compute_facets(df, current_filters)
+    t_facets = time.perf_counter() - start
+    assert format_boites(1234567) == "(1 234 567 boîtes)"
+    print(f"✅ groupby: {t_groupby * 1000:.0f} ms, bincount: {t_facets * 1000:.0f} ms")
+
+
+def run_all_tests():
+    """Exécuter tous les tests du moteur de facettes"""
+    print("🚀 TESTS DU MOTEUR DE FACETTES PHMEV")
+    print("=" * 60)
+    print(f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 60)
+
+    tests = [
+        ("Groupes de facettes", test_facet_groups),
+        ("Équivalence", test_facets_equivalence),
+        ("Vitesse", test_facets_speed),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            results.append((test_name, True))
+        except Exception as e:
+            print(f"❌ ERREUR dans {test_name}: {e}")
+            traceback.print_exc()
+            results.append((test_name, False))
+
+    print("\n" + "=" * 60)
+    failed = sum(1 for _, ok in results if not ok)
+    for test_name, ok in results:
+        print(f"{test_name:.<30} {'✅ PASSÉ' if ok else '❌ ÉCHOUÉ'}")
+    print(f"Total: {len(results)} tests | Réussis: {len(results) - failed} | Échoués: {failed}")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Test de l'index bitmap PHMEV
+Vérifie que toute combinaison de filtres résolue par bitsets donne les mêmes lignes que les masques isin
+"""
+
+import sys
+import os
+import time
+import traceback
+from datetime import datetime
+import numpy as np
+
+# Ajouter le répertoire courant au path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phmev_index import BitmapIndex, Bitset, FilterCascade
+from phmev_schema import FILTER_COLUMNS, isin_mask
+from phmev_testdata import make_df
+
+
+def reference_mask(df, current_filters):
+    """Chaîne de isin_mask (ancienne résolution des filtres)"""
+    mask = np.ones(len(df), dtype=bool)
+    for filter_key, column in FILTER_COLUMNS:
+        if current_filters.get(filter_key):
+            mask &= isin_mask(df[column], current_filters[filter_key])
+    return mask
+
+
+def test_bitset_containers():
+    """Chaque conteneur (plages, positions, bitmap) restitue exactement ses lignes"""
+    print("🧪 Test: Conteneurs de bitsets...")
+    n = 10_000
+    cases = {
+        'runs': np.r_[np.arange(100, 900), np.arange(5000, 7000)],
+        'rows': np.arange(3, n, 97),
+        'bits': np.arange(0, n, 3),
+    }
+    for kind, rows in cases.items():
+        bitset = Bitset.from_rows(rows, n)
+        assert bitset.kind == kind, (kind, bitset.kind)
+        assert np.array_equal(bitset.rows(), rows)
+        assert np.array_equal(np.flatnonzero(bitset.fill(np.zeros(n, dtype=bool))), rows)
+    print(f"✅ runs / rows / bits identiques aux positions d'origine")
+
+
+def test_filter_equivalence():
+    """Combinaisons aléatoires de filtres : mêmes lignes qu'avec isin_mask, valeurs inconnues comprises"""
+    print("\n🧪 Test: Équivalence avec les masques isin...")
+    df = make_df(300_000, villes_na=True)
+    index = BitmapIndex.build(df)
+    rng = np.random.default_rng(1)
+    assert index.rows({}) is None and index.rows({'ville_filtre': []}) is None
+
+    for _ in range(200):
+        current_filters = {}
+        for filter_key, column in FILTER_COLUMNS:
+            if rng.random() < 0.3:
+                values = list(df[column].cat.categories)
+                picked = [values[i] for i in rng.integers(0, len(values), rng.integers(1, 4))]
+                current_filters[filter_key] = picked + (['INCONNUE'] if rng.random() < 0.1 else [])
+        expected = reference_mask(df, current_filters)
+        rows = index.rows(current_filters)
+        if rows is None:
+            assert expected.all()
+        else:
+            assert np.array_equal(rows, np.flatnonzero(expected)), current_filters
+            assert np.array_equal(index.mask(current_filters), expected)
+    print(f"✅ 200 combinaisons identiques")
+
+
+def test_cascade_memo():
+    """Cascade incrémentale : mêmes lignes que isin_mask, niveaux amont servis par le memo"""
+    print("\n🧪 Test: Cascade incrémentale...")
+    df = make_df(300_000, villes_na=True)
+    memo = {}
+    levels = [('atc1_filtre', ['A', 'B']), ('atc2_filtre', ['A01', 'B02']),
+              ('atc3_filtre', []), ('atc4_filtre', ['A01AA', 'A01BA', 'B02AA']),
+              ('atc5_filtre', ['A01AA01', 'B02AA03'])]
+    for bitmap_index in (None, BitmapIndex.build(df)):
+        memo.clear()
+        # Première exécution : chaque niveau ajoute une contrainte aux lignes du niveau précédent
+        cascade = FilterCascade(df, bitmap_index, memo)
+        current_filters = {}
+        for filter_key, values in levels:
+            current_filters[filter_key] = values
+            expected = np.flatnonzero(reference_mask(df, current_filters))
+            assert np.array_equal(cascade.rows(current_filters), expected), filter_key
+        assert np.array_equal(cascade.frame(current_filters).index, df.index[expected])
+
+        # Exécution suivante, seul l'ATC5 change : ATC1..4 viennent du memo, un seul niveau recalculé
+        cascade = FilterCascade(df, bitmap_index, memo)
+        current_filters['atc5_filtre'] = ['A01AA02']
+        rows = cascade.rows(current_filters)
+        assert np.array_equal(rows, np.flatnonzero(reference_mask(df, current_filters)))
+        assert (cascade.hits, cascade.misses) == (3, 1)
+
+        # Retour en arrière à l'ATC1 : les niveaux aval mémorisés ne sont plus valides
+        cascade = FilterCascade(df, bitmap_index, memo)
+        current_filters = {'atc1_filtre': ['C'], 'ville_filtre': ['VILLE 5']}
+        assert np.array_equal(cascade.rows(current_filters), np.flatnonzero(reference_mask(df, current_filters)))
+        assert cascade.hits == 0 and len(memo) <= len(FILTER_COLUMNS)
+    print(f"✅ Lignes identiques, ATC1..4 réutilisés quand seul l'ATC5 change")
+
+
+def test_index_memory_and_speed():
+    """📈 Mémoire de l'index et temps de résolution vs chaîne de isin_mask"""
+    print("\n🧪 Test: Mémoire et vitesse de l'index...")
+    df = make_df(300_000, villes_na=True)
+    start = time.perf_counter()
+    index = BitmapIndex.build(df)
+    t_build = time.perf_counter() - start
+    kinds = {}
+    for column in index.columns():
+        for bitset in index._dimensions[column][1]:
+            if bitset is not None:
+                kinds[bitset.kind] = kinds.get(bitset.kind, 0) + 1
+    # Dataset trié par ATC5 : les niveaux ATC tiennent en quelques plages
+    assert all(b.kind == 'runs' for b in index._dimensions['ATC5'][1] if b is not None)
+
+    current_filters = {'atc1_filtre': ['A', 'B'], 'categorie_filtre': ['CATEGORIE 1'],
+                       'ville_filtre': ['VILLE 1', 'VILLE 2', 'VILLE 3']}
+    start = time.perf_counter()
+    for _ in range(20):
+        reference_mask(df, current_filters)
+    t_isin = (time.perf_counter() - start) / 20
+    start = time.perf_counter()
+    for _ in range(20):
+        index.rows(current_filters)
+    t_index = (time.perf_counter() - start) / 20
+    print(f"✅ Construction {t_build:.2f}s | {index.nbytes / 1024**2:.1f} Mo | conteneurs {kinds}")
+    print(f"   isin: {t_isin * 1000:.2f} ms, bitsets: {t_index * 1000:.2f} ms")
+
+
+def run_all_tests():
+    """Exécuter tous les tests de l'index bitmap"""
+    print("🚀 TESTS DE L'INDEX BITMAP PHMEV")
+    print("=" * 60)
+    print(f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 60)
+
+    tests = [
+        ("Conteneurs", test_bitset_containers),
+        ("Équivalence isin", test_filter_equivalence),
+        ("Cascade incrémentale", test_cascade_memo),
+        ("Mémoire et vitesse", test_index_memory_and_speed),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            results.append((test_name, True))
+        except Exception as e:
+            print(f"❌ ERREUR dans {test_name}: {e}")
+            traceback.print_exc()
+            results.append((test_name, False))
+
+    print("\n" + "=" * 60)
+    failed = sum(1 for _, ok in results if not ok)
+    for test_name, ok in results:
+        print(f"{test_name:.<30} {'✅ PASSÉ' if ok else '❌ ÉCHOUÉ'}")
+    print(f"Total: {len(results)} tests | Réussis: {len(results) - failed} | Échoués: {failed}")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
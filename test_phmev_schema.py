@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Test du schéma compact PHMEV (dimensions encodées en dictionnaire)
+Vérifie que filtres et options calculés sur les codes entiers donnent les mêmes résultats que sur les chaînes
+"""
+
+import sys
+import os
+import time
+import traceback
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# Ajouter le répertoire courant au path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phmev_schema import (encode_dimensions, ensure_cents, isin_mask, money_in_euros, present_values, present_pairs,
+                          parse_french_decimal, to_cents)
+
+
+def make_df(n=200_000, seed=0):
+    """Petit dataset synthétique au format PHMEV"""
+    rng = np.random.default_rng(seed)
+    atc5 = np.array([f"{l}{i:02d}AA{j:02d}" for l in "ABCL" for i in range(1, 6) for j in range(1, 6)])
+    codes = atc5[rng.integers(0, len(atc5), n)]
+    villes = np.array([f"VILLE {i}" for i in range(300)] + [None], dtype=object)
+    return pd.DataFrame({
+        'atc1': [c[:1] for c in codes],
+        'l_atc1': [f"SYSTEME {c[:1]}" for c in codes],
+        'ATC5': codes,
+        'L_ATC5': [f"MOLECULE {c}" for c in codes],
+        'ville': villes[rng.integers(0, len(villes), n)],
+        'etablissement': [f"CH {i}" for i in rng.integers(0, 1000, n)],
+        'BOITES': rng.integers(1, 100, n),
+    })
+
+
+def test_memory_reduction():
+    """L'encodage réduit fortement la mémoire des dimensions"""
+    print("🧪 Test: Réduction mémoire...")
+    df = make_df()
+    before = df.memory_usage(deep=True).sum()
+    encoded = encode_dimensions(df.copy())
+    after = encoded.memory_usage(deep=True).sum()
+    assert isinstance(encoded['ville'].dtype, pd.CategoricalDtype)
+    assert after * 5 < before
+    print(f"✅ {before / 1024**2:.1f} Mo -> {after / 1024**2:.1f} Mo (÷{before / after:.1f})")
+
+
+def test_isin_mask_equivalence():
+    """isin_mask sur codes == Series.isin sur chaînes (y compris valeurs absentes et NaN)"""
+    print("\n🧪 Test: Filtre sur codes entiers...")
+    df = make_df()
+    encoded = encode_dimensions(df.copy())
+    for values in (['VILLE 1', 'VILLE 42'], ['INCONNUE'], ['VILLE 7', 'INCONNUE'], []):
+        expected = df['ville'].isin(values).to_numpy()
+        got = isin_mask(encoded['ville'], values)
+        assert np.array_equal(expected, got), values
+    # Évaluation sur un sous-ensemble de positions (cascade incrémentale)
+    rows = np.arange(0, len(df), 7)
+    expected = df['ville'].isin(['VILLE 1', 'VILLE 42']).to_numpy()[rows]
+    assert np.array_equal(isin_mask(encoded['ville'], ['VILLE 1', 'VILLE 42'], rows), expected)
+    assert np.array_equal(isin_mask(df['ville'], ['VILLE 1', 'VILLE 42'], rows), expected)
+    # Colonne non encodée : repli sur isin
+    assert np.array_equal(isin_mask(df['ville'], ['VILLE 1']), df['ville'].isin(['VILLE 1']).to_numpy())
+
+    start = time.perf_counter()
+    for _ in range(20):
+        df['etablissement'].isin(['CH 1', 'CH 2', 'CH 3'])
+    t_str = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(20):
+        isin_mask(encoded['etablissement'], ['CH 1', 'CH 2', 'CH 3'])
+    t_codes = time.perf_counter() - start
+    print(f"✅ Masques identiques | chaînes: {t_str * 50:.1f} ms, codes: {t_codes * 50:.1f} ms")
+
+
+def test_options_equivalence():
+    """Options distinctes identiques sur codes et sur chaînes, y compris après filtrage"""
+    print("\n🧪 Test: Options disponibles...")
+    df = make_df()
+    encoded = encode_dimensions(df.copy())
+    subset = encoded[isin_mask(encoded['atc1'], ['A'])]
+    raw_subset = df[df['atc1'] == 'A']
+
+    assert sorted(present_values(subset['ville'])) == sorted(raw_subset['ville'].dropna().unique())
+    expected_pairs = raw_subset[['ATC5', 'L_ATC5']].drop_duplicates().set_index('ATC5')['L_ATC5'].to_dict()
+    assert present_pairs(subset, 'ATC5', 'L_ATC5') == expected_pairs
+    assert all(code.startswith('A') for code in present_pairs(subset, 'ATC5', 'L_ATC5'))
+    print(f"✅ {len(expected_pairs)} couples ATC5 et {len(present_values(subset['ville']))} villes identiques")
+
+
+def legacy_convert_french_decimal(series):
+    """Ancienne implémentation (Series.apply ligne à ligne), conservée comme référence"""
+    cleaned = series.astype(str).str.strip()
+    cleaned = cleaned.replace(['', 'nan', 'NaN', 'NULL', 'null'], np.nan)
+
+    def clean_french_number(x):
+        if pd.isna(x) or x == 'nan':
+            return np.nan
+        x = str(x).strip()
+        if ',' in x:
+            parts = x.split(',')
+            if len(parts) == 2:
+                entiere = parts[0].replace('.', '')
+                decimale = parts[1]
+                return f"{entiere}.{decimale}"
+        return x.replace('.', '') if '.' in x else x
+
+    cleaned = cleaned.apply(clean_french_number)
+    return pd.to_numeric(cleaned, errors='coerce')
+
+
+def make_french_amounts(n, seed=0):
+    """Montants au format de l'export OPEN_PHMEV (336.578,01), avec vides et NULL"""
+    rng = np.random.default_rng(seed)
+    values = rng.random(n) * 10 ** rng.integers(0, 8, n)
+    text = [f"{v:,.2f}".replace(',', ' ').replace('.', ',').replace(' ', '.') for v in values]
+    for i in rng.integers(0, n, n // 50):
+        text[i] = ['', 'NULL', 'null', 'nan', '  ', None][i % 6]
+    return pd.Series(text, dtype=object)
+
+
+def test_french_decimal_correctness():
+    """Le parseur vectorisé donne exactement les mêmes valeurs que l'ancienne fonction"""
+    print("\n🧪 Test: Parseur décimal français...")
+    edge_cases = pd.Series(['336.578,01', '12,5', '1.234', '', 'NULL', 'null', 'NaN', None, np.nan,
+                            ' 7,25 ', '1,2,3', 'abc', '1,2.3', '-4,5', '0,00', '1.234.567', ',5'],
+                           dtype=object)
+    for series in (edge_cases, make_french_amounts(20_000)):
+        expected = legacy_convert_french_decimal(series)
+        got = parse_french_decimal(series)
+        pd.testing.assert_series_equal(got, expected.astype('float64'), check_names=False)
+    assert parse_french_decimal(pd.Series(['336.578,01']))[0] == 336578.01
+    # Colonne déjà numérique (Parquet) : valeurs conservées telles quelles
+    assert parse_french_decimal(pd.Series([1.5, 2.25])).tolist() == [1.5, 2.25]
+    print(f"✅ {len(edge_cases)} cas limites + 20 000 montants identiques à l'ancienne fonction")
+
+
+def test_french_decimal_throughput():
+    """📈 Benchmark de débit : vectorisé vs Series.apply"""
+    print("\n🧪 Test: Débit du parseur décimal...")
+    series = make_french_amounts(300_000)
+
+    start = time.perf_counter()
+    legacy_convert_french_decimal(series)
+    t_legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parse_french_decimal(series)
+    t_vectorized = time.perf_counter() - start
+
+    print(f"   Series.apply : {len(series) / t_legacy:,.0f} valeurs/s ({t_legacy:.2f}s)")
+    print(f"   Vectorisé    : {len(series) / t_vectorized:,.0f} valeurs/s ({t_vectorized:.2f}s)")
+    print(f"✅ Accélération x{t_legacy / t_vectorized:.1f}")
+    assert t_vectorized < t_legacy
+
+
+def test_money_cents():
+    """Centimes entiers : total exact là où la somme float64 dérive, conversions aller-retour"""
+    print("\n🧪 Test: Montants en centimes...")
+    amounts = pd.Series([0.1] * 1_000_000 + [336578.01, np.nan, -4.5])
+    cents = to_cents(amounts)
+    assert cents.dtype == 'int64' and cents.tolist()[-3:] == [33657801, 0, -450]
+    assert cents.sum() == 100_000_00 + 33657801 - 450
+
+    old_format = pd.DataFrame({'REM': [1.5, 2.25], 'BSE': [3.0, 4.0], 'cout_par_boite': [0.75, 1.125]})
+    converted = ensure_cents(old_format.copy())
+    assert converted['REM'].tolist() == [150, 225] and converted['cout_par_boite'].tolist() == [75.0, 112.5]
+    assert ensure_cents(converted) is converted and converted['BSE'].tolist() == [300, 400]
+    assert money_in_euros(converted.copy())['REM'].tolist() == [1.5, 2.25]
+    print(f"✅ Somme exacte: {cents.sum():,} centimes (float64 séquentiel: {amounts.cumsum().iloc[-1] * 100:,.6f})")
+
+
+def run_all_tests():
+    """Exécuter tous les tests du schéma compact"""
+    print("🚀 TESTS DU SCHÉMA COMPACT PHMEV")
+    print("=" * 60)
+    print(f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 60)
+
+    tests = [
+        ("Réduction mémoire", test_memory_reduction),
+        ("Filtre sur codes", test_isin_mask_equivalence),
+        ("Options disponibles", test_options_equivalence),
+        ("Décimaux français", test_french_decimal_correctness),
+        ("Débit décimaux", test_french_decimal_throughput),
+        ("Montants en centimes", test_money_cents),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            results.append((test_name, True))
+        except Exception as e:
+            print(f"❌ ERREUR dans {test_name}: {e}")
+            traceback.print_exc()
+            results.append((test_name, False))
+
+    print("\n" + "=" * 60)
+    failed = sum(1 for _, ok in results if not ok)
+    for test_name, ok in results:
+        print(f"{test_name:.<30} {'✅ PASSÉ' if ok else '❌ ÉCHOUÉ'}")
+    print(f"Total: {len(results)} tests | Réussis: {len(results) - failed} | Échoués: {failed}")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Test de la recherche PHMEV (index de trigrammes)
+Vérifie l'équivalence avec le parcours des libellés, accents et fautes de frappe, classement et latence
+"""
+
+import sys
+import os
+import time
+import traceback
+from datetime import datetime
+import numpy as np
+
+# Ajouter le répertoire courant au path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phmev_search import NarrowingSearch, TrigramIndex, normalize, prefix_distance, substring_search
+
+BRANDS = ['DOLIPRANE', 'CABOMETYX', 'KEYTRUDA', 'HUMIRA', 'OPDIVO', 'AMOXICILLINE', 'VENTOLINE', 'Ténormine']
+
+
+def make_labels(n=9_080, seed=0):
+    """Libellés au format l_cip13 (marque, dosage, conditionnement), quelques libellés très courts"""
+    rng = np.random.default_rng(seed)
+    labels = [f"{BRANDS[i % len(BRANDS)]} {rng.integers(1, 1000)}MG CPR B/{rng.integers(1, 100)}" for i in range(n)]
+    return labels + ['AB', 'X', None, float('nan')]
+
+
+def scan_search(labels, query):
+    """Référence : parcours de tous les libellés normalisés (tous les mots présents)"""
+    words = normalize(query).split()
+    return {str(l) for l in labels if isinstance(l, str) and all(w in normalize(l) for w in words)}
+
+
+def test_search_equivalence():
+    """Mêmes libellés que le parcours complet : mots courts, longs, plusieurs mots, absents"""
+    print("🧪 Test: Équivalence avec le parcours...")
+    labels = make_labels()
+    index = TrigramIndex(labels)
+    assert len(index) == len(set(l for l in labels if isinstance(l, str)))
+    queries = ['doli', 'D', 'ab', 'b/1', 'cpr b/12', 'mg doli', '  KEYTRUDA 5 ', 'ténor', 'TENOR', 'zzz', 'x']
+    for query in queries:
+        got = [index.labels[p] for p in index.positions(query)]
+        assert len(got) == len(set(got)) and set(got) == scan_search(labels, query), query
+        assert set(index.search(query)) == set(got), query
+    # Deuxième passage des mots courts : listes mémorisées, mêmes résultats
+    assert set(index.search('ab')) == scan_search(labels, 'ab')
+    assert index.search('') == index.labels
+    print(f"✅ {len(queries)} recherches identiques au parcours de {len(index)} libellés")
+
+
+def test_search_ranking():
+    """Début du libellé, puis phrase exacte, puis mots épars ; libellés proposés seulement"""
+    print("\n🧪 Test: Classement...")
+    index = TrigramIndex(['CH DE LA ROCHE', 'ROCHE CH', 'CLINIQUE ROCHE', 'CH ROCHE', 'Ch roche nord'])
+    assert index.search('ch roche') == ['CH ROCHE', 'Ch roche nord', 'CH DE LA ROCHE', 'CLINIQUE ROCHE', 'ROCHE CH']
+    assert index.search('roche', limit=2) == ['ROCHE CH', 'CH DE LA ROCHE']
+    assert index.search('roche', allowed={'CH ROCHE', 'INCONNU'}) == ['CH ROCHE']
+    # À qualité égale, le plus gros volume (REM) d'abord
+    weights = {'CLINIQUE ROCHE': 10**6, 'CH ROCHE': 10}
+    assert index.search('roche', weights=weights)[:3] == ['ROCHE CH', 'CLINIQUE ROCHE', 'CH ROCHE']
+    print("✅ Classement, volumes et restriction aux options disponibles")
+
+
+def test_accents_and_typos():
+    """Accents, casse et ponctuation ignorés ; fautes de frappe bornées, classées après les correspondances exactes"""
+    print("\n🧪 Test: Accents et fautes de frappe...")
+    assert normalize('HÔPITAL Saint-Éloi (C.H.)') == 'hopital saint eloi c h'
+    assert prefix_distance('cabomteyx', 'cabometyx', 2) == 1 and prefix_distance('cabomet', 'cabometyx', 1) == 0
+    assert prefix_distance('keytruda', 'opdivo', 2) == 3
+    index = TrigramIndex(['HÔPITAL NORD', 'Clinique de l\'Hôpital', 'CABOMETYX 20MG CPR', 'CABOMETYX 40MG CPR',
+                          'KEYTRUDA 25MG/ML SOL INJ', 'DOLIPRANE 1G CPR', 'DOLIPRANI 1G CPR', 'OPDIVO 10MG/ML'])
+    assert index.search('hopital') == ['HÔPITAL NORD', 'Clinique de l\'Hôpital']
+    assert index.search('cabometix') == ['CABOMETYX 20MG CPR', 'CABOMETYX 40MG CPR']
+    assert index.search('cabomteyx 40') == ['CABOMETYX 40MG CPR']
+    assert index.search('keytrud 25mg/ml') == ['KEYTRUDA 25MG/ML SOL INJ']
+    # Correspondance exacte : sans limite, pas de complément approximatif ; avec limite, après les exactes
+    assert index.search('doliprane') == ['DOLIPRANE 1G CPR']
+    assert index.search('doliprane', limit=10) == ['DOLIPRANE 1G CPR', 'DOLIPRANI 1G CPR']
+    assert index.search('opd') == ['OPDIVO 10MG/ML'] and index.search('opx') == [] and index.search('zzzzzz') == []
+    print("✅ hopital → HÔPITAL, cabometix → CABOMETYX")
+
+
+def test_narrowing_search():
+    """Frappe progressive : mêmes résultats qu'une recherche complète, en filtrant les précédents ; préfixes partagés"""
+    print("\n🧪 Test: Au fil de la frappe...")
+    labels = make_labels()
+    index = TrigramIndex(labels)
+    session = index.narrowing()
+    # Frappe, retour arrière, nouvelle recherche, plusieurs mots
+    typed = ['c', 'ca', 'cab', 'cabo', 'cabom', 'cabo', 'cabometyx 5', 'cabometyx 50', 'ténor', 'TENORM', '']
+    for query in typed:
+        assert session(query).tolist() == index.positions(query).tolist(), query
+    assert session.computed == 2 and session.narrowed == 7
+    # Une autre session part des préfixes courts déjà tapés
+    other = index.narrowing()
+    for query in ['ca', 'cabom', 'cabomx']:
+        assert other(query).tolist() == index.positions(query).tolist(), query
+    assert other.computed == 0 and other.narrowed == 1
+    weights = {label: i for i, label in enumerate(index.labels)}
+    assert (index.search('cabo 5', 20, weights=weights, positions=other('cabo 5'))
+            == index.search('cabo 5', 20, weights=weights))
+    # Les fautes de frappe restent calculées sur toute la liste
+    assert index.search('cabomteyx', 5, positions=other('cabomteyx')) == index.search('cabomteyx', 5)
+    # Recherche sur une liste quelconque (ex: libellés renvoyés par DuckDB)
+    calls = []
+    def compute(term):
+        calls.append(term)
+        return [label for label in BRANDS if term in label.lower()]
+    listing = NarrowingSearch(compute, lambda term, found: [label for label in found if term in label.lower()], key=str.lower)
+    assert listing('O') == ['DOLIPRANE', 'CABOMETYX', 'OPDIVO', 'AMOXICILLINE', 'VENTOLINE', 'Ténormine']
+    assert listing('Op') == ['OPDIVO'] and listing('opd') == ['OPDIVO'] and calls == ['o']
+    # Recherche d'une session DuckDB : recréée avec la connexion, préfixes partagés rangés par version des données
+    shared, session_state, queried = TrigramIndex([]).prefix_cache, {}, []
+    def search(term, conn, version):
+        def query_all(lowered):
+            queried.append((conn, lowered))
+            return [label for label in BRANDS + [conn.upper()] if lowered in label.lower()]
+        return substring_search(session_state, 'med', query_all, term, 3, conn, shared, version)
+    assert search('Ol', 'conn1', 'v1') == ['DOLIPRANE', 'VENTOLINE'] and search('oli', 'conn1', 'v1') == ['DOLIPRANE', 'VENTOLINE']
+    assert queried == [('conn1', 'ol')]
+    # Nouvelle connexion sur les mêmes données : préfixe partagé relu ; nouvelles données : nouvelles requêtes
+    assert search('ol', 'conn2', 'v1') == ['DOLIPRANE', 'VENTOLINE'] and len(queried) == 1
+    assert search('conn', 'conn2', 'v2') == ['CONN2'] and queried[-1] == ('conn2', 'conn')
+    assert search('ol', 'conn2', 'v2') == ['DOLIPRANE', 'VENTOLINE'] and queried[-1] == ('conn2', 'ol')
+    assert search('ven', 'conn2', 'v2') == ['VENTOLINE'] and search('O', 'conn2', 'v2')[:1] == ['OPDIVO']
+    print(f"✅ {len(typed)} frappes : {session.computed} calculs complets, {session.narrowed} filtrages")
+
+
+def test_search_latency():
+    """📈 Latence stable quand le nombre de libellés grandit (index vs parcours), p99 avec fautes de frappe"""
+    print("\n🧪 Test: Latence...")
+    for n in (10_000, 100_000):
+        labels = make_labels(n)
+        start = time.perf_counter()
+        index = TrigramIndex(labels)
+        t_build = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(20):
+            scan_search(labels, 'cabometyx 5')
+        t_scan = (time.perf_counter() - start) / 20
+        start = time.perf_counter()
+        for _ in range(20):
+            index.search('cabometyx 5', limit=50)
+        t_index = (time.perf_counter() - start) / 20
+        print(f"✅ {n:,} libellés | construction {t_build:.2f}s, {index.nbytes / 1024**2:.1f} Mo")
+        timings = []
+        for query in ['doli', 'cabometix', 'amoxiciline 500', 'tenormine', 'humra', 'a', 'ke', 'venolin'] * 10:
+            start = time.perf_counter()
+            index.search(query, limit=50)
+            timings.append(time.perf_counter() - start)
+        print(f"   parcours: {t_scan * 1000:.2f} ms, index: {t_index * 1000:.2f} ms, "
+              f"p99 avec fautes: {np.percentile(timings, 99) * 1000:.2f} ms")
+        # Frappe lettre à lettre : recherches indépendantes vs filtrage des résultats précédents
+        typed = ['c', 'ca', 'cab', 'cabo', 'cabom', 'cabome', 'cabomet', 'cabomety', 'cabometyx', 'cabometyx 5']
+        timings = []
+        for search in (index.positions, index.narrowing(), index.narrowing()):
+            start = time.perf_counter()
+            for query in typed:
+                search(query)
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"   frappe de {len(typed)} préfixes: indépendantes {timings[0]:.2f} ms, au fil de la frappe "
+              f"{timings[1]:.2f} ms, préfixes partagés {timings[2]:.2f} ms")
+
+
+def run_all_tests():
+    """Exécuter tous les tests de l'index de trigrammes"""
+    print("🚀 TESTS DE L'INDEX DE TRIGRAMMES PHMEV")
+    print("=" * 60)
+    print(f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 60)
+
+    tests = [
+        ("Équivalence", test_search_equivalence),
+        ("Classement", test_search_ranking),
+        ("Accents et fautes", test_accents_and_typos),
+        ("Au fil de la frappe", test_narrowing_search),
+        ("Latence", test_search_latency),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            results.append((test_name, True))
+        except Exception as e:
+            print(f"❌ ERREUR dans {test_name}: {e}")
+            traceback.print_exc()
+            results.append((test_name, False))
+
+    print("\n" + "=" * 60)
+    failed = sum(1 for _, ok in results if not ok)
+    for test_name, ok in results:
+        print(f"{test_name:.<30} {'✅ PASSÉ' if ok else '❌ ÉCHOUÉ'}")
+    print(f"Total: {len(results)} tests | Réussis: {len(results) - failed} | Échoués: {failed}")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
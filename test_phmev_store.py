@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Test du store partagé du dataset PHMEV
+Vérifie qu'une seule copie du dataset est chargée et partagée entre les sessions
+"""
+
+import sys
+import os
+import threading
+import traceback
+from datetime import datetime
+import pandas as pd
+
+# Ajouter le répertoire courant au path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from phmev_store import SharedDatasetStore, SharedDatasetError, purge_session_copies
+
+
+def make_df(n=1000):
+    return pd.DataFrame({
+        'etablissement': [f"ETB {i % 10}" for i in range(n)],
+        'BOITES': range(n),
+        'REM': [i * 1.5 for i in range(n)],
+    })
+
+
+def test_single_load_across_sessions():
+    """Le loader n'est appelé qu'une fois, même avec des sessions concurrentes"""
+    print("🧪 Test: Chargement unique partagé...")
+    store = SharedDatasetStore()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return make_df()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(store.get_or_load('phmev', loader)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert all(df is results[0] for df in results)
+    print(f"✅ 8 sessions -> 1 chargement, même objet partagé")
+
+
+def test_refuse_duplicate():
+    """Une seconde copie sous la même clé est refusée"""
+    print("\n🧪 Test: Refus de duplication...")
+    store = SharedDatasetStore()
+    df = store.publish('phmev', make_df())
+    assert store.publish('phmev', df) is df
+    try:
+        store.publish('phmev', make_df())
+    except SharedDatasetError:
+        print("✅ Seconde copie refusée")
+    else:
+        raise AssertionError("La duplication aurait dû être refusée")
+
+
+def test_memory_report_and_purge():
+    """Rapport mémoire et purge des anciennes copies en session"""
+    print("\n🧪 Test: Rapport mémoire + purge session...")
+    store = SharedDatasetStore()
+    df = store.publish('phmev', make_df())
+    report = store.memory_report()
+    assert report['datasets']['phmev']['rows'] == len(df)
+    assert report['datasets_bytes'] == int(df.memory_usage(deep=True).sum())
+    assert report['process_rss_bytes'] > 0
+
+    session_state = {'phmev_data_cached': df, 'filters': {}}
+    assert purge_session_copies(session_state) == ['phmev_data_cached']
+    assert 'phmev_data_cached' not in session_state and 'filters' in session_state
+
+    store.evict('phmev')
+    assert store.get('phmev') is None
+    print(f"✅ Dataset: {report['datasets_bytes']:,} octets | RSS: {report['process_rss_bytes'] / 1024**2:.0f} Mo")
+
+
+def test_background_loading():
+    """Chargement non bloquant : Future partagé, progression, attente sans relancer le loader"""
+    print("\n🧪 Test: Chargement en arrière-plan...")
+    store = SharedDatasetStore()
+    release = threading.Event()
+    calls = []
+
+    def loader(report):
+        calls.append(1)
+        report(0.5, "lecture")
+        release.wait(5)
+        return make_df()
+
+    future = store.start_loading('phmev', loader)
+    assert store.start_loading('phmev', loader) is future
+    assert not future.done() and store.get('phmev') is None
+    for _ in range(100):
+        if store.progress('phmev')[0] == 0.5:
+            break
+        threading.Event().wait(0.01)
+    assert store.progress('phmev') == (0.5, "lecture")
+
+    # Une vue qui a besoin des lignes attend le Future, sans second chargement
+    waiting = []
+    waiter = threading.Thread(target=lambda: waiting.append(store.get_or_load('phmev', lambda: make_df())))
+    waiter.start()
+    release.set()
+    waiter.join(5)
+    assert future.result(5) is waiting[0] is store.get('phmev')
+    assert len(calls) == 1 and store.progress('phmev')[0] == 1.0
+
+    # Échec : l'exception est portée par le Future, un nouvel appel relance le chargement
+    failing = SharedDatasetStore()
+    failed = failing.start_loading('phmev', lambda report: 1 / 0)
+    assert isinstance(failed.exception(5), ZeroDivisionError)
+    retried = failing.start_loading('phmev', lambda report: make_df())
+    assert retried is not failed and len(retried.result(5)) == 1000
+    print("✅ Future partagé, progression visible, 1 seul chargement, relance après erreur")
+
+
+def test_version_invalidation():
+    """Même version : dataset réutilisé ; nouvelle version : ancien dataset libéré et rechargé"""
+    print("\n🧪 Test: Invalidation par version...")
+    store = SharedDatasetStore()
+    first = store.start_loading('phmev', lambda report: make_df(), version='v1').result(5)
+    assert store.start_loading('phmev', lambda report: make_df(), version='v1').result(5) is first
+    assert store.version('phmev') == 'v1'
+
+    second = store.start_loading('phmev', lambda report: make_df(10), version='v2').result(5)
+    assert second is not first and len(second) == 10
+    assert store.get('phmev') is second and store.version('phmev') == 'v2'
+    print("✅ v1 réutilisée, v2 rechargée à la place de v1")
+
+
+def test_version_change_while_loading():
+    """Nouvelle version pendant le chargement de l'ancienne : rechargée aussitôt, l'ancienne ne publie rien"""
+    print("\n🧪 Test: Nouvelle version en cours de chargement...")
+    store = SharedDatasetStore()
+    release = threading.Event()
+
+    def slow_loader(report):
+        release.wait(5)
+        report(0.9, "ancienne version")
+        return make_df()
+
+    stale = store.start_loading('phmev', slow_loader, version='v1')
+    assert not stale.done() and store.version('phmev') == 'v1'
+    fresh = store.start_loading('phmev', lambda report: make_df(10), version='v2')
+    assert fresh is not stale and store.loading_future('phmev') is fresh
+    assert len(fresh.result(5)) == 10 and store.version('phmev') == 'v2'
+
+    # L'ancien chargement se termine ensuite : pas de publication par-dessus la v2
+    release.set()
+    assert len(stale.result(5)) == 1000
+    assert store.get('phmev') is fresh.result() and store.version('phmev') == 'v2'
+    assert store.start_loading('phmev', slow_loader, version='v2') is fresh
+
+    # Dataset publié sans version (get_or_load) : la version du premier start_loading est enregistrée
+    other = SharedDatasetStore()
+    df = other.get_or_load('phmev', make_df)
+    assert other.start_loading('phmev', slow_loader, version='v1').result(5) is df and other.version('phmev') == 'v1'
+    print("✅ v2 chargée sans attendre la fin de v1, v1 ignorée à la fin de son chargement")
+
+
+def run_all_tests():
+    """Exécuter tous les tests du store partagé"""
+    print("🚀 TESTS DU STORE PARTAGÉ PHMEV")
+    print("=" * 60)
+    print(f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 60)
+
+    tests = [
+        ("Chargement unique", test_single_load_across_sessions),
+        ("Refus duplication", test_refuse_duplicate),
+        ("Mémoire + purge", test_memory_report_and_purge),
+        ("Arrière-plan", test_background_loading),
+        ("Invalidation version", test_version_invalidation),
+        ("Version en cours de chargement", test_version_change_while_loading),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            results.append((test_name, True))
+        except Exception as e:
+            print(f"❌ ERREUR dans {test_name}: {e}")
+            traceback.print_exc()
+            results.append((test_name, False))
+
+    print("\n" + "=" * 60)
+    failed = sum(1 for _, ok in results if not ok)
+    for test_name, ok in results:
+        print(f"{test_name:.<30} {'✅ PASSÉ' if ok else '❌ ÉCHOUÉ'}")
+    print(f"Total: {len(results)} tests | Réussis: {len(results) - failed} | Échoués: {failed}")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
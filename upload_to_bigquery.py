@@ -1,13 +1,26 @@
 """
 🚀 Script d'upload des données PHMEV vers Google BigQuery
 Charge le fichier OPEN_PHMEV_2024.parquet vers BigQuery pour l'application Streamlit
+
+Usage : python upload_to_bigquery.py               (table historique PHMEV2024)
+        python upload_to_bigquery.py --year 2023   (partition 2023 de la table PHMEV partitionnée par année)
+        python upload_to_bigquery.py --cube [--year 2023]   (recalcule seulement le cube <table>_CUBE)
 """
 
 import pandas as pd
 from google.cloud import bigquery
 from google.oauth2 import service_account
 import os
+import sys
 from datetime import datetime
+from phmev_cube import bigquery_cube_sql, bigquery_cube_table
+from phmev_dataset import (YEAR_COLUMN, bigquery_table_version, load_year_dataframe, prepared_parquet_path,
+                           read_prepared_parquet)
+from phmev_schema import money_in_euros
+
+# Table multi-années : une partition entière par année (colonne `year`), ex: PHMEV$2023
+PARTITIONED_TABLE_ID = 'PHMEV'
+YEAR_RANGE = (2015, 2040)
 
 def upload_phmev_to_bigquery():
     """Upload des données PHMEV vers BigQuery"""
@@ -23,7 +36,7 @@ def upload_phmev_to_bigquery():
     script_dir = os.path.dirname(os.path.abspath(__file__))
     parquet_path = os.path.join(script_dir, 'OPEN_PHMEV_2024.parquet')
     
-    if not os.path.exists(parquet_path):
+    if not os.path.exists(parquet_path) and not os.path.exists(prepared_parquet_path()):
         print(f"❌ Fichier non trouvé: {parquet_path}")
         return False
     
@@ -35,6 +48,25 @@ def upload_phmev_to_bigquery():
         # Référence de la table
         table_ref = client.dataset(DATASET_ID).table(TABLE_ID)
         
+        # Configuration du job d'upload
+        job_config = bigquery.LoadJobConfig(
+            write_disposition="WRITE_TRUNCATE",  # Remplacer la table existante
+            source_format=bigquery.SourceFormat.PARQUET,
+            autodetect=True,  # Détection automatique du schéma
+            max_bad_records=1000  # Tolérer quelques erreurs
+        )
+        
+        # Fichier préparé (build_analytics_dataset.py) : déjà nettoyé et typé ; montants stockés en
+        # centimes entiers, remis en euros pour les requêtes SUM(REM) de l'application BigQuery
+        prepared_path = prepared_parquet_path()
+        if os.path.exists(prepared_path):
+            print(f"📤 Upload du fichier préparé: {prepared_path}")
+            df_prepared = money_in_euros(read_prepared_parquet(prepared_path))
+            job = client.load_table_from_dataframe(df_prepared, table_ref, job_config=job_config)
+            print("⏳ Upload en cours...")
+            job.result()
+            return _report_upload(client, table_ref, PROJECT_ID, DATASET_ID, TABLE_ID)
+        
         # Charger le fichier parquet
         print(f"📊 Chargement du fichier parquet: {parquet_path}")
         df = pd.read_parquet(parquet_path, engine='pyarrow')
@@ -67,14 +99,6 @@ def upload_phmev_to_bigquery():
             if col in df_clean.columns:
                 df_clean[col] = pd.to_numeric(df_clean[col], errors='coerce').fillna(0)
         
-        # Configuration du job d'upload
-        job_config = bigquery.LoadJobConfig(
-            write_disposition="WRITE_TRUNCATE",  # Remplacer la table existante
-            source_format=bigquery.SourceFormat.PARQUET,
-            autodetect=True,  # Détection automatique du schéma
-            max_bad_records=1000  # Tolérer quelques erreurs
-        )
-        
         print(f"📤 Upload vers BigQuery: {PROJECT_ID}.{DATASET_ID}.{TABLE_ID}")
         print(f"📊 Nombre de lignes à uploader: {len(df_clean):,}")
         
@@ -88,38 +112,115 @@ def upload_phmev_to_bigquery():
         print("⏳ Upload en cours...")
         job.result()  # Attendre la fin du job
         
-        # Vérifier le résultat
-        table = client.get_table(table_ref)
-        print(f"✅ Upload terminé avec succès!")
-        print(f"📊 Lignes dans BigQuery: {table.num_rows:,}")
-        print(f"💾 Taille de la table: {table.num_bytes / (1024*1024):.1f} MB")
-        
-        # Test de requête simple
-        print("🧪 Test de requête...")
-        test_query = f"""
-        SELECT COUNT(*) as total_rows,
-               COUNT(DISTINCT nom_etb) as unique_etablissements,
-               COUNT(DISTINCT L_ATC5) as unique_medicaments,
-               SUM(REM) as total_remboursement
-        FROM `{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}`
-        LIMIT 1
-        """
+        return _report_upload(client, table_ref, PROJECT_ID, DATASET_ID, TABLE_ID)
         
-        result = client.query(test_query).to_dataframe()
-        print("📊 Statistiques de la table:")
-        print(f"   - Lignes totales: {result['total_rows'].iloc[0]:,}")
-        print(f"   - Établissements uniques: {result['unique_etablissements'].iloc[0]:,}")
-        print(f"   - Médicaments uniques: {result['unique_medicaments'].iloc[0]:,}")
-        print(f"   - Remboursement total: {result['total_remboursement'].iloc[0]:,.2f}€")
+    except Exception as e:
+        print(f"❌ Erreur lors de l'upload: {e}")
+        print(f"🔍 Type d'erreur: {type(e).__name__}")
+        return False
+
+def upload_phmev_year_to_bigquery(year):
+    """📅 Remplace la partition `year` de la table PHMEV (partitionnée par année) par le fichier préparé"""
+    
+    print(f"🚀 Début de l'upload PHMEV {year} vers BigQuery...")
+    
+    PROJECT_ID = 'test-db-473321'
+    DATASET_ID = 'dataset'
+    
+    try:
+        # Partition OPEN_PHMEV/year=YYYY/ (build_analytics_dataset.py --year), ou fichier historique pour 2024
+        df = money_in_euros(load_year_dataframe(year))
+        df[YEAR_COLUMN] = int(year)
+        print(f"✅ Fichier chargé: {len(df):,} lignes, {len(df.columns)} colonnes")
         
-        print("🎉 Upload PHMEV vers BigQuery terminé avec succès!")
-        return True
+        print("🔗 Connexion à BigQuery...")
+        client = bigquery.Client(project=PROJECT_ID)
+        table_ref = client.dataset(DATASET_ID).table(PARTITIONED_TABLE_ID)
+        
+        # Partitionnement entier sur `year` : un filtre d'année ne lit que les partitions concernées
+        job_config = bigquery.LoadJobConfig(
+            write_disposition="WRITE_TRUNCATE",  # Remplace uniquement la partition visée
+            range_partitioning=bigquery.RangePartitioning(
+                field=YEAR_COLUMN,
+                range_=bigquery.PartitionRange(start=YEAR_RANGE[0], end=YEAR_RANGE[1], interval=1),
+            ),
+        )
         
+        print(f"📤 Upload vers BigQuery: {PROJECT_ID}.{DATASET_ID}.{PARTITIONED_TABLE_ID}${year}")
+        job = client.load_table_from_dataframe(
+            df,
+            client.dataset(DATASET_ID).table(f"{PARTITIONED_TABLE_ID}${int(year)}"),
+            job_config=job_config
+        )
+        print("⏳ Upload en cours...")
+        job.result()
+        
+        return _report_upload(client, table_ref, PROJECT_ID, DATASET_ID, PARTITIONED_TABLE_ID)
+        
+    except FileNotFoundError as e:
+        print(f"❌ {e}")
+        return False
     except Exception as e:
         print(f"❌ Erreur lors de l'upload: {e}")
         print(f"🔍 Type d'erreur: {type(e).__name__}")
         return False
 
+def _report_upload(client, table_ref, project_id, dataset_id, table_id):
+    """Vérifie la table chargée et affiche quelques statistiques"""
+    # Vérifier le résultat
+    table = client.get_table(table_ref)
+    print(f"✅ Upload terminé avec succès!")
+    print(f"📊 Lignes dans BigQuery: {table.num_rows:,}")
+    print(f"💾 Taille de la table: {table.num_bytes / (1024*1024):.1f} MB")
+    
+    # Test de requête simple
+    print("🧪 Test de requête...")
+    test_query = f"""
+    SELECT COUNT(*) as total_rows,
+           COUNT(DISTINCT nom_etb) as unique_etablissements,
+           COUNT(DISTINCT L_ATC5) as unique_medicaments,
+           SUM(REM) as total_remboursement
+    FROM `{project_id}.{dataset_id}.{table_id}`
+    LIMIT 1
+    """
+    
+    result = client.query(test_query).to_dataframe()
+    print("📊 Statistiques de la table:")
+    print(f"   - Lignes totales: {result['total_rows'].iloc[0]:,}")
+    print(f"   - Établissements uniques: {result['unique_etablissements'].iloc[0]:,}")
+    print(f"   - Médicaments uniques: {result['unique_medicaments'].iloc[0]:,}")
+    print(f"   - Remboursement total: {result['total_remboursement'].iloc[0]:,.2f}€")
+    
+    print("🎉 Upload PHMEV vers BigQuery terminé avec succès!")
+    return True
+
+def create_bigquery_cube(table_id='PHMEV2024', partitioned=False):
+    """🧊 Matérialise le cube (établissement × CIP13) d'une table PHMEV dans <table>_CUBE
+
+    Sommes BOITES/REM/BSE et nombre de lignes par cellule ; la description porte la version de la table
+    source, l'application n'interroge le cube que s'il correspond aux données chargées.
+    """
+    
+    print(f"🧊 Construction du cube de {table_id}...")
+    
+    PROJECT_ID = 'test-db-473321'
+    DATASET_ID = 'dataset'
+    
+    try:
+        client = bigquery.Client(project=PROJECT_ID)
+        source_id = f"{PROJECT_ID}.{DATASET_ID}.{table_id}"
+        source = client.get_table(source_id)
+        client.query(bigquery_cube_sql(source_id, bigquery_table_version(source), partitioned, YEAR_RANGE)).result()
+        
+        cube = client.get_table(bigquery_cube_table(source_id))
+        print(f"✅ Cube {cube.table_id}: {cube.num_rows:,} cellules pour {source.num_rows:,} lignes "
+              f"(÷{source.num_rows / max(cube.num_rows, 1):,.1f}), {cube.num_bytes / (1024*1024):.1f} MB")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur lors de la création du cube: {e}")
+        return False
+
 def create_bigquery_views():
     """Crée des vues optimisées dans BigQuery"""
     
@@ -191,11 +292,26 @@ if __name__ == "__main__":
     print("🏥 PHMEV Analytics Pro - Upload BigQuery")
     print("=" * 50)
     
+    # --cube : cube de la table existante seulement (après un upload fait sans lui)
+    if '--cube' in sys.argv:
+        if '--year' in sys.argv:
+            sys.exit(0 if create_bigquery_cube(PARTITIONED_TABLE_ID, partitioned=True) else 1)
+        sys.exit(0 if create_bigquery_cube() else 1)
+    
+    # --year YYYY : partition annuelle de la table PHMEV (les vues restent sur PHMEV2024)
+    if '--year' in sys.argv:
+        year = int(sys.argv[sys.argv.index('--year') + 1])
+        success = upload_phmev_year_to_bigquery(year) and create_bigquery_cube(PARTITIONED_TABLE_ID, partitioned=True)
+        sys.exit(0 if success else 1)
+    
     # Étape 1: Upload des données
     success = upload_phmev_to_bigquery()
     
     if success:
-        # Étape 2: Création des vues optimisées
+        # Étape 2: Cube pré-agrégé lu par les KPIs et les tops de l'application
+        create_bigquery_cube()
+        
+        # Étape 3: Création des vues optimisées
         create_bigquery_views()
         
         print("\n🎉 Configuration BigQuery terminée!")